@@ -17,7 +17,6 @@
 
 # Can Specific python libs
 import can
-import cantools
 import isotp
 
 # Common python libs
@@ -25,9 +24,41 @@ import time
 import datetime as dt
 import binascii
 import os
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+# Robot Framework
+from robot.api import logger as robot_logger
+from robot.libraries.BuiltIn import BuiltIn, RobotNotRunningError
 
 # Libs created for this project
-from averagetime import AverageTime
+from buspool import bus_pool
+from bytepattern import compile_pattern
+from dbcache import database_cache
+from dbindex import DatabaseIndex
+from diagsession import DiagSession, add_constants, get_key_algorithm
+from dtcdecoder import DtcRecords
+from flashdownload import FlashDownload
+from framedispatcher import frame_key, message_key, parse_frame_id
+from framereplay import hex_to_bytes, load_frames, send_frames
+from gatewaylatency import GatewayLatency, parse_routes
+from isotplink import IsotpLink
+from metrics import KeywordTimer, metrics
+from offlinedispatcher import OfflineDispatcher, read_log, read_segment
+from periodstats import PeriodStats
+from sequencecheck import SequenceCheck, parse_step
+from signalcapture import SignalCapture
+from signalhistory import SignalHistory, numeric, same_value
+from simulatedecu import SimulatedEcu, default_key
+
+# State of the channel used by the keywords, switched by
+# select_can_channel()
+CHANNEL_ATTRIBUTES = ("interface", "channel", "bitrate", "db_file", "fd",
+                      "session", "bus", "dispatcher", "bus_notifier",
+                      "logbus", "db", "db_index", "db_default_node",
+                      "signal_history", "logger", "notifier", "is_set",
+                      "is_isotp",
+                      "isotp_link", "isotp_addr", "isotp_stack", "ecu_name")
 
 
 class Curf:
@@ -37,6 +68,11 @@ class Curf:
         """
         self.is_set = False
         self.is_isotp = False
+        # State of each channel by alias
+        self.channels = {}
+        self.channel_alias = None
+        # Duration of every keyword in the metrics
+        self.ROBOT_LIBRARY_LISTENER = KeywordTimer()
         self.statusOfDTCbits = {"0": "testFailed",
                                 "1": "testFailedThisMonitoringCycle",
                                 "2": "pendingDTC",
@@ -78,30 +114,53 @@ class Curf:
         raise AssertionError('Curf error happened : %s - %s' %
                              (error.__class__.__name__, str(error)))
 
-    def set_can(self, interface, channel, bitrate, db=None, test_name=None):
+    def set_can(self, interface, channel, bitrate, db=None, test_name=None,
+                fd=False, data_bitrate=None, alias='default'):
         """ Set the CAN BUS
+        Several channels can be set, each one with its alias. The last
+        channel set is the one used by the keywords, see
+        select_can_channel().
         Keyword arguments:
         interface -- can interface (socketcan, vector, ...)
         channel -- can channel (can0, vcan0, ...)
         bitrate -- can bitrate (125000, 500000, ...)
         db -- can database (arxml,dbc,kcd,sym,cdd)
         test_name -- Name of test case
+        fd -- True to open the bus in CAN FD mode (default False)
+        data_bitrate -- CAN FD data phase bitrate (2000000, ...)
+        alias -- Name of the channel (default default)
 
         See https://cantools.readthedocs.io/en/latest/#about
         See https://python-can.readthedocs.io/en/master/interfaces.html
         """
         dt_now = dt.datetime.now()
+        self._new_channel(alias)
         self.interface = interface
         self.channel = channel
         self.bitrate = bitrate
         self.db_file = db
-        self.bus = can.interface.Bus(
-            bustype=self.interface, channel=self.channel, bitrate=self.bitrate)
-        self.logbus = can.ThreadSafeBus(
-            interface=self.interface, channel=self.channel)
+        self.fd = str(fd) in ('True', 'true', '1')
+        if data_bitrate is not None and data_bitrate != 'None':
+            data_bitrate = int(data_bitrate)
+        else:
+            data_bitrate = None
+        # Bus handles are reused from the previous test cases
+        self.session = bus_pool.acquire(
+            self.interface, self.channel, self.bitrate, self.fd, data_bitrate)
+        self.bus = self.session.bus
+        self.dispatcher = self.session.dispatcher
+        self.dispatcher.clear()
+        # Each test sends the initial values of its own database
+        self.session.signal_state.reset()
+        self.signal_history = self.session.signal_history
+        self.bus_notifier = self.session.notifier
+        self.logbus = self.session.logbus
         if db is not None and db != 'None':
-            self.db = cantools.database.load_file(db)
+            self.db, self.db_index = database_cache.load(db)
             self.db_default_node = self.db.nodes[0].name
+            duplicates = self.db_index.get_duplicates_report()
+            if duplicates is not None:
+                metrics.log("INFO", duplicates)
         path = os.getcwd()
         path = path + "/outputs/" + ("%d%02d%02d/" % (dt_now.year,
                                                                     dt_now.month,
@@ -110,42 +169,331 @@ class Curf:
             os.mkdir(path)
         except FileExistsError:
             pass
-        output_candump_filename = path + ("%s_%d%02d%02d_%02d%02d%02d" % (test_name,
+        output_candump_filename = ("%s_%d%02d%02d_%02d%02d%02d" % (self.channel,
                                                                     dt_now.year,
                                                                     dt_now.month,
                                                                     dt_now.day,
                                                                     dt_now.hour,
                                                                     dt_now.minute,
                                                                     dt_now.second))
-        self.logger = can.Logger(output_candump_filename)
-        self.notifier = can.Notifier(self.logbus, [self.logger])
+        # The log of the session is shared by the test cases, each test
+        # is a segment of it
+        self.logger = self.session.open_log(path, output_candump_filename,
+                                            **bus_pool.log_config)
+        self.logger.start_segment(test_name)
+        self.notifier = self.session.log_notifier
+        self.is_set = True
+        self._save_channel()
+
+    def set_can_log_file(self, log_file, db=None, test_name=None,
+                         alias='default'):
+        """ Run the check keywords against a recorded log instead of a bus
+        Frames are streamed from the file as the checks wait for them and
+        timeouts elapse in log time.
+        Keyword arguments:
+        log_file -- log file readable by python-can (blf, asc, ...), or
+                    <base_name>_index.json of a LogWriter log
+        db -- can database (arxml,dbc,kcd,sym,cdd)
+        test_name -- with an index file, the test case to read
+        alias -- Name of the channel (default default)
+        """
+        self._new_channel(alias)
+        if log_file.endswith("_index.json"):
+            frames = read_segment(log_file, test_name)
+        else:
+            if not os.path.exists(log_file):
+                raise AssertionError("Log file not found: %s" % (log_file))
+            frames = read_log(log_file)
+        self.session = None
+        self.bus = None
+        self.logger = None
+        self.dispatcher = OfflineDispatcher(frames)
+        self.signal_history = SignalHistory(self.dispatcher)
+        if db is not None and db != 'None':
+            self.db, self.db_index = database_cache.load(db)
+            self.db_default_node = self.db.nodes[0].name
         self.is_set = True
+        self._save_channel()
+
+    def _new_channel(self, alias):
+        """ Keep the current channel and start the channel alias
+        """
+        self._save_channel()
+        self.channel_alias = alias
+        state = self.channels.get(alias, {})
+        for name in CHANNEL_ATTRIBUTES:
+            setattr(self, name, state.get(name))
+        self.is_isotp = bool(self.is_isotp)
+
+    def _save_channel(self):
+        if self.channel_alias is not None:
+            self.channels[self.channel_alias] = {
+                name: getattr(self, name, None)
+                for name in CHANNEL_ATTRIBUTES}
+
+    def select_can_channel(self, alias):
+        """ Use the channel alias for the next keywords
+        Keyword argument:
+        alias -- Name given to set_can()
+        """
+        if alias == self.channel_alias:
+            return
+        if alias not in self.channels:
+            raise AssertionError("CAN channel %s is not set, known "
+                                 "channels: %s" %
+                                 (alias, ", ".join(self.channels)))
+        self._save_channel()
+        self.channel_alias = alias
+        for name, value in self.channels[alias].items():
+            setattr(self, name, value)
+
+    def _use_channel(self, alias):
+        """ Select the channel alias if one is given
+        """
+        if alias is not None and alias != 'None':
+            self.select_can_channel(alias)
+
+    def measure_gateway_latency(self, source_channel, target_channel,
+                                duration, *routes, budget=None,
+                                max_latency=1):
+        """ Measure the latency of the frames routed by a gateway
+        The frames of both channels are read during duration and each
+        source frame is matched with the next frame of its route on the
+        target channel, using the reception timestamps.
+        Return the latency report in second of each route.
+        Keyword arguments:
+        source_channel -- alias of the channel the frames are sent on
+        target_channel -- alias of the channel they are routed to
+        duration -- measure time in second
+        routes -- IDs in hexadecimal, "123" for a frame routed with the
+                  same ID, "123:456" for a translated ID (default every
+                  message of the source channel database), one route
+                  per target ID
+        budget -- maximum latency in second, fail if a frame is routed
+                  later or lost (default no check)
+        max_latency -- a frame not routed after this time in second is
+                       lost (default 1)
+        """
+        self._save_channel()
+        channels = []
+        for alias in (source_channel, target_channel):
+            state = self.channels.get(alias)
+            if state is None or state["session"] is None:
+                raise AssertionError("CAN channel %s is not set to a bus" %
+                                     (alias))
+            channels.append(state)
+        if routes:
+            targets = parse_routes(routes)
+        elif channels[0]["db"] is not None:
+            targets = {message_key(message): message_key(message)
+                       for message in channels[0]["db"].messages}
+        else:
+            raise AssertionError("No route given and no database for %s" %
+                                 (source_channel))
+        latency = GatewayLatency(targets, max_latency)
+        end_time = time.monotonic() + float(duration)
+        with channels[0]["dispatcher"].subscribe(ids=targets.keys()) \
+                as sources, \
+                channels[1]["dispatcher"].subscribe(
+                    ids=targets.values()) as routed:
+            while time.monotonic() < end_time:
+                received = False
+                for frames, put in ((sources, latency.put_source),
+                                    (routed, latency.put_target)):
+                    received_frame = frames.get(0)
+                    while received_frame is not None:
+                        received = True
+                        put(received_frame)
+                        received_frame = frames.get(0)
+                if not received:
+                    routed.wait(min(0.005, max(0.0,
+                                               end_time - time.monotonic())))
+        report = latency.get_report()
+        metrics.log("INFO", report)
+        if budget is not None and budget != 'None':
+            late = ["%s (max %.6f s, %d lost)" %
+                    (name, route["max"] or 0.0, route["lost"])
+                    for name, route in report.items()
+                    if route["lost"] or (route["max"] is not None and
+                                         route["max"] > float(budget))]
+            if late:
+                raise AssertionError("Gateway latency over %s s: %s" %
+                                     (budget, ", ".join(late)))
+        return report
+
+    def set_can_log(self, log_format='blf', max_size_mb=100, max_minutes=0):
+        """ Set the CAN log of the buses opened afterwards
+        Must be called before set_can()
+        Keyword arguments:
+        log_format -- log file format (blf, asc.gz, log.gz, asc, ...)
+                      (default blf)
+        max_size_mb -- rotate the file at this uncompressed size in MB,
+                       0 to disable (default 100)
+        max_minutes -- rotate the file after this time in minutes,
+                       0 to disable (default 0)
+        """
+        bus_pool.log_config = {
+            "log_format": log_format,
+            "max_bytes": int(float(max_size_mb) * 1024 * 1024),
+            "max_seconds": float(max_minutes) * 60}
+
+    def get_database_cache_stats(self):
+        """ Return the hit and miss counters of the database cache
+        """
+        return database_cache.get_stats()
+
+    def set_database_disk_cache(self, enabled=True):
+        """ Enable or disable the pickled databases in outputs/dbcache
+        The disk cache is disabled unless the CURF_DB_CACHE_DIR
+        environment variable gives its directory.
+        Keyword argument:
+        enabled -- True to enable the disk cache (default True)
+        """
+        if str(enabled) in ('True', 'true', '1'):
+            database_cache.cache_dir = os.path.join(
+                os.getcwd(), "outputs", "dbcache")
+        else:
+            database_cache.cache_dir = None
 
     def end_can(self):
-        """ Stop the CAN BUS
+        """ Stop the CAN BUS log of every channel, the buses stay open for
+        the next test
+        """
+        self._save_channel()
+        for state in self.channels.values():
+            if state["logger"] is not None:
+                self._end_log(state["session"], state["logger"])
+
+    @staticmethod
+    def _end_log(session, logger):
+        # The next test starts without acceptance filter
+        session.acceptance_filter.disable()
+        segment = logger.end_segment()
+        if segment is None:
+            return
+        robot_logger.info("CAN log: %d frames in %s" %
+                          (segment["frames"],
+                           ", ".join(part["file"]
+                                     for part in segment["parts"])))
+        if segment["dropped"]:
+            robot_logger.warn("CAN log: %d frames dropped by the log writer"
+                              % (segment["dropped"]))
+
+    def set_can_acceptance_filters(self, *ids):
+        """ Read only the frames the test waits for until end_can()
+        The IDs of the ISO-TP links and the IDs given are accepted, then
+        the IDs of the messages and frames checked are added as the checks
+        start. A frame arriving before its ID is expected is dropped, so
+        give the IDs answered right after a request.
+        socketcan and the interfaces filtering in the driver drop the
+        other frames before Python, the others in the frame dispatcher.
+        The traffic log still records every frame.
+        Keyword argument:
+        ids -- arbitration IDs in hexadecimal, 8 digits for an extended
+               one (00000123, see parse_frame_id, default none)
+        """
+        accepted = {parse_frame_id(frame_id) for frame_id in ids}
+        accepted.update(frame_key(link.address.get_rx_arbitration_id(),
+                                  link.address.is_rx_29bits())
+                        for link in self.session.isotp_links.values())
+        self.session.acceptance_filter.enable(accepted)
+        metrics.log("INFO", self.session.acceptance_filter.get_report())
+
+    def clear_can_acceptance_filters(self):
+        """ Read every frame again and restore the filters of the bus
+        """
+        self.session.acceptance_filter.disable()
+
+    def get_can_acceptance_filters(self):
+        """ Return the state of the acceptance filter of the bus
+        """
+        return self.session.acceptance_filter.get_report()
+
+    def _expect_ids(self, ids):
+        """ Add the keys of some IDs (see frame_key()) to the acceptance
+        filter, if enabled
+        """
+        if self.session is not None:
+            self.session.acceptance_filter.expect(ids)
+
+    def release_can_buses(self):
+        """ Close every CAN BUS opened by the library (suite teardown)
+        The metrics are written first
         """
-        self.notifier.remove_listener(self.logger)
-        self.logger.stop()
+        if bus_pool.sessions:
+            self.write_can_metrics()
+        bus_pool.close_all()
+        self.is_isotp = False
+
+    def set_curf_log_level(self, level='INFO'):
+        """ Set the lowest level of the messages printed by the keywords
+        Keyword argument:
+        level -- TRACE, DEBUG (frames and payloads), INFO (reports),
+                 WARN or NONE (default INFO)
+        """
+        metrics.set_level(level)
+
+    def get_can_metrics(self):
+        """ Return the keyword latencies, the ISO-TP round trip times, the
+        counters and for each open bus its frame rates, bus load and queue
+        depths
+        """
+        report = metrics.get_report()
+        report["buses"] = {"%s %s" % session.key[:2]: session.get_metrics()
+                           for session in list(bus_pool.sessions.values())}
+        return report
+
+    def reset_can_metrics(self):
+        """ Forget the keyword latencies, round trip times and counters
+        """
+        metrics.reset()
+
+    def write_can_metrics(self, path=None):
+        """ Write the metrics as JSON and add them to the Robot log
+        Return the path of the file
+        Keyword argument:
+        path -- JSON file (default outputs/YYYYMMDD/metrics_HHMMSS.json)
+        """
+        if path is None:
+            dt_now = dt.datetime.now()
+            directory = os.path.join(os.getcwd(), "outputs",
+                                     dt_now.strftime("%Y%m%d"))
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory,
+                                dt_now.strftime("metrics_%H%M%S.json"))
+        report = self.get_can_metrics()
+        with open(path, "w") as metrics_file:
+            json.dump(report, metrics_file, indent=1)
+        robot_logger.info("CAN metrics written to %s\n%s" %
+                          (path, json.dumps(report, indent=1)))
+        return path
 
     def get_message_name_by_signal(self, signal_name):
         """ Search message_name in Database by signal
         Keyword argument:
         signal_name -- The signal name for whom to search for the message
+                       (SIGNAL or MESSAGE.SIGNAL)
         """
-        is_in_db = False
-        for message in self.db.messages:
-            for signal in message.signals:
-                if signal_name == signal.name:
-                    msg_name = message.name
-                    is_in_db = True
-                    return msg_name
-        if not(is_in_db):
+        message = self.db_index.message_by_signal(signal_name)
+        if message is None:
             return None
+        return message.name
 
-    def get_next_raw_can(self):
+    def get_next_raw_can(self, channel=None):
         """ Return the next received Can Frame
+        Keyword argument:
+        channel -- alias of the CAN channel (default the selected one)
         """
-        return self.bus.recv(3)
+        self._use_channel(channel)
+        return self.dispatcher.next(3)
+
+    def clear_can_buffers(self, channel=None):
+        """ Forget every received and unread Can Frame
+        Keyword argument:
+        channel -- alias of the CAN channel (default the selected one)
+        """
+        self._use_channel(channel)
+        self.dispatcher.clear()
 
     def get_can_config(self):
         """ Return the CAN configuration
@@ -158,102 +506,378 @@ class Curf:
         return self.bus.state
 
     def set_isotp(self, source, destination,
-                  addr_mode='Normal_29bits', test_name=None):
+                  addr_mode='Normal_29bits', test_name=None,
+                  ecu_name='default', channel=None):
         """ Set ISO-TP protocol
+        Several ECUs can be set on the same bus, each one with its name.
+        The last ECU set is the one used by the diagnostic keywords.
         Keyword Argument:
         source -- Sender address
         destination -- Receiver address
         addr_mode -- Adressing mode (default Normal_29bits)
+        ecu_name -- Name of the ECU (default default)
+        channel -- alias of the CAN channel (default the selected one)
+        """
+        self._use_channel(channel)
+        self.isotp_addr = self._make_isotp_address(
+            source, destination, addr_mode)
+        isotp_key = (source, destination, addr_mode)
+        link = self.session.isotp_links.get(ecu_name)
+        if link is None or link.key != isotp_key:
+            # The link of a previous test is reused if the address matches
+            self.session.close_isotp(ecu_name)
+            params = None
+            if self.session.fd:
+                # 64 bytes frames, with the data phase bitrate if any
+                params = {"can_fd": True, "tx_data_length": 64,
+                          "bitrate_switch":
+                              self.session.data_bitrate is not None}
+            link = IsotpLink(self.bus, self.dispatcher, self.isotp_addr,
+                             error_handler=self.curf_error_handler,
+                             params=params)
+            link.key = isotp_key
+            link.start()
+            self.session.isotp_links[ecu_name] = link
+            self.session.diag_sessions[ecu_name] = DiagSession(link)
+            self._expect_ids([frame_key(
+                self.isotp_addr.get_rx_arbitration_id(),
+                self.isotp_addr.is_rx_29bits())])
+        link.clear()
+        self.select_ecu(ecu_name)
+
+    def select_ecu(self, ecu_name, channel=None):
+        """ Use the ISO-TP link of an ECU for the diagnostic keywords
+        Keyword Argument:
+        ecu_name -- Name given to set_isotp()
+        channel -- alias of the CAN channel (default the selected one)
         """
+        self._use_channel(channel)
+        link = self.session.isotp_links.get(ecu_name)
+        if link is None:
+            raise AssertionError("ECU %s is not set, known ECUs: %s"
+                                 % (ecu_name,
+                                    ", ".join(self.session.isotp_links)))
+        self.ecu_name = ecu_name
+        self.isotp_link = link
+        self.isotp_addr = link.address
+        self.isotp_stack = link.stack
+        self.is_isotp = True
+
+    def set_isotp_parameters(self, **params):
+        """ Change the ISO-TP parameters of the selected ECU
+        The link keeps them for the next test cases.
+        Keyword arguments (see the can-isotp documentation):
+        stmin -- minimum separation time asked to the ECU in ms
+        blocksize -- number of consecutive frames between flow controls
+        wftmax -- maximum number of wait flow controls
+        tx_padding -- padding byte of the sent frames, None to disable
+        rx_flowcontrol_timeout -- flow control timeout in ms
+        rx_consecutive_frame_timeout -- consecutive frame timeout in ms
+        tx_data_length -- CAN frame size: 8, 12, ... 64
+        can_fd -- True to send CAN FD frames
+        bitrate_switch -- True to send at the data phase bitrate
+        """
+        self.isotp_link.set_params(
+            {name: self._parse_isotp_value(value)
+             for name, value in params.items()})
+        metrics.log("INFO", self.isotp_link.get_params())
+
+    def get_isotp_parameters(self):
+        """ Return the ISO-TP parameters of the selected ECU
+        """
+        return self.isotp_link.get_params()
+
+    @staticmethod
+    def _parse_isotp_value(value):
+        """ Return the python value of a parameter given by Robot
+        """
+        if not isinstance(value, str):
+            return value
+        if value in ('None', 'none', ''):
+            return None
+        if value in ('True', 'true'):
+            return True
+        if value in ('False', 'false'):
+            return False
+        if value[:2] in ('0x', '0X'):
+            return int(value, 16)
+        try:
+            return int(value)
+        except ValueError:
+            return float(value)
+
+    def measure_isotp_throughput(self, payload_size=4095, repetitions=10,
+                                 request_prefix='', wait_response=False,
+                                 timeout=1):
+        """ Measure the ISO-TP throughput of the selected ECU link
+        Send repetitions PDUs of payload_size bytes with the current
+        parameters and return the payload rate in bytes/s.
+        Keyword arguments:
+        payload_size -- size of each PDU in bytes, prefix included
+                        (default 4095)
+        repetitions -- number of PDUs (default 10)
+        request_prefix -- first bytes of each PDU in hexadecimal (a
+                          service and its parameters, default none)
+        wait_response -- True to wait for the response of each PDU, its
+                         size is then counted (default False)
+        timeout -- time to wait for each response in second
+        """
+        prefix = bytes.fromhex(request_prefix)
+        payload_size = int(payload_size)
+        data = prefix + bytes(max(0, payload_size - len(prefix)))
+        wait_response = str(wait_response) in ('True', 'true', '1')
+        sent = 0
+        received = 0
+        self.isotp_link.clear()
+        start = time.perf_counter()
+        for _ in range(int(repetitions)):
+            self.isotp_link.send(data)
+            sent += len(data)
+            if wait_response:
+                response = self.isotp_link.wait_response(float(timeout))
+                if response is None:
+                    raise AssertionError("No ISO-TP response in timeout")
+                received += len(response)
+        duration = time.perf_counter() - start
+        report = {"sent_bytes": sent,
+                  "received_bytes": received,
+                  "duration": duration,
+                  "bytes_per_second":
+                      (sent + received) / duration if duration > 0 else 0.0,
+                  "params": self.isotp_link.get_params()}
+        metrics.log("INFO", report)
+        robot_logger.info("ISO-TP throughput: %.0f bytes/s" %
+                          (report["bytes_per_second"]))
+        return report
+
+    def start_simulated_ecu(self, source, destination,
+                            addr_mode='Normal_29bits', ecu_name='default',
+                            key_constant='0', s3_timeout=5):
+        """ Start a simulated ECU answering the diagnostic requests
+        The ECU runs in a thread on its own bus of the channel set by
+        set_can(), so a test can run without hardware on the virtual
+        interface. It is stopped by stop_simulated_ecu() or when the bus
+        is released.
+        Keyword arguments:
+        source -- Sender address, as given to set_isotp()
+        destination -- Receiver address, as given to set_isotp()
+        addr_mode -- Adressing mode (default Normal_29bits)
+        ecu_name -- Name of the simulated ECU (default default)
+        key_constant -- SecurityAccess key is the seed plus this
+                        hexadecimal constant (default 0)
+        s3_timeout -- time in second without request after which the ECU
+                      goes back to the default session (default 5)
+        """
+        self.session.stop_simulated_ecu(ecu_name)
+        address = self._make_isotp_address(destination, source, addr_mode,
+                                           ecu_side=True)
+        params = None
+        if self.session.fd:
+            params = {"can_fd": True, "tx_data_length": 64,
+                      "bitrate_switch": self.session.data_bitrate is not None}
+        constant = int(key_constant, 16)
+        ecu = SimulatedEcu(self.session.open_bus(), address, params=params,
+                           key_function=lambda seed, level:
+                               default_key(seed, constant),
+                           s3_timeout=float(s3_timeout))
+        ecu.start()
+        self.session.simulated_ecus[ecu_name] = ecu
+
+    def _get_simulated_ecu(self, ecu_name):
+        ecu = self.session.simulated_ecus.get(ecu_name)
+        if ecu is None:
+            raise AssertionError("Simulated ECU %s is not started" %
+                                 (ecu_name))
+        return ecu
+
+    def set_simulated_ecu_response(self, request, response,
+                                   ecu_name='default'):
+        """ Answer the requests starting with request by response
+        Keyword arguments:
+        request -- request prefix in hexadecimal (e.g. 22F190)
+        response -- response in hexadecimal, None for no response
+        ecu_name -- Name of the simulated ECU (default default)
+        """
+        self._get_simulated_ecu(ecu_name).set_response(
+            bytes.fromhex(request),
+            None if response in (None, 'None') else bytes.fromhex(response))
+
+    def set_simulated_ecu_did(self, did, value, ecu_name='default'):
+        """ Set the value of a DID read by ReadDataByIdentifier
+        Keyword arguments:
+        did -- DID in hexadecimal (e.g. F190)
+        value -- value in hexadecimal
+        ecu_name -- Name of the simulated ECU (default default)
+        """
+        self._get_simulated_ecu(ecu_name).set_did(int(did, 16),
+                                                  bytes.fromhex(value))
+
+    def set_simulated_ecu_dtc(self, dtc, status, ecu_name='default'):
+        """ Set the status of a DTC read by ReadDTCInformation
+        Keyword arguments:
+        dtc -- DTC in hexadecimal on 3 bytes (e.g. 012345)
+        status -- status byte in hexadecimal (e.g. 09)
+        ecu_name -- Name of the simulated ECU (default default)
+        """
+        self._get_simulated_ecu(ecu_name).set_dtc(int(dtc, 16),
+                                                  int(status, 16))
+
+    def set_simulated_ecu_pending(self, service, delay, ecu_name='default'):
+        """ Answer a service by NRCs 0x78 (response pending) during delay
+        Keyword arguments:
+        service -- service in hexadecimal (e.g. 31)
+        delay -- time before the response in second, 0 to disable
+        ecu_name -- Name of the simulated ECU (default default)
+        """
+        self._get_simulated_ecu(ecu_name).set_pending(int(service, 16),
+                                                      float(delay))
+
+    def get_simulated_ecu_stats(self, ecu_name='default'):
+        """ Return the request and response counters of a simulated ECU
+        """
+        return self._get_simulated_ecu(ecu_name).get_stats()
+
+    def stop_simulated_ecu(self, ecu_name=None):
+        """ Stop a simulated ECU (default every simulated ECU of the bus)
+        """
+        self.session.stop_simulated_ecu(ecu_name)
+
+    @staticmethod
+    def _make_isotp_address(source, destination, addr_mode, ecu_side=False):
+        """ Return the isotp.Address of an addressing mode
+        ecu_side swaps the extended addresses for the ECU end of the link
+        """
+        tester_address, ecu_address = 0x55, 0xAA
+        if ecu_side:
+            tester_address, ecu_address = ecu_address, tester_address
         if addr_mode == 'Normal_29bits':
-            self.isotp_addr = isotp.Address(
+            return isotp.Address(
                 isotp.AddressingMode.Normal_29bits,
                 rxid=int(destination, 16),
                 txid=int(source, 16))
         elif addr_mode == 'Normal_11bits':
-            self.isotp_addr = isotp.Address(
+            return isotp.Address(
                 isotp.AddressingMode.Normal_11bits,
                 rxid=int(destination, 16),
                 txid=int(source, 16))
         elif addr_mode == 'Mixed_11bits':
-            self.isotp_addr = isotp.Address(
+            return isotp.Address(
                 isotp.AddressingMode.Mixed_11bits,
                 rxid=int(destination, 16),
                 txid=int(source, 16), address_extension=0x99)
         elif addr_mode == 'Mixed_29bits':
-            self.isotp_addr = isotp.Address(
+            return isotp.Address(
                 isotp.AddressingMode.Mixed_29bits,
                 source_address=int(source, 16),
                 target_address=int(destination, 16), address_extension=0x99)
         elif addr_mode == 'NormalFixed_29bits':
-            self.isotp_addr = isotp.Address(
+            return isotp.Address(
                 isotp.AddressingMode.NormalFixed_29bits,
                 target_address=int(destination, 16),
                 source_address=int(source, 16))
         elif addr_mode == 'Extended_11bits':
-            self.isotp_addr = isotp.Address(
+            return isotp.Address(
                 isotp.AddressingMode.Extended_11bits,
                 rxid=int(destination, 16),
                 txid=int(source, 16),
-                source_address=0x55,
-                target_address=0xAA)
+                source_address=tester_address,
+                target_address=ecu_address)
         elif addr_mode == 'Extended_29bits':
-            self.isotp_addr = isotp.Address(
+            return isotp.Address(
                 isotp.AddressingMode.Extended_29bits,
                 rxid=int(destination, 16),
                 txid=int(source, 16),
-                source_address=0x55,
-                target_address=0xAA)
+                source_address=tester_address,
+                target_address=ecu_address)
         else:
             raise AssertionError(
                 """Uncompatible addressing\nSee
                 https://can-isotp.readthedocs.io/en/latest/isotp/
                 examples.html#different-type-of-addresses""")
 
-        self.isotp_stack = isotp.CanStack(
-            bus=self.bus, address=self.isotp_addr,
-            error_handler=self.curf_error_handler)
-        self.is_isotp = True
-
-    def send_frame(self, frame_id, frame_data):
+    def send_frame(self, frame_id, frame_data, channel=None):
         """ Send a CAN frame
         Keyword arguments:
-        frame_id -- ID to send
+        frame_id -- ID to send in hexadecimal, 8 digits for an extended
+                    one (00000123, see parse_frame_id)
         frame_data -- Data to send
+        channel -- alias of the CAN channel (default the selected one)
         """
-        frame_data = [frame_data[i:i+2] for i in range(0, len(frame_data), 2)]
-        frame_data = [int(x, 16) for x in frame_data]
-        frame = can.Message(arbitration_id=int(frame_id, 16), data=frame_data)
+        self._use_channel(channel)
+        frame_id, is_extended = parse_frame_id(frame_id)
+        frame = can.Message(arbitration_id=frame_id,
+                            is_extended_id=is_extended,
+                            data=hex_to_bytes(frame_data))
         self.bus.send(frame)
 
-    def send_signal(self, signal_name, value):
+    def send_frames(self, source, rate=None, channel=None):
+        """ Send a list of CAN frames with a precise pacing
+        Frames are encoded once before the first one is sent.
+        Keyword arguments:
+        source -- list of "ID,DATA[,DELTA]" rows, CSV file of
+                  ID,DATA[,DELTA] rows or recorded log file
+                  (asc, blf, log, ...)
+        rate -- frames per second, None to keep the DELTA column or the
+                recorded timing (default None)
+        channel -- alias of the CAN channel (default the selected one)
+        Return the achieved frames per second and timing errors
+        """
+        self._use_channel(channel)
+        frames = load_frames(source)
+        if rate is not None and rate != 'None':
+            rate = float(rate)
+        else:
+            rate = None
+        report = send_frames(self.bus, frames, rate)
+        robot_logger.info("%d frames sent in %.3f s (%.0f frames/s), "
+                          "timing error mean %.1f us max %.1f us" %
+                          (report["frames"], report["duration"],
+                           report["frames_per_second"],
+                           report["mean_error"] * 1e6,
+                           report["max_error"] * 1e6))
+        return report
+
+    def send_signal(self, signal_name, value, channel=None):
         """ Send a CAN signal from Database
+        The other signals of the message keep their last value sent in
+        the test, set_can() restores the initial values
         Keyword arguments:
         signal_name -- Name of the signal to send
         value -- Value of the signal to send
+        channel -- alias of the CAN channel (default the selected one)
         """
-        signal_dict = {signal_name: float(value)}
-        message_to_send = self.get_message_name_by_signal(signal_name)
-        message_to_send = self.db.get_message_by_name(message_to_send)
-        if message_to_send is not None:
-            for signal in message_to_send.signals:
-                if signal.name != signal_name and signal is not None:
-                    signal_dict[signal.name] = 0.0
+        self._use_channel(channel)
+        self.send_signals({signal_name: value})
 
-            message_to_send = self.db.get_message_by_name(message_to_send.name)
-            data = message_to_send.encode(signal_dict)
+    def send_signals(self, signals, channel=None):
+        """ Send CAN signals from Database, one frame per message
+        The other signals of the messages keep their last value sent in
+        the test, set_can() restores the initial values
+        Keyword argument:
+        signals -- dictionary of signal names and values
+        channel -- alias of the CAN channel (default the selected one)
+        """
+        self._use_channel(channel)
+        for message_to_send, updates in self._group_signals(signals).items():
+            data = self.session.signal_state.encode(message_to_send, updates)
             message = can.Message(
-                arbitration_id=message_to_send.frame_id, data=data)
-            print(message)
+                arbitration_id=message_to_send.frame_id,
+                is_extended_id=message_to_send.is_extended_frame, data=data)
+            metrics.log("DEBUG", message)
             self.bus.send(message)
-        else:
-            raise AssertionError('Signal : %s is not in Database' %
-                                 (signal_name))
 
-    # def send_signals(self,signal_dict):
+    def reset_signal_values(self, message_name=None):
+        """ Forget the last sent signal values, the next frames use the
+        initial values of the database
+        Keyword argument:
+        message_name -- message to reset (default every message)
+        """
+        if message_name == 'None':
+            message_name = None
+        self.session.signal_state.reset(message_name)
 
     def check_msg(self, msg_name, time_out,
-                  check_not_received, node_name=None):
+                  check_not_received, node_name=None, channel=None):
         """Check the reception of given message
         with the given time out value
         Keyword arguments:
@@ -265,13 +889,13 @@ class Curf:
                               check_not_received = True if
                               we want to check the no-reception
         node_name -- Node ID (optional)
+        channel -- alias of the CAN channel (default the selected one)
         """
+        self._use_channel(channel)
         if node_name is None or node_name == 'None':
             node_name = self.db_default_node
-        tester = cantools.tester.Tester(
-            dut_name=node_name, database=self.db, can_bus=self.bus)
-        res = tester.expect(msg_name, signals=None, timeout=int(time_out))
-        print(res)
+        res = self._expect_message(msg_name, node_name, int(time_out))
+        metrics.log("DEBUG", res)
         if res is not None:
             if check_not_received == 'False':
                 pass
@@ -285,56 +909,44 @@ class Curf:
             elif check_not_received == 'True':
                 pass
 
-    def check_frame(self, expect_id, expect_data, timeout, node_name=None):
+    def check_frame(self, expect_id, expect_data, timeout, node_name=None,
+                    channel=None):
         """Check the reception of give frame
         with the given time out value
+        The frames received before the call are ignored.
         Keyword arguments:
-        expect_id -- frame expected ID to be received
+        expect_id -- frame expected ID to be received, 8 digits for an
+                     extended one (see parse_frame_id)
         expect_data -- frame expected data to be received
         timeout -- timeout value in second for the reception
         node_name -- Node ID (optional)
+        channel -- alias of the CAN channel (default the selected one)
         """
-        expect_id = expect_id.upper()
-        expect_id = "0X"+expect_id
-        if expect_data != 'ANY':
+        self._use_channel(channel)
+        received_id = parse_frame_id(expect_id)
+        self._expect_ids([received_id])
+        if expect_data not in ('ANY', 'NoReception'):
             expect_data = int(expect_data, 16)
-        end_time = time.time()+float(timeout)
-        if node_name is None or node_name == 'None':
-            node_name = self.db_default_node
-        while 1:
-            received_frame = self.bus.recv(float(timeout))
-            print(received_frame)
-            received_id = str(hex(received_frame.arbitration_id)).upper()
+        self.dispatcher.discard(received_id)
+        received_frame = self.dispatcher.pop(received_id, float(timeout))
+        metrics.log("DEBUG", received_frame)
+        if received_frame is None:
+            if expect_data != "NoReception":
+                raise AssertionError('No Frame was received with ID: %s'
+                                     % (expect_id))
+        elif expect_data == "NoReception":
+            raise AssertionError('Frame : %s was received with ID: %s'
+                                 % (received_frame, expect_id))
+        elif expect_data != "ANY":
             received_data = int(binascii.hexlify(received_frame.data), 16)
-            if received_frame is not None and received_id == expect_id:
-                if expect_data == "ANY":
-                    break
-                elif received_data == expect_data:
-                    break
-                elif expect_data == "NoReception":
-                    raise AssertionError('Frame : %s was received with ID: %s'
-                                         % (received_frame, received_id))
-                else:
-                    raise AssertionError("""Frame : %s received with good ID: %s
-                                         \nBut with Data: %s instead of: %s"""
-                                         % (received_frame, received_id,
-                                            received_data, expect_data))
-
-            elif received_frame is None and expect_data == "NoReception":
-                break
-            elif received_frame is None and expect_data != "NoReception":
-                raise AssertionError('No Frame was received')
-            elif received_frame is not None and received_id != expect_id and time.time() > end_time:
-                raise AssertionError("""Frame : %s received with bad ID: %s\n
-                                     With Data: %s instead of ID: %s""" %
-                                     (received_frame, received_id,
-                                      received_data, expect_id))
-            else:
-                continue
-        pass
+            if received_data != expect_data:
+                raise AssertionError("""Frame : %s received with good ID: %s
+                                     \nBut with Data: %s instead of: %s"""
+                                     % (received_frame, expect_id,
+                                        received_data, expect_data))
 
     def check_signal(self, signal_name, expect_value,
-                     time_out, node_name=None):
+                     time_out, node_name=None, channel=None):
         """Check the reception of give signal
         with the given time out value
         Keyword arguments:
@@ -342,19 +954,21 @@ class Curf:
         expect_value -- signal expected value to be received
         time_out -- timeout value in second for the reception
         node_name -- Node ID (optional)
+        channel -- alias of the CAN channel (default the selected one)
         """
+        self._use_channel(channel)
         if node_name is None or node_name == 'None':
             node_name = self.db_default_node
-        tester = cantools.tester.Tester(
-            dut_name=node_name, database=self.db, can_bus=self.bus)
         message_to_send = self.get_message_name_by_signal(signal_name)
         if message_to_send is not None:
-            res = tester.expect(
-                message_to_send, signals=None, timeout=int(time_out))
+            res = self._expect_message(
+                message_to_send, node_name, int(time_out))
             if res is not None:
+                short_name = DatabaseIndex.signal_short_name(signal_name)
                 for key, value in res.items():
-                    if key == signal_name:
-                        if value == expect_value:
+                    if key == short_name:
+                        if str(value) == expect_value or \
+                                self._same_value(value, expect_value):
                             pass
                         elif expect_value == 'NoReception':
                             raise AssertionError('Signal : %s was received' %
@@ -373,33 +987,265 @@ class Curf:
             raise AssertionError('Signal : %s was not in database' %
                                  (signal_name))
 
-    def check_period(self, id_frame, expect_period, times):
+    def _expect_message(self, msg_name, node_name, time_out):
+        """ Return the decoded signals of the next message msg_name
+        received from now on, None if not received in time_out seconds
+        The frames received before the call are ignored, use the signal
+        value keywords to look back.
+        """
+        if node_name not in [node.name for node in self.db.nodes]:
+            raise AssertionError('Node : %s is not in Database' % (node_name))
+        message = self.db_index.message_by_name(msg_name)
+        if message is None:
+            raise AssertionError('Message : %s is not in Database' %
+                                 (msg_name))
+        self._expect_ids([message_key(message)])
+        self.dispatcher.discard(message_key(message))
+        end_time = self.dispatcher.now() + time_out
+        while True:
+            frame = self.dispatcher.pop(
+                message_key(message),
+                max(0.0, end_time - self.dispatcher.now()))
+            if frame is None:
+                return None
+            if frame.is_error_frame or frame.is_remote_frame:
+                continue
+            return message.decode(frame.data)
+
+    def _get_signal_message(self, signal_name):
+        """ Return the message of a signal and the short signal name
+        """
+        message = self.db_index.message_by_signal(signal_name)
+        if message is None:
+            raise AssertionError('Signal : %s was not in database' %
+                                 (signal_name))
+        self._expect_ids([message_key(message)])
+        return message, DatabaseIndex.signal_short_name(signal_name)
+
+    def get_signal_value(self, signal_name, channel=None):
+        """ Return the last received value of a signal
+        Keyword arguments:
+        signal_name -- name of the signal (SIGNAL or MESSAGE.SIGNAL)
+        channel -- alias of the CAN channel (default the selected one)
+        """
+        self._use_channel(channel)
+        message, short_name = self._get_signal_message(signal_name)
+        latest = self.signal_history.get_latest(message, short_name)
+        if latest is None:
+            raise AssertionError('Signal : %s was not received' %
+                                 (signal_name))
+        return latest[1]
+
+    def watch_signals(self, *signal_names, channel=None):
+        """ Keep the last values of the signals from now on, for
+        get_signal_history() and wait_signal_change()
+        Keyword arguments:
+        signal_names -- names of the signals
+        channel -- alias of the CAN channel (default the selected one)
+        """
+        self._use_channel(channel)
+        for signal_name in signal_names:
+            self.signal_history.watch(
+                self._get_signal_message(signal_name)[0])
+
+    def get_signal_history(self, signal_name, channel=None):
+        """ Return the last values of a watched signal as a list of
+        (timestamp, value), oldest first
+        Keyword arguments:
+        signal_name -- name of the signal (SIGNAL or MESSAGE.SIGNAL)
+        channel -- alias of the CAN channel (default the selected one)
+        """
+        self._use_channel(channel)
+        message, short_name = self._get_signal_message(signal_name)
+        return self.signal_history.get_history(message, short_name)
+
+    def wait_signal_value(self, signal_name, expect_value, timeout=0,
+                          channel=None):
+        """ Wait until a signal has a value, return at once if the last
+        received value is already the expected one
+        Keyword arguments:
+        signal_name -- name of the signal (SIGNAL or MESSAGE.SIGNAL)
+        expect_value -- expected value, a number or a choice name
+        timeout -- time to wait in second (default 0)
+        channel -- alias of the CAN channel (default the selected one)
+        """
+        self._use_channel(channel)
+        message, short_name = self._get_signal_message(signal_name)
+        value = self.signal_history.wait(
+            message, short_name,
+            lambda value: same_value(value, expect_value), timeout)
+        if value is None:
+            self._raise_signal_timeout(message, short_name,
+                                       "equal to %s" % (expect_value),
+                                       timeout)
+        return value
+
+    def wait_signal_in_range(self, signal_name, minimum, maximum,
+                             timeout=0, channel=None):
+        """ Wait until a signal is between minimum and maximum included,
+        return at once if the last received value already is
+        Keyword arguments:
+        signal_name -- name of the signal (SIGNAL or MESSAGE.SIGNAL)
+        minimum -- lowest accepted value
+        maximum -- highest accepted value
+        timeout -- time to wait in second (default 0)
+        channel -- alias of the CAN channel (default the selected one)
+        """
+        self._use_channel(channel)
+        message, short_name = self._get_signal_message(signal_name)
+        minimum = float(minimum)
+        maximum = float(maximum)
+        value = self.signal_history.wait(
+            message, short_name,
+            lambda value: minimum <= numeric(value) <= maximum, timeout)
+        if value is None:
+            self._raise_signal_timeout(message, short_name,
+                                       "between %s and %s" %
+                                       (minimum, maximum), timeout)
+        return value
+
+    def wait_signal_change(self, signal_name, timeout=0, reference=None,
+                           channel=None):
+        """ Wait until a signal is received with another value
+        Return the new value.
+        Keyword arguments:
+        signal_name -- name of the signal (SIGNAL or MESSAGE.SIGNAL)
+        timeout -- time to wait in second (default 0)
+        reference -- value to differ from, the last received value is
+                     returned at once if it differs (default the last
+                     received value)
+        channel -- alias of the CAN channel (default the selected one)
+        """
+        self._use_channel(channel)
+        message, short_name = self._get_signal_message(signal_name)
+        if reference == 'None':
+            reference = None
+        value = self.signal_history.wait_change(message, short_name,
+                                                reference, timeout)
+        if value is None:
+            self._raise_signal_timeout(message, short_name, "changed",
+                                       timeout)
+        return value
+
+    def _raise_signal_timeout(self, message, short_name, expected, timeout):
+        latest = self.signal_history.get_latest(message, short_name)
+        raise AssertionError("Signal : %s was not %s in timeout: %s, last "
+                             "value: %s" %
+                             (short_name, expected, timeout,
+                              "not received" if latest is None
+                              else latest[1]))
+
+    def check_sequence(self, *steps, timeout=5, pending_timeout=5,
+                       channel=None):
+        """ Check an ordered sequence of frames, signal values and
+        diagnostic responses with the delay between the steps
+        The frames are read once, in reception order, and every step is
+        checked against their timestamps. The delays are measured on the
+        clock of the interface timestamps: the start of the sequence and
+        the SEND and REQUEST steps are mapped to it from the host time
+        (see FrameDispatcher.frame_time()). The first step out of its
+        window fails with the timeline of the previous ones.
+        Return the timeline, a list of {step, delay, timestamp}.
+        Keyword arguments:
+        steps -- steps, one per argument:
+                 FRAME <ID> [<data pattern>] [<min>..<max>]
+                 SIGNAL <name> <value> [<min>..<max>]
+                 DIAG <response pattern> [<min>..<max>]
+                 SEND <ID> <data>
+                 REQUEST <diagnostic request>
+                 with the delays in second from the previous step
+        timeout -- maximum delay of the steps without one (default 5)
+        pending_timeout -- a DIAG step answered by a response pending
+                           (7F xx 78) waits this time in second more
+                           (P2*, default 5)
+        channel -- alias of the CAN channel (default the selected one)
+        """
+        self._use_channel(channel)
+        address = self.isotp_link.address if self.is_isotp else None
+        steps = [parse_step(step, self.db_index, address, timeout,
+                            pending_timeout)
+                 for step in steps]
+        if self.bus is None and any(step.is_action() for step in steps):
+            raise AssertionError("SEND and REQUEST steps need a CAN bus, "
+                                 "not a log file")
+        is_diag = any(step.kind in ("DIAG", "REQUEST") for step in steps)
+        if is_diag and not self.is_isotp:
+            raise AssertionError("set_isotp() must be called before a "
+                                 "sequence with DIAG or REQUEST steps")
+        dispatcher = self.dispatcher
+        check = SequenceCheck(steps, 0.0)
+        ids = check.get_ids()
+        self._expect_ids(ids)
+        if is_diag:
+            self.isotp_link.clear()
+        with dispatcher.subscribe(ids) as subscription:
+            check.reference = dispatcher.frame_time()
+            while check.current() is not None:
+                step = check.current()
+                if step.is_action():
+                    # The answer may come before send() returns
+                    sent = dispatcher.frame_time()
+                    if step.kind == "SEND":
+                        self.bus.send(can.Message(
+                            arbitration_id=step.key[0],
+                            is_extended_id=step.key[1], data=step.data))
+                    else:
+                        self.isotp_link.send(step.data)
+                    check.done(sent)
+                    continue
+                msg = subscription.get(
+                    max(0.0, check.get_deadline() - dispatcher.frame_time()))
+                if msg is None:
+                    check.timeout()
+                else:
+                    check.put(msg)
+        if is_diag:
+            # The responses were also queued by the link
+            self.isotp_link.clear()
+        report = check.get_report()
+        metrics.log("INFO", report)
+        if check.failure is not None:
+            raise AssertionError("Sequence failed:\n%s" % (report))
+        return check.timeline
+
+    @staticmethod
+    def _same_value(value, expect_value):
+        try:
+            return float(value) == float(expect_value)
+        except (TypeError, ValueError):
+            return False
+
+    def check_period(self, id_frame, expect_period, times, channel=None):
         """Check the periodicity of given frame ID
         Keyword arguments:
-        expect_id -- frame expected ID to be received
+        id_frame -- frame expected ID to be received, 8 digits for an
+                    extended one (see parse_frame_id)
         expect_period -- expected period in second
         times -- number of measured frame
+        channel -- alias of the CAN channel (default the selected one)
         """
+        self._use_channel(channel)
         timeOut = float(expect_period)*int(times)+1
-        end_time = time.time()+float(timeOut)
-        self.avrTime = AverageTime()
-        self.avrTime.clean_list()
+        end_time = self.dispatcher.now()+float(timeOut)
+        self.period_stats = PeriodStats(float(expect_period))
         count = 0
-        while time.time() < end_time:
+        key = parse_frame_id(id_frame)
+        self._expect_ids([key])
+        with self.dispatcher.subscribe(ids=[key]) as frames:
             while (count < int(times)):
-                if(time.time() >= end_time):
+                if(self.dispatcher.now() >= end_time):
                     break
-                received_frame = self.bus.recv(float(expect_period)+1)
-                received_id = str(hex(received_frame.arbitration_id)).upper()
-                expect_id = id_frame.upper()
-                if received_id == expect_id:
-                    self.avrTime.put_tick()
+                received_frame = frames.get(
+                    min(float(expect_period)+1,
+                        end_time - self.dispatcher.now()))
+                if received_frame is not None:
+                    self.period_stats.put(received_frame.timestamp)
                     count += 1
         up_bound = float(expect_period)*1.1
         down_bound = float(expect_period)*0.9
-        if(count > 0):
-            period = self.avrTime.get_average()
-        else:
+        period = self.period_stats.get_average()
+        metrics.log("INFO", self.period_stats.get_report())
+        if period is None:
             raise RuntimeError("No Message with ID:%s Received" % (id_frame))
         if not (period < up_bound and period > down_bound):
             raise RuntimeError("""The period is wrong, expected period is %f
@@ -407,66 +1253,347 @@ class Curf:
                                % (float(expect_period), float(period)))
         pass
 
-    def send_periodic_message(self, message_to_send, period, data=None):
+    def check_periods(self, duration, *messages, tolerance=10,
+                      max_missed=None, channel=None):
+        """Check in a single pass the periodicity of many frames
+        The expected periods are the cycle times of the database
+        Keyword arguments:
+        duration -- measurement time in second
+        tolerance -- allowed mean period error in percent (default 10)
+        max_missed -- allowed missed cycles per frame (default no check)
+        messages -- names of the messages to check
+                    (default every periodic message of the database)
+        channel -- alias of the CAN channel (default the selected one)
+        """
+        self._use_channel(channel)
+        if messages:
+            to_check = []
+            for name in messages:
+                message = self.db_index.message_by_name(name)
+                if message is None:
+                    raise AssertionError('Message : %s is not in Database'
+                                         % (name))
+                if not message.cycle_time:
+                    raise AssertionError('Message : %s has no cycle time'
+                                         % (name))
+                to_check.append(message)
+        else:
+            to_check = [message for message in self.db.messages
+                        if message.cycle_time]
+        stats = {message_key(message):
+                 PeriodStats(message.cycle_time / 1000.0)
+                 for message in to_check}
+        self._expect_ids(stats.keys())
+        end_time = self.dispatcher.now() + float(duration)
+        with self.dispatcher.subscribe(ids=stats.keys()) as frames:
+            while self.dispatcher.now() < end_time:
+                received_frame = frames.get(end_time - self.dispatcher.now())
+                if received_frame is not None:
+                    stats[(received_frame.arbitration_id,
+                           received_frame.is_extended_id)].put(
+                        received_frame.timestamp)
+        errors = []
+        report = {}
+        for message in to_check:
+            period_stats = stats[message_key(message)]
+            report[message.name] = period_stats.get_report()
+            metrics.log("INFO", "%s: %s" % (message.name,
+                                            report[message.name]))
+            expect_period = period_stats.expected_period
+            period = period_stats.get_average()
+            if period is None:
+                errors.append("%s: not received" % (message.name))
+            elif abs(period - expect_period) > \
+                    expect_period * float(tolerance) / 100:
+                errors.append("%s: expected period is %f but the real "
+                              "period is %f" % (message.name,
+                                                expect_period, period))
+            elif max_missed not in (None, 'None') and \
+                    period_stats.missed > int(max_missed):
+                errors.append("%s: %d missed cycles" % (message.name,
+                                                        period_stats.missed))
+        if errors:
+            raise AssertionError("Wrong periods:\n" + "\n".join(errors))
+        return report
+
+    def capture_can(self, duration, *messages, channel=None):
+        """Capture the frames of messages during duration for the
+        captured signal keywords
+        Return the number of captured frames by message
+        Keyword arguments:
+        duration -- capture time in second
+        messages -- names of the messages to capture
+                    (default every message of the database)
+        channel -- alias of the CAN channel (default the selected one)
+        """
+        self._use_channel(channel)
+        if messages:
+            to_capture = []
+            for name in messages:
+                message = self.db_index.message_by_name(name)
+                if message is None:
+                    raise AssertionError('Message : %s is not in Database'
+                                         % (name))
+                to_capture.append(message)
+        else:
+            to_capture = [message for message in self.db.messages
+                          if message.length <= 8]
+        self.capture = SignalCapture(to_capture)
+        self._expect_ids(self.capture.messages.keys())
+        end_time = self.dispatcher.now() + float(duration)
+        with self.dispatcher.subscribe(
+                ids=self.capture.messages.keys()) as frames:
+            while self.dispatcher.now() < end_time:
+                received_frame = frames.get(end_time - self.dispatcher.now())
+                if received_frame is not None:
+                    self.capture.put(received_frame)
+        count = self.capture.get_frames_count()
+        metrics.log("INFO", count)
+        return count
+
+    def get_captured_signal(self, signal_name):
+        """Return the timestamps and the values of a signal over the last
+        capture as two numpy arrays
+        Keyword argument:
+        signal_name -- signal name (SIGNAL or MESSAGE.SIGNAL)
+        """
+        if getattr(self, "capture", None) is None:
+            raise AssertionError("Capture CAN must be called first")
+        message = self.db_index.message_by_signal(signal_name)
+        if message is None or \
+                message_key(message) not in self.capture.messages:
+            raise AssertionError('Signal : %s was not captured' %
+                                 (signal_name))
+        signal = message.get_signal_by_name(
+            DatabaseIndex.signal_short_name(signal_name))
+        return self.capture.decode(message, signal)
+
+    def _get_captured_values(self, signal_name):
+        """ Return the captured timestamps and values of a signal, raise
+        AssertionError if it was not received
+        """
+        timestamps, values = self.get_captured_signal(signal_name)
+        if len(values) == 0:
+            raise AssertionError('Signal : %s was not received during the '
+                                 'capture' % (signal_name))
+        return timestamps, values
+
+    def captured_signal_must_be_in_range(self, signal_name, minimum,
+                                         maximum):
+        """Check every captured value of a signal is in [minimum, maximum]
+        Keyword arguments:
+        signal_name -- signal name (SIGNAL or MESSAGE.SIGNAL)
+        minimum -- lowest allowed value
+        maximum -- highest allowed value
+        """
+        timestamps, values = self._get_captured_values(signal_name)
+        outside = (values < float(minimum)) | (values > float(maximum))
+        count = int(outside.sum())
+        if count:
+            first = outside.argmax()
+            raise AssertionError(
+                "Signal : %s is %d times outside [%s, %s], first value %s "
+                "at %f" % (signal_name, count, minimum, maximum,
+                           values[first], timestamps[first]))
+
+    def captured_signal_must_be_monotonic(self, signal_name,
+                                          direction='increasing',
+                                          strict=False):
+        """Check the captured values of a signal never go backward
+        Keyword arguments:
+        signal_name -- signal name (SIGNAL or MESSAGE.SIGNAL)
+        direction -- increasing or decreasing (default increasing)
+        strict -- True to also fail on equal successive values
+        """
+        timestamps, values = self._get_captured_values(signal_name)
+        steps = values[1:] - values[:-1]
+        if direction == 'decreasing':
+            steps = -steps
+        elif direction != 'increasing':
+            raise AssertionError("BAD ARGUMENTS")
+        if str(strict) in ('True', 'true', '1'):
+            wrong = steps <= 0
+        else:
+            wrong = steps < 0
+        if wrong.any():
+            first = wrong.argmax()
+            raise AssertionError(
+                "Signal : %s is not %s: %s at %f then %s at %f" %
+                (signal_name, direction, values[first], timestamps[first],
+                 values[first + 1], timestamps[first + 1]))
+
+    def captured_signal_min_max_must_be(self, signal_name, expect_min=None,
+                                        expect_max=None, tolerance=0):
+        """Check the minimum and maximum captured values of a signal
+        Return the minimum and the maximum
+        Keyword arguments:
+        signal_name -- signal name (SIGNAL or MESSAGE.SIGNAL)
+        expect_min -- expected minimum (default no check)
+        expect_max -- expected maximum (default no check)
+        tolerance -- allowed absolute error (default 0)
+        """
+        values = self._get_captured_values(signal_name)[1]
+        minimum = float(values.min())
+        maximum = float(values.max())
+        errors = []
+        for name, value, expect in (("minimum", minimum, expect_min),
+                                    ("maximum", maximum, expect_max)):
+            if expect not in (None, 'None') and \
+                    abs(value - float(expect)) > float(tolerance):
+                errors.append("%s is %s instead of %s" %
+                              (name, value, expect))
+        if errors:
+            raise AssertionError("Signal : %s %s" %
+                                 (signal_name, ", ".join(errors)))
+        return minimum, maximum
+
+    def send_periodic_message(self, message_to_send, period, data=None,
+                              task_name=None, channel=None, byte=None):
         """Send a message with the given periodicity
+        If the task is already running with the same period its payload
+        is updated in place
         Keyword arguments:
         message_to_send -- name of the message
                           (relative to databse) to send
         period -- periodicity in second
-        data -- data to send
-        """
-        if data is None or data == 'None':
-            data = '0'
-        is_in_db = False
-        for message in self.db.messages:
-            if message.name == message_to_send:
-                messagets = message
-                is_in_db = True
-        if is_in_db:
+        data -- hexadecimal payload to send, as send_frame() (0x01,
+                DEADBEEF, default 00)
+        task_name -- name of the periodic task (default message name)
+        channel -- alias of the CAN channel (default the selected one)
+        byte -- single decimal byte (0 to 255) to send instead of data
+        """
+        self._use_channel(channel)
+        messagets = self.db_index.message_by_name(message_to_send)
+        if messagets is not None:
+            if byte is not None and byte != 'None':
+                if data is not None and data != 'None':
+                    raise AssertionError("Give either data or byte, not both")
+                if not 0 <= int(byte) <= 255:
+                    raise AssertionError("Byte %s is not between 0 and 255"
+                                         % (byte))
+                data = bytearray([int(byte)])
+            elif data is None or data == 'None':
+                data = bytearray([0])
+            else:
+                data = hex_to_bytes(data)
             msg = can.Message(
-                arbitration_id=messagets.frame_id, data=bytearray([int(data)]))
-            print(msg)
-            self.bus.send_periodic(msg, float(period))
+                arbitration_id=messagets.frame_id,
+                is_extended_id=messagets.is_extended_frame, data=data)
+            metrics.log("DEBUG", msg)
+            self._start_periodic_task(task_name or message_to_send, msg,
+                                      period)
         else:
             raise AssertionError('Message : %s is not in Database' %
                                  (message_to_send))
 
-    def send_periodic_signal(self, signal_name, signal_value, period):
+    def send_periodic_signal(self, signal_name, signal_value, period,
+                             task_name=None, channel=None):
         """Send a signal with the given periodicity
+        The other signals of the message keep their last sent value.
+        If the task of the message is already running with the same period
+        its payload is updated in place
         Keyword arguments:
         signal_name -- name of the signal
                        (relative to databse) to send
         signal_value -- signal value to send
         period -- periodicity in second
+        task_name -- name of the periodic task (default message name)
+        channel -- alias of the CAN channel (default the selected one)
         """
-        is_in_db = False
-        signal_dict = {signal_name: float(signal_value)}
-        for message in self.db.messages:
-            for signal in message.signals:
-                if signal_name == signal.name:
-                    message_to_send = message
-                    is_in_db = True
-        if is_in_db:
-            for signal in message_to_send.signals:
-                if signal.name != signal_name and signal is not None:
-                    signal_dict[signal.name] = 0.0
-            message_to_send = self.db.get_message_by_name(message_to_send.name)
-            data = message_to_send.encode(signal_dict)
-            msg = can.Message(
-                arbitration_id=message_to_send.frame_id, data=data)
-            print(msg)
-            self.bus.send_periodic(msg, float(period))
-        else:
-            raise AssertionError('Signal : %s is not in Database' %
-                                 (signal_name))
+        self._use_channel(channel)
+        self.send_periodic_signals({signal_name: signal_value}, period,
+                                   task_name)
+
+    def send_periodic_signals(self, signals, period, task_name=None,
+                              channel=None):
+        """Send signals with the given periodicity, one task per message
+        The other signals of the messages keep their last sent value.
+        Keyword arguments:
+        signals -- dictionary of signal names and values
+        period -- periodicity in second
+        task_name -- name of the periodic task, only if all the signals
+                     are in the same message (default message name)
+        channel -- alias of the CAN channel (default the selected one)
+        """
+        self._use_channel(channel)
+        if task_name == 'None':
+            task_name = None
+        groups = self._group_signals(signals)
+        if task_name is not None and len(groups) > 1:
+            # Each task would replace the previous one
+            raise AssertionError(
+                "Task name %s given for signals of %d messages: %s" %
+                (task_name, len(groups),
+                 ", ".join(message.name for message in groups)))
+        for message, updates in groups.items():
+            data = self.session.signal_state.encode(message, updates)
+            msg = can.Message(arbitration_id=message.frame_id,
+                              is_extended_id=message.is_extended_frame,
+                              data=data)
+            metrics.log("DEBUG", msg)
+            self._start_periodic_task(task_name or message.name, msg, period)
+
+    def update_periodic_signals(self, signals):
+        """Change signals of running periodic tasks without stopping them
+        The tasks must be named after their message
+        Keyword argument:
+        signals -- dictionary of signal names and values
+        """
+        groups = self._group_signals(signals)
+        running = self.session.periodic_tasks.names()
+        for message in groups:
+            # Checked before any signal value is changed
+            if message.name not in running:
+                raise AssertionError("Periodic task : %s is not running, "
+                                     "start it with send_periodic_signals()"
+                                     % (message.name))
+        for message, updates in groups.items():
+            data = self.session.signal_state.encode(message, updates)
+            self.session.periodic_tasks.modify(
+                message.name,
+                can.Message(arbitration_id=message.frame_id,
+                            is_extended_id=message.is_extended_frame,
+                            data=data))
+
+    def _group_signals(self, signals):
+        """ Return the signal values of signals grouped by message
+        """
+        messages = {}
+        for signal_name, value in signals.items():
+            message = self.db_index.message_by_signal(signal_name)
+            if message is None:
+                raise AssertionError('Signal : %s is not in Database' %
+                                     (signal_name))
+            updates = messages.setdefault(message, {})
+            updates[DatabaseIndex.signal_short_name(signal_name)] = \
+                float(value)
+        return messages
+
+    def _start_periodic_task(self, task_name, msg, period):
+        self.session.periodic_tasks.start(task_name, msg, float(period))
+
+    def list_periodic_tasks(self):
+        """Return the description of the running periodic tasks"""
+        tasks = [str(task)
+                 for task in self.session.periodic_tasks.tasks.values()]
+        metrics.log("INFO", "\n".join(tasks))
+        return tasks
+
+    def stop_periodic_task(self, task_name):
+        """Stop the sending of one periodic task
+        Keyword argument:
+        task_name -- name of the periodic task
+        """
+        self.session.periodic_tasks.stop(task_name)
 
     def stop_periodic_message(self):
         """Stop the sending of all periodic messages, signals and frames"""
-        self.bus.stop_all_periodic_tasks()
+        self.session.periodic_tasks.stop_all()
 
     def stop_bus(self):
         """Stop the CAN BUS"""
-        self.bus.shutdown()
+        bus_pool.close(self.session)
+        self.is_isotp = False
 
     def flush_bus(self):
         """Flush the TX buffer"""
@@ -480,17 +1607,158 @@ class Curf:
         address_type -- Addressing type (default Physical)
         """
         data = bytes.fromhex(data_to_send)
-        print(data)
-        print(address_type)
+        metrics.log("DEBUG", data)
+        metrics.log("DEBUG", address_type)
         if address_type == 'Functional':
-            self.isotp_stack.send(
+            self.isotp_link.send(
                 data, isotp.TargetAddressType.Functional)
         else:
-            self.isotp_stack.send(
+            self.isotp_link.send(
                 data)
-        while self.isotp_stack.transmitting():
-            self.isotp_stack.process()
-            time.sleep(self.isotp_stack.sleep_time())
+
+    def send_diagnostic_request_to_all(self, data_to_send,
+                                       address_type='Physical',
+                                       timeout=1, pending_timeout=5):
+        """Send a diagnostic (ISO-TP) request to every ECU set with
+        set_isotp() and return their responses by ECU name
+        The ECUs are handled in parallel by a pool of threads, so every
+        response is collected in one P2 window (P2* after a 7F XX 78).
+        A Functional request is sent once from the selected ECU link.
+        Keyword arguments:
+        data_to_send -- The payload to send
+        address_type -- Addressing type (default Physical)
+        timeout -- time to wait for each response in second (P2)
+        pending_timeout -- time to wait after a response pending in second
+                           (P2*)
+        """
+        data = bytes.fromhex(data_to_send)
+        links = dict(self.session.isotp_links)
+        if not links:
+            raise AssertionError("No ECU set, call set_isotp() first")
+        for link in links.values():
+            link.clear()
+        timeout = float(timeout)
+        pending_timeout = float(pending_timeout)
+        functional = address_type == 'Functional'
+        if functional:
+            self.isotp_link.send(data, isotp.TargetAddressType.Functional)
+
+        def request(link):
+            if not functional:
+                link.send(data)
+            return link.wait_response(timeout, pending_timeout)
+
+        with ThreadPoolExecutor(max_workers=len(links)) as pool:
+            futures = {name: pool.submit(request, link)
+                       for name, link in links.items()}
+            responses = {}
+            for name, future in futures.items():
+                response = future.result()
+                responses[name] = None if response is None \
+                    else response.hex().upper()
+        metrics.log("INFO", responses)
+        return responses
+
+    def read_did_from_all(self, did, timeout=1, pending_timeout=5):
+        """Read a DID (service 22) from every ECU set with set_isotp()
+        Return the data record of each ECU, None if it did not answer
+        positively
+        Keyword arguments:
+        did -- Data identifier in hexadecimal (F190, ...)
+        timeout -- time to wait for each response in second (P2)
+        pending_timeout -- time to wait after a response pending in second
+                           (P2*)
+        """
+        did = did.upper()
+        responses = self.send_diagnostic_request_to_all(
+            "22" + did, 'Physical', timeout, pending_timeout)
+        records = {}
+        for name, response in responses.items():
+            if response is not None and response.startswith("62" + did):
+                records[name] = response[2 + len(did):]
+            else:
+                records[name] = None
+        return records
+
+    def request_download(self, memory_address, memory_size,
+                         data_format='00', address_and_length_format='44',
+                         timeout=1, pending_timeout=5):
+        """Send a RequestDownload (0x34) to the selected ECU
+        Return the maxNumberOfBlockLength given by the ECU
+        Keyword arguments:
+        memory_address -- start address in hexadecimal
+        memory_size -- number of bytes to download
+        data_format -- dataFormatIdentifier in hexadecimal (default 00)
+        address_and_length_format -- addressAndLengthFormatIdentifier in
+                                     hexadecimal (default 44)
+        timeout -- time to wait for each response in second (P2)
+        pending_timeout -- time to wait after a response pending in second
+                           (P2*)
+        """
+        self.flash = FlashDownload(self.isotp_link, timeout, pending_timeout)
+        return self.flash.request_download(
+            int(memory_address, 16), int(memory_size),
+            int(data_format, 16), int(address_and_length_format, 16))
+
+    def transfer_data_from_file(self, image_path, offset=0, size=None):
+        """Send an image file with TransferData (0x36) requests
+        request_download() must be called first
+        Return the throughput and block latency report
+        Keyword arguments:
+        image_path -- path of the image file
+        offset -- first byte of the file to send (default 0)
+        size -- number of bytes to send (default up to the end of file)
+        """
+        if getattr(self, "flash", None) is None:
+            raise AssertionError("Request Download must be called first")
+        report = self.flash.transfer_data(
+            image_path, int(offset), None if size is None else int(size))
+        self._log_flash_report(report)
+        return report
+
+    def request_transfer_exit(self, parameter=''):
+        """Send a RequestTransferExit (0x37) to the selected ECU
+        Return the transferResponseParameterRecord in hexadecimal
+        Keyword arguments:
+        parameter -- transferRequestParameterRecord in hexadecimal
+        """
+        if getattr(self, "flash", None) is None:
+            self.flash = FlashDownload(self.isotp_link)
+        return self.flash.request_transfer_exit(
+            bytes.fromhex(parameter)).hex().upper()
+
+    def download_image(self, image_path, memory_address, data_format='00',
+                       address_and_length_format='44',
+                       timeout=1, pending_timeout=5):
+        """Download an image file to the selected ECU with RequestDownload,
+        TransferData and RequestTransferExit
+        Return the throughput and block latency report
+        Keyword arguments:
+        image_path -- path of the image file
+        memory_address -- start address in hexadecimal
+        data_format -- dataFormatIdentifier in hexadecimal (default 00)
+        address_and_length_format -- addressAndLengthFormatIdentifier in
+                                     hexadecimal (default 44)
+        timeout -- time to wait for each response in second (P2)
+        pending_timeout -- time to wait after a response pending in second
+                           (P2*)
+        """
+        self.flash = FlashDownload(self.isotp_link, timeout, pending_timeout)
+        report = self.flash.download(
+            image_path, int(memory_address, 16), int(data_format, 16),
+            int(address_and_length_format, 16))
+        self._log_flash_report(report)
+        return report
+
+    @staticmethod
+    def _log_flash_report(report):
+        metrics.log("INFO", report)
+        robot_logger.info(
+            "Downloaded %d bytes in %d blocks of %d bytes: %.0f bytes/s, "
+            "block latency mean %.1f ms max %.1f ms" %
+            (report["bytes"], report["blocks"], report["max_block_length"],
+             report["bytes_per_second"], report["block_latency_mean"] * 1000,
+             report["block_latency_max"] * 1000))
 
     def check_diag_request(self, expect_reponse_data,
                            timeout_value, exact_or_contain):
@@ -504,17 +1772,14 @@ class Curf:
         res = "NoReception"
         end_time = time.time() + float(timeout_value)
         while (time.time() < end_time):
-            recv_data = None
-            self.isotp_stack.process()
-            if self.isotp_stack.available():
-                recv_data = self.isotp_stack.recv()
+            recv_data = self.isotp_link.recv(max(0.0, end_time - time.time()))
             if(recv_data is None):
                 continue
             recv_data = recv_data.hex()
-            print(recv_data)
+            metrics.log("DEBUG", recv_data)
             if(recv_data[0:2] == "7f"):
                 if(recv_data[4:6] == "78"):
-                    print("7F XX 78")
+                    metrics.log("DEBUG", "7F XX 78")
                     end_time = time.time() + float(timeout_value)
                     continue
                 else:
@@ -576,6 +1841,61 @@ class Curf:
         if res == "NoReception" and expect_reponse_data != "NoReception":
             raise AssertionError("Error CAN TimeOut Reached")
 
+    def check_diag_response_pattern(self, pattern, timeout_value=5,
+                                    exact_or_start='EXACT'):
+        """Check the next diagnostic (ISO-TP) response against a byte
+        pattern and return its captured fields
+        The fields are also set as test variables: the pattern
+        62 F1 87 ?? ?? {serial:4} sets ${serial}.
+        set_isotp() must be already instanciate
+        Keyword arguments:
+        pattern -- expected response, see BytePattern
+        timeout_value -- timeout value in second for the reception
+        exact_or_start -- EXACT to match the whole response, START to
+                          accept more bytes after the pattern
+        """
+        if exact_or_start not in ('EXACT', 'START'):
+            raise AssertionError("BAD ARGUMENTS")
+        compiled = compile_pattern(pattern)
+        timeout_value = float(timeout_value)
+        response = self.isotp_link.wait_response(timeout_value, timeout_value)
+        if response is None:
+            raise AssertionError("Error CAN TimeOut Reached")
+        fields = compiled.match(response, exact_or_start == 'EXACT')
+        if fields is None:
+            raise AssertionError(("The diagnostic reponse "
+                                  "expect to  be %s but was %s.")
+                                 % (pattern, response.hex().upper()))
+        self._set_test_variables(fields)
+        return fields
+
+    def match_diag_response(self, pattern, response,
+                            exact_or_start='EXACT'):
+        """Return the fields of a response captured by a byte pattern,
+        None if it does not match
+        Keyword arguments:
+        pattern -- expected response, see BytePattern
+        response -- response in hexadecimal
+        exact_or_start -- EXACT to match the whole response, START to
+                          accept more bytes after the pattern
+        """
+        fields = compile_pattern(pattern).match(
+            bytes.fromhex(response), exact_or_start == 'EXACT')
+        if fields is not None:
+            self._set_test_variables(fields)
+        return fields
+
+    @staticmethod
+    def _set_test_variables(fields):
+        """ Set each captured field as a test variable
+        """
+        try:
+            builtin = BuiltIn()
+            for name, value in fields.items():
+                builtin.set_test_variable("${%s}" % (name), value)
+        except RobotNotRunningError:
+            pass
+
     def get_next_isotp_frame(self, timeout='3'):
         """Return the next diagnostic (ISO-TP) frame
         set_isotp() must be already instanciate
@@ -584,20 +1904,17 @@ class Curf:
         """
         end_time = time.time() + float(timeout)
         while (time.time() < end_time):
-            recv_data = None
-            self.isotp_stack.process()
-            if self.isotp_stack.available():
-                recv_data = self.isotp_stack.recv()
+            recv_data = self.isotp_link.recv(max(0.0, end_time - time.time()))
             if(recv_data is None):
                 continue
             try:
                 recv_data = recv_data.hex()
             except:
                 recv_data = recv_data
-            print(recv_data)
+            metrics.log("DEBUG", recv_data)
             if(recv_data[0:2] == "7f"):
                 if(recv_data[4:6] == "78"):
-                    print("7F XX 78")
+                    metrics.log("DEBUG", "7F XX 78")
                     end_time = time.time() + float(timeout)
                     continue
                 else:
@@ -636,13 +1953,13 @@ class Curf:
                                  " does not contain DTC\n")
         snapshot = '{:032b}'.format(int(snapshot, 16))
         statusOfDTC = snapshot[39:47]
-        print(statusOfDTC)
+        metrics.log("DEBUG", statusOfDTC)
         for key, value in self.statusOfDTCbits.items():
             if(bit_name == value):
                 wanted_bit = statusOfDTC[7-int(key)]
-                print(wanted_bit)
-                print(key)
-                print(value)
+                metrics.log("DEBUG", wanted_bit)
+                metrics.log("DEBUG", key)
+                metrics.log("DEBUG", value)
         if(int(wanted_bit) < 2):
             if(wanted_bit == bit_value):
                 pass
@@ -657,18 +1974,141 @@ class Curf:
                                             sorted(self.statusOfDTCbits)) +
                                  "\nBut Was:\n"+bit_name)
 
+    def decode_dtc_response(self, response):
+        """Return the records of a ReadDTCInformation (0x59) response, one
+        dictionary per DTC (dtc, status and its bits, ...)
+        Keyword argument:
+        response -- response in hexadecimal
+        """
+        return DtcRecords(bytes.fromhex(response)).get_records()
+
+    def check_dtc_status(self, response, *dtcs, **bits):
+        """Check statusOfDTC bits of every DTC of a ReadDTCInformation
+        (0x59) response in one pass
+        Keyword arguments:
+        response -- response in hexadecimal (0x1902, 0x190A, ...)
+        dtcs -- DTC numbers to check in hexadecimal (default all)
+        bits -- expected bits, testFailed=1 confirmedDTC=0 ...
+        """
+        records = DtcRecords(bytes.fromhex(response))
+        failed = records.check_status(bits, dtcs or None)
+        if failed:
+            raise AssertionError(
+                "%d DTC(s) do not have %s: %s" %
+                (len(failed), ", ".join("%s=%s" % bit for bit in bits.items()),
+                 ", ".join(failed)))
+
+    def read_dtc_by_status_mask(self, status_mask='FF', timeout=5):
+        """Send ReportDTCByStatusMask (0x1902) to the selected ECU and
+        return its response in hexadecimal
+        Keyword arguments:
+        status_mask -- DTCStatusMask in hexadecimal (default FF)
+        timeout -- timeout value in second for the reception
+        """
+        self.isotp_link.clear()
+        self.isotp_link.send(bytes.fromhex("1902" + status_mask))
+        response = self.isotp_link.wait_response(float(timeout))
+        if response is None:
+            raise AssertionError("Error CAN TimeOut Reached")
+        if response[:2] != b"\x59\x02":
+            raise AssertionError("Bad ReportDTCByStatusMask response %s" %
+                                 (response.hex().upper()))
+        return response.hex().upper()
+
+    def _get_diag_session(self):
+        if not self.is_isotp:
+            raise AssertionError("set_isotp() must be called first")
+        return self.session.diag_sessions[self.ecu_name]
+
+    def enter_diagnostic_session(self, session, timeout=2,
+                                 pending_timeout=5, force=False):
+        """ Enter a diagnostic session on the selected ECU, unless it is
+        already the current one
+        Return the response in hexadecimal, None if the request was
+        skipped.
+        Keyword arguments:
+        session -- diagnosticSessionType in hexadecimal (e.g. 03)
+        timeout -- response timeout in second (default 2)
+        pending_timeout -- timeout after a response pending (default 5)
+        force -- send the request even in the session (default False)
+        """
+        response = self._get_diag_session().change_session(
+            int(session, 16), float(timeout), float(pending_timeout),
+            force in (True, 'True'))
+        return None if response is None else response.hex().upper()
+
+    def set_security_algorithm(self, algorithm, **params):
+        """ Use a seed and key algorithm to unlock the selected ECU
+        Keyword arguments:
+        algorithm -- name of diagsession.KEY_ALGORITHMS (add_constants)
+                     or module.function importable by Python, called as
+                     function(seed, level, **params) and returning the key
+                     as bytes
+        params -- parameters of the algorithm (e.g. constant_1=9735A267)
+        """
+        self._get_diag_session().set_key_algorithm(
+            get_key_algorithm(algorithm), **params)
+
+    def unlock_security_access(self, level='01', timeout=2,
+                               pending_timeout=5, force=False):
+        """ Unlock a security level of the selected ECU with the algorithm
+        of set_security_algorithm(), unless it is already unlocked
+        Return True if the seed and key were exchanged.
+        Keyword arguments:
+        level -- requestSeed sub-function in hexadecimal (default 01)
+        timeout -- response timeout in second (default 2)
+        pending_timeout -- timeout after a response pending (default 5)
+        force -- exchange the seed and key even if unlocked
+                 (default False)
+        """
+        return self._get_diag_session().unlock(
+            int(level, 16), float(timeout), float(pending_timeout),
+            force in (True, 'True'))
+
+    def start_tester_present(self, period=2):
+        """ Keep the session of the selected ECU alive: TesterPresent
+        without response (3E 80) is sent in the background when no
+        request was sent during period
+        Keyword argument:
+        period -- time in second, below the S3 timeout of the ECU
+                  (default 2)
+        """
+        self._get_diag_session().start_tester_present(float(period))
+
+    def stop_tester_present(self):
+        """ Stop sending TesterPresent to the selected ECU
+        """
+        self._get_diag_session().stop_tester_present()
+
+    def set_s3_timeout(self, s3_timeout):
+        """ Set the time after which the selected ECU leaves a non default
+        session without request (S3server, default 5 s)
+        Keyword argument:
+        s3_timeout -- time in second
+        """
+        self._get_diag_session().s3_timeout = float(s3_timeout)
+
+    def get_diagnostic_state(self):
+        """ Return the session and the security level tracked for the
+        selected ECU, with the sent and skipped requests counters
+        """
+        return self._get_diag_session().get_state()
+
+    def reset_diagnostic_state(self):
+        """ Forget the session and security level of the selected ECU,
+        e.g. after a power cycle
+        """
+        self._get_diag_session().reset()
+
     def get_seedkey(self, Seed, Constant_1, Constant_2):
         """Return a Key generated by a given key and 2 constants
-        This is a "dumb" example only adding constant to seed.
-        You must implement your own security handshake.
+        This is a "dumb" example only adding constant to seed, see
+        set_security_algorithm() to plug your own security handshake.
         Keyword arguments:
         Seed -- The seed to generate key from
         Constant_1 -- The first constant
         Constant_2 -- The second constant
         """
-        Constant_1 = int(Constant_1, 16)
-        Constant_2 = int(Constant_2, 16)
-        Seed = int(Seed, 16)
-        result_key = Seed + Constant_1 + Constant_2
-        result_key = (result_key).to_bytes(4, byteorder='big')
-        return result_key.hex()
+        seed = int(Seed, 16)
+        seed = seed.to_bytes(max(4, (seed.bit_length() + 7) // 8), 'big')
+        return add_constants(seed, 0, Constant_1, Constant_2).hex()
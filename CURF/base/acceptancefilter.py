@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+import threading
+
+import can
+
+from framedispatcher import format_frame_key
+
+# Number of filters a SocketCAN raw socket accepts (CAN_RAW_FILTER_MAX)
+MAX_FILTERS = 512
+
+
+class AcceptanceFilter:
+    """ AcceptanceFilter restricts the frames read by a FrameDispatcher to
+        the arbitration IDs the test is waiting for
+        The IDs are (arbitration ID, extended) keys, see frame_key(), so
+        a standard and an extended frame of the same ID are told apart.
+        Once enabled, the IDs named by the checks and the ISO-TP links are
+        added as they are expected. Interfaces filtering in the driver or
+        in the kernel (socketcan, ...) get them with bus.set_filters so
+        the unwanted frames never reach Python. On the others (virtual,
+        ...) the dispatcher drops them with a set lookup.
+        The filters of the bus are restored by disable().
+    """
+
+    def __init__(self, bus, dispatcher):
+        """Instanciate an AcceptanceFilter object
+        Keyword arguments:
+        bus -- python-can bus read by the dispatcher
+        dispatcher -- FrameDispatcher of the bus
+        """
+        self.bus = bus
+        self.dispatcher = dispatcher
+        self.lock = threading.Lock()
+        self.enabled = False
+        self.ids = set()
+        self.saved_filters = None
+        # The interface overrides _apply_filters when it filters itself
+        self.hardware = type(bus)._apply_filters is not \
+            can.BusABC._apply_filters
+
+    def enable(self, ids=()):
+        """ Accept only the given arbitration IDs and the expected ones
+        """
+        with self.lock:
+            if not self.enabled:
+                self.saved_filters = self.bus.filters
+                self.enabled = True
+            self.ids = set(ids)
+            self._install()
+
+    def expect(self, ids):
+        """ Accept some more arbitration IDs if the filter is enabled
+        """
+        if not self.enabled:
+            return
+        with self.lock:
+            new_ids = set(ids) - self.ids
+            if self.enabled and new_ids:
+                self.ids |= new_ids
+                self._install()
+
+    def disable(self):
+        """ Accept every frame and restore the filters of the bus
+        """
+        with self.lock:
+            if not self.enabled:
+                return
+            self.enabled = False
+            self.ids = set()
+            self.dispatcher.accepted_ids = None
+            if self.hardware:
+                self.bus.set_filters(self.saved_filters)
+
+    def _install(self):
+        self.dispatcher.accepted_ids = frozenset(self.ids)
+        if self.hardware:
+            filters = None
+            if 0 < len(self.ids) <= MAX_FILTERS:
+                filters = [{"can_id": frame_id,
+                            "can_mask": 0x1FFFFFFF if is_extended else 0x7FF,
+                            "extended": is_extended}
+                           for frame_id, is_extended in sorted(self.ids)]
+            self.bus.set_filters(filters)
+
+    def get_report(self):
+        """ Return the state of the filter
+        """
+        return {"enabled": self.enabled,
+                "mode": "bus" if self.hardware else "dispatcher",
+                "ids": [format_frame_key(key) for key in sorted(self.ids)],
+                "filtered_frames": self.dispatcher.filtered}
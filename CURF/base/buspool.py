@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+import atexit
+import threading
+
+import can
+
+from acceptancefilter import AcceptanceFilter
+from canlogwriter import LogWriter
+from framedispatcher import FrameDispatcher
+from metrics import BusLoadMeter
+from periodictasks import PeriodicTasks
+from signalhistory import SignalHistory
+from signalstate import SignalState
+
+
+class BusSession:
+    """ BusSession holds the live handles of one CAN channel
+        The bus read by the FrameDispatcher, the bus read by the logger,
+        their notifiers and the LogWriter are kept open between test
+        cases. Each test only starts a new segment of the log.
+    """
+
+    def __init__(self, interface, channel, bitrate, fd=False,
+                 data_bitrate=None):
+        """Instanciate a BusSession object
+        Keyword arguments:
+        interface -- can interface (socketcan, vector, ...)
+        channel -- can channel (can0, vcan0, ...)
+        bitrate -- can bitrate (125000, 500000, ...)
+        fd -- True to open the channel in CAN FD mode (default False)
+        data_bitrate -- CAN FD data phase bitrate (2000000, ...)
+        """
+        self.key = (interface, channel, bitrate, fd, data_bitrate)
+        self.fd = fd
+        self.data_bitrate = data_bitrate
+        fd_config = {}
+        if fd:
+            fd_config["fd"] = True
+            if data_bitrate is not None:
+                fd_config["data_bitrate"] = data_bitrate
+        self.fd_config = fd_config
+        self.bus = can.interface.Bus(
+            interface=interface, channel=channel, bitrate=bitrate,
+            **fd_config)
+        self.dispatcher = FrameDispatcher()
+        self.notifier = can.Notifier(self.bus, [self.dispatcher])
+        self.acceptance_filter = AcceptanceFilter(self.bus, self.dispatcher)
+        self.signal_history = SignalHistory(self.dispatcher)
+        self.logbus = can.ThreadSafeBus(interface=interface, channel=channel,
+                                        **fd_config)
+        self.load_meter = BusLoadMeter(bitrate)
+        self.log_notifier = can.Notifier(self.logbus, [self.load_meter])
+        self.log_writer = None
+        self.periodic_tasks = PeriodicTasks(self.bus)
+        self.signal_state = SignalState()
+        # ISO-TP links by ECU name
+        self.isotp_links = {}
+        # DiagSession of the links by ECU name
+        self.diag_sessions = {}
+        # SimulatedEcu by ECU name
+        self.simulated_ecus = {}
+
+    def is_alive(self):
+        """ Return False if a reader thread died
+        """
+        return (getattr(self.notifier, "exception", None) is None and
+                getattr(self.log_notifier, "exception", None) is None)
+
+    def open_log(self, directory, base_name, **config):
+        """ Return the LogWriter of the session, started if needed
+        Keyword arguments:
+        directory -- directory of the log files
+        base_name -- prefix of the log file names
+        config -- LogWriter options (log_format, max_bytes, ...)
+        """
+        if self.log_writer is None:
+            self.log_writer = LogWriter(directory, base_name, **config)
+            self.log_notifier.add_listener(self.log_writer)
+        return self.log_writer
+
+    def close_log(self):
+        """ Detach and stop the LogWriter
+        """
+        if self.log_writer is None:
+            return
+        self.log_notifier.remove_listener(self.log_writer)
+        self.log_writer.stop()
+        self.log_writer = None
+
+    def get_metrics(self):
+        """ Return the traffic rates, the bus load and the queue depths
+        """
+        report = self.load_meter.get_report(self.dispatcher.received)
+        report["dispatcher_overflows"] = self.dispatcher.overflows
+        report["dispatcher_queue"] = len(self.dispatcher.raw)
+        report["dispatcher_filtered"] = self.dispatcher.filtered
+        report["subscription_queues"] = [
+            len(subscription.frames)
+            for subscription in list(self.dispatcher.subscriptions)]
+        if self.log_writer is not None:
+            report["log_queue"] = self.log_writer.queue.qsize()
+            report["log_dropped"] = self.log_writer.dropped
+        report["isotp_queues"] = {name: link.pdus.qsize() for name, link
+                                  in self.isotp_links.items()}
+        return report
+
+    def close_isotp(self, ecu_name=None):
+        """ Stop the ISO-TP link of an ECU (default every link)
+        """
+        if ecu_name is None:
+            names = list(self.isotp_links)
+        else:
+            names = [ecu_name] if ecu_name in self.isotp_links else []
+        for name in names:
+            diag_session = self.diag_sessions.pop(name, None)
+            if diag_session is not None:
+                diag_session.close()
+            self.isotp_links.pop(name).close()
+
+    def open_bus(self):
+        """ Return a new bus on the channel of the session
+        """
+        return can.interface.Bus(interface=self.key[0], channel=self.key[1],
+                                 bitrate=self.key[2], **self.fd_config)
+
+    def stop_simulated_ecu(self, ecu_name=None):
+        """ Stop the simulated ECU of a name (default every ECU)
+        """
+        if ecu_name is None:
+            names = list(self.simulated_ecus)
+        else:
+            names = [ecu_name] if ecu_name in self.simulated_ecus else []
+        for name in names:
+            self.simulated_ecus.pop(name).stop()
+
+    def close(self):
+        """ Release every handle of the session
+        """
+        self.stop_simulated_ecu()
+        self.close_isotp()
+        self.periodic_tasks.stop_all()
+        self.log_notifier.stop()
+        self.close_log()
+        self.notifier.stop()
+        self.bus.shutdown()
+        self.logbus.shutdown()
+
+
+class BusPool:
+    """ BusPool shares the BusSession of each (interface, channel, bitrate,
+        fd, data_bitrate) between the Curf instances of the process
+    """
+
+    def __init__(self):
+        self.sessions = {}
+        self.lock = threading.Lock()
+        # LogWriter options of the sessions opened afterwards
+        self.log_config = {}
+
+    def acquire(self, interface, channel, bitrate, fd=False,
+                data_bitrate=None):
+        """ Return the live session of the channel, opened if needed
+        """
+        key = (interface, channel, bitrate, fd, data_bitrate)
+        with self.lock:
+            session = self.sessions.get(key)
+            if session is not None and not session.is_alive():
+                session.close()
+                session = None
+            if session is None:
+                session = BusSession(interface, channel, bitrate, fd,
+                                     data_bitrate)
+                self.sessions[key] = session
+            return session
+
+    def close(self, session):
+        """ Close a session and remove it from the pool
+        """
+        with self.lock:
+            if self.sessions.get(session.key) is session:
+                del self.sessions[session.key]
+        session.close()
+
+    def close_all(self):
+        """ Close every session of the pool
+        """
+        with self.lock:
+            sessions = list(self.sessions.values())
+            self.sessions.clear()
+        for session in sessions:
+            session.close()
+
+
+# Shared by every Curf instance of the process
+bus_pool = BusPool()
+atexit.register(bus_pool.close_all)
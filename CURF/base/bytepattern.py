@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+import functools
+import re
+
+_CAPTURE = re.compile(r"^\{(\w+)(?::(\d+|\*))?\}$")
+_BYTES = re.compile(r"^(?:[0-9A-Fa-f?]{2})+$")
+
+
+class BytePattern:
+    """ BytePattern is an expected payload compiled into a value and a mask
+        Tokens are separated by spaces:
+        62       -- byte 0x62 (62F187 is read as 62 F1 87)
+        ??       -- any byte
+        4?       -- byte whose high nibble is 4 (nibble wildcard)
+        {name:4} -- 4 bytes captured as name
+        {name}   -- 1 byte captured as name
+        {name:*} -- every remaining byte captured as name (last token)
+        *        -- any number of remaining bytes (last token)
+        Example: 62 F1 87 ?? ?? {serial:4}
+        The fixed length part is checked with a single integer operation:
+        int(data) & mask == value.
+    """
+
+    def __init__(self, pattern):
+        """Instanciate a BytePattern object
+        Keyword argument:
+        pattern -- pattern to compile
+        """
+        self.pattern = pattern
+        self.length = 0
+        self.value = 0
+        self.mask = 0
+        self.captures = []
+        self.tail = None
+        tokens = pattern.split()
+        for index, token in enumerate(tokens):
+            if self.tail is not None:
+                raise AssertionError("Pattern %s: %s must be the last token"
+                                     % (pattern, tokens[index - 1]))
+            capture = _CAPTURE.match(token)
+            if token == "*":
+                self.tail = ""
+            elif capture is not None:
+                name, size = capture.groups()
+                if size == "*":
+                    self.tail = name
+                    continue
+                size = int(size or 1)
+                self.captures.append((name, self.length, self.length + size))
+                self._add(size, 0, 0)
+            elif _BYTES.match(token):
+                for position in range(0, len(token), 2):
+                    byte = token[position:position + 2]
+                    value = int(byte.replace("?", "0"), 16)
+                    mask = (0 if byte[0] == "?" else 0xF0) | \
+                        (0 if byte[1] == "?" else 0x0F)
+                    self._add(1, value, mask)
+            else:
+                raise AssertionError("Pattern %s: bad token %s" %
+                                     (pattern, token))
+
+    def _add(self, size, value, mask):
+        self.length += size
+        self.value = (self.value << (8 * size)) | value
+        self.mask = (self.mask << (8 * size)) | mask
+
+    def match(self, data, exact=True):
+        """ Return the captured fields of data (bytes), None if it does not
+        match
+        Keyword arguments:
+        data -- received payload
+        exact -- False to accept more bytes than the pattern (default True)
+        """
+        if len(data) < self.length:
+            return None
+        if len(data) > self.length and exact and self.tail is None:
+            return None
+        head = int.from_bytes(data[:self.length], "big")
+        if head & self.mask != self.value:
+            return None
+        fields = {name: bytes(data[start:end]).hex().upper()
+                  for name, start, end in self.captures}
+        if self.tail:
+            fields[self.tail] = bytes(data[self.length:]).hex().upper()
+        return fields
+
+    def __str__(self):
+        return self.pattern
+
+
+@functools.lru_cache(maxsize=1024)
+def compile_pattern(pattern):
+    """ Return the BytePattern of a pattern, compiled once per process
+    """
+    return BytePattern(pattern)
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+import json
+import os
+import queue
+import threading
+import time
+
+import can
+
+
+class LogWriter(can.Listener):
+    """ LogWriter records the CAN traffic from a dedicated writer thread
+        Frames go through a bounded queue so that a slow disk never delays
+        the notifier; frames are counted as dropped when the queue is full.
+        Files are rotated by size or age, and each test case is a segment
+        whose position in the files is saved in <base_name>_index.json.
+    """
+
+    def __init__(self, directory, base_name, log_format="blf",
+                 max_bytes=100 * 1024 * 1024, max_seconds=0,
+                 queue_size=100000):
+        """Instanciate a LogWriter object
+        Keyword arguments:
+        directory -- directory of the log files
+        base_name -- prefix of the log file names
+        log_format -- file extension given to can.Logger
+                      (blf, asc.gz, log.gz, ...) (default blf)
+        max_bytes -- rotate when a file reaches this uncompressed size,
+                     0 to disable (default 100MB)
+        max_seconds -- rotate when a file is older, 0 to disable
+                       (default 0)
+        queue_size -- size of the queue to the writer thread
+                      (default 100000)
+        """
+        self.directory = directory
+        self.base_name = base_name
+        self.log_format = log_format
+        self.max_bytes = int(max_bytes)
+        self.max_seconds = float(max_seconds)
+        self.queue = queue.Queue(maxsize=int(queue_size))
+        self.index_path = os.path.join(directory, base_name + "_index.json")
+        self.segments = []
+        self.segment = None
+        self.file_number = 0
+        self.file_name = None
+        self.writer = None
+        self.opened_at = 0
+        self.file_frames = 0
+        self.written = 0
+        self.dropped = 0
+        self.stopped = False
+        self.thread = threading.Thread(target=self._run, daemon=True,
+                                       name="LogWriter %s" % (base_name,))
+        self.thread.start()
+
+    def on_message_received(self, msg):
+        try:
+            self.queue.put_nowait(msg)
+        except queue.Full:
+            self.dropped += 1
+
+    def start_segment(self, name):
+        """ Start the segment of a test case
+        """
+        self.queue.put(("start", name, self.dropped))
+
+    def end_segment(self, timeout=5):
+        """ End the current segment once its frames are written
+        Return the segment record (files, frames, dropped)
+        """
+        done = threading.Event()
+        result = {}
+        self.queue.put(("end", (done, result), self.dropped))
+        done.wait(timeout)
+        return result.get("segment")
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            if isinstance(item, tuple):
+                self._control(*item)
+                continue
+            if self.writer is None or self._must_rotate():
+                self._open()
+            self.writer.on_message_received(item)
+            self.file_frames += 1
+            self.written += 1
+            if self.segment is not None:
+                self.segment["frames"] += 1
+        self._control("end", None, self.dropped)
+        self._close()
+
+    def _control(self, action, argument, dropped):
+        if action == "start":
+            self._control("end", None, dropped)
+            if self.writer is None:
+                self._open()
+            self.segment = {"test": argument,
+                            "start_time": time.time(),
+                            "frames": 0,
+                            "dropped": dropped,
+                            "parts": [{"file": self.file_name,
+                                       "first_frame": self.file_frames}]}
+        elif action == "end":
+            segment = self.segment
+            if segment is not None:
+                segment["end_time"] = time.time()
+                segment["dropped"] = dropped - segment["dropped"]
+                self.segments.append(segment)
+                self.segment = None
+                self._save_index()
+            if argument is not None:
+                done, result = argument
+                result["segment"] = segment
+                done.set()
+
+    def _must_rotate(self):
+        if self.max_bytes:
+            if hasattr(self.writer, "file_size"):
+                size = self.writer.file_size()
+            else:
+                size = os.path.getsize(self.file_name)
+            if size >= self.max_bytes:
+                return True
+        if self.max_seconds and \
+                time.time() - self.opened_at >= self.max_seconds:
+            return True
+        return False
+
+    def _open(self):
+        self._close()
+        self.file_number += 1
+        self.file_name = os.path.join(
+            self.directory, "%s_%03d.%s" % (self.base_name, self.file_number,
+                                            self.log_format))
+        self.writer = can.Logger(self.file_name)
+        self.opened_at = time.time()
+        self.file_frames = 0
+        if self.segment is not None:
+            self.segment["parts"].append({"file": self.file_name,
+                                          "first_frame": 0})
+
+    def _close(self):
+        if self.writer is not None:
+            self.writer.stop()
+            self.writer = None
+
+    def _save_index(self):
+        with open(self.index_path, "w") as index_file:
+            json.dump(self.segments, index_file, indent=1)
+
+    def stop(self):
+        """ Write the pending frames and close the files
+        """
+        if self.stopped:
+            return
+        self.stopped = True
+        self.queue.put(None)
+        self.thread.join()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+import hashlib
+import os
+import pickle
+import threading
+
+import cantools
+
+from dbindex import DatabaseIndex
+
+
+class DatabaseCache:
+    """ DatabaseCache keeps the parsed CAN databases and their indexes
+        An entry is reused while the file path, mtime and size are the
+        same. When they change the content hash is computed: an unchanged
+        content is still a hit, otherwise the file is parsed again.
+        When cache_dir is set, parsed databases are also pickled in it,
+        named by content hash, so that a new Robot run skips the parsing
+        too.
+    """
+
+    def __init__(self, cache_dir=None):
+        """Instanciate a DatabaseCache object
+        Keyword argument:
+        cache_dir -- directory of the pickled databases
+                     (default None, only the memory cache)
+        """
+        self.cache_dir = cache_dir
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def load(self, path):
+        """ Return the (database, DatabaseIndex) of the file at path
+        """
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is not None and \
+                    entry["stamp"] == (stat.st_mtime_ns, stat.st_size):
+                self.memory_hits += 1
+                return entry["db"], entry["index"]
+            digest = self._digest(path)
+            if entry is not None and entry["digest"] == digest:
+                entry["stamp"] = (stat.st_mtime_ns, stat.st_size)
+                self.memory_hits += 1
+                return entry["db"], entry["index"]
+            loaded = self._load_pickle(digest)
+            if loaded is not None:
+                self.disk_hits += 1
+            else:
+                self.misses += 1
+                db = cantools.database.load_file(path)
+                loaded = (db, DatabaseIndex(db))
+                self._save_pickle(digest, loaded)
+            self.entries[path] = {"stamp": (stat.st_mtime_ns, stat.st_size),
+                                  "digest": digest,
+                                  "db": loaded[0],
+                                  "index": loaded[1]}
+            return loaded
+
+    def _digest(self, path):
+        sha = hashlib.sha256()
+        with open(path, "rb") as db_file:
+            for chunk in iter(lambda: db_file.read(1 << 20), b""):
+                sha.update(chunk)
+        return sha.hexdigest()
+
+    def _pickle_path(self, digest):
+        # Pickles are only valid for the cantools version that made them
+        return os.path.join(self.cache_dir, "%s_cantools-%s.pickle" %
+                            (digest, cantools.__version__))
+
+    def _load_pickle(self, digest):
+        if self.cache_dir is None:
+            return None
+        try:
+            with open(self._pickle_path(digest), "rb") as pickle_file:
+                return pickle.load(pickle_file)
+        except (OSError, pickle.UnpicklingError, EOFError,
+                AttributeError, ImportError):
+            return None
+
+    def _save_pickle(self, digest, loaded):
+        if self.cache_dir is None:
+            return
+        path = self._pickle_path(digest)
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            # Write then rename so that a parallel run never reads
+            # a partial file
+            with open(path + ".tmp%d" % os.getpid(), "wb") as pickle_file:
+                pickle.dump(loaded, pickle_file,
+                            protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(path + ".tmp%d" % os.getpid(), path)
+        except (OSError, pickle.PicklingError):
+            pass
+
+    def clear(self):
+        """ Forget the databases kept in memory
+        """
+        with self.lock:
+            self.entries.clear()
+
+    def get_stats(self):
+        """ Return the hit and miss counters as a dictionary
+        """
+        return {"memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "entries": len(self.entries)}
+
+
+# Shared by every Curf instance of the process, the disk cache is enabled
+# by the CURF_DB_CACHE_DIR environment variable
+database_cache = DatabaseCache(os.environ.get("CURF_DB_CACHE_DIR") or None)
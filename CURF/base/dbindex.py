@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+
+
+class DatabaseIndex:
+    """ DatabaseIndex holds the lookup tables of a CAN database
+        Tables are built once when the database is loaded so that
+        signal, message name and frame ID lookups are O(1)
+    """
+
+    def __init__(self, db):
+        """Instanciate a DatabaseIndex object
+        Keyword argument:
+        db -- cantools database to index
+        """
+        self.by_name = {}
+        self.by_frame_id = {}
+        self.by_signal = {}
+        self.duplicates = {}
+        for message in db.messages:
+            self.by_name[message.name] = message
+            self.by_frame_id.setdefault(message.frame_id, message)
+            for signal in message.signals:
+                # MESSAGE.SIGNAL is always unique
+                self.by_signal[message.name + "." + signal.name] = message
+                if signal.name not in self.by_signal:
+                    self.by_signal[signal.name] = message
+                else:
+                    first = self.by_signal[signal.name].name
+                    self.duplicates.setdefault(
+                        signal.name, [first]).append(message.name)
+
+    def get_duplicates_report(self):
+        """ Return a printable report of the signals defined in
+        several messages, None if there is no duplicate
+        """
+        if not self.duplicates:
+            return None
+        lines = ["Signals defined in several messages "
+                 "(first message is used, "
+                 "use MESSAGE.SIGNAL to select another one):"]
+        for signal_name, messages in sorted(self.duplicates.items()):
+            lines.append("  %s: %s" % (signal_name, ", ".join(messages)))
+        return "\n".join(lines)
+
+    def message_by_signal(self, signal_name):
+        """ Return the message holding signal_name, None if unknown
+        """
+        return self.by_signal.get(signal_name)
+
+    def message_by_name(self, message_name):
+        """ Return the message named message_name, None if unknown
+        """
+        return self.by_name.get(message_name)
+
+    def message_by_frame_id(self, frame_id):
+        """ Return the message with the given frame ID, None if unknown
+        """
+        return self.by_frame_id.get(frame_id)
+
+    @staticmethod
+    def signal_short_name(signal_name):
+        """ Return the signal name without its MESSAGE. prefix
+        """
+        return signal_name.rsplit(".", 1)[-1]
@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+import importlib
+import threading
+import time
+
+import isotp
+
+from metrics import metrics
+
+DEFAULT_SESSION = 0x01
+
+
+def add_constants(seed, level, constant_1=0, constant_2=0):
+    """ Return the key of a seed: the seed plus two constants, on the
+    length of the seed (4 bytes at least)
+    This is the "dumb" example of the Get Seedkey keyword, you must
+    implement the security handshake of your ECU.
+    Keyword arguments:
+    seed -- seed sent by the ECU (bytes)
+    level -- security level of the seed request (odd sub-function)
+    constant_1 -- first constant (int or hexadecimal string)
+    constant_2 -- second constant (int or hexadecimal string)
+    """
+    length = max(4, len(seed))
+    key = int.from_bytes(seed, "big") + _to_int(constant_1) + \
+        _to_int(constant_2)
+    return (key & ((1 << (8 * length)) - 1)).to_bytes(length, "big")
+
+
+def _to_int(value):
+    if isinstance(value, str):
+        return int(value, 16)
+    return int(value)
+
+
+# Seed and key algorithms by name, a function(seed, level, **params)
+# returning the key as bytes
+KEY_ALGORITHMS = {"add_constants": add_constants}
+
+
+def get_key_algorithm(name):
+    """ Return the seed and key function of a name of KEY_ALGORITHMS or a
+    module.function path importable by Python
+    """
+    if name in KEY_ALGORITHMS:
+        return KEY_ALGORITHMS[name]
+    module_name, _, function_name = name.rpartition(".")
+    try:
+        function = getattr(importlib.import_module(module_name),
+                           function_name)
+    except (ImportError, ValueError, AttributeError):
+        raise AssertionError("Unknown seed and key algorithm: %s, known "
+                             "algorithms: %s or module.function" %
+                             (name, ", ".join(KEY_ALGORITHMS)))
+    if not callable(function):
+        raise AssertionError("%s is not a function" % (name))
+    return function
+
+
+class DiagSession:
+    """ DiagSession tracks the diagnostic session and the security level
+        of the ECU of an IsotpLink
+        The state is read from the positive responses received on the
+        link (0x50, 0x51 and 0x67), whatever keyword sent the request, so
+        entering a session or unlocking a level already established is
+        skipped. A background thread sends TesterPresent (3E 80) when no
+        request was sent for a period, so the ECU stays in its session
+        (S3 timer) during long waits. Without it the session is assumed
+        back to default after s3_timeout.
+    """
+
+    def __init__(self, link, s3_timeout=5.0):
+        """Instanciate a DiagSession object
+        Keyword arguments:
+        link -- IsotpLink of the ECU
+        s3_timeout -- time in second after which the ECU leaves a non
+                      default session without request (default 5)
+        """
+        self.link = link
+        self.s3_timeout = s3_timeout
+        self.session = DEFAULT_SESSION
+        self.security_level = None
+        self.key_function = add_constants
+        self.key_params = {}
+        self.period = None
+        self.thread = None
+        self.stop_event = threading.Event()
+        self.last_tester_present = None
+        self.stats = {"session_requests": 0, "session_skipped": 0,
+                      "security_requests": 0, "security_skipped": 0,
+                      "tester_present": 0}
+        link.response_listener = self.observe
+
+    def observe(self, response):
+        """ Update the state from a response received on the link
+        """
+        if len(response) >= 2 and response[0] == 0x50:
+            self.session = response[1] & 0x7F
+            self.security_level = None
+        elif len(response) >= 2 and response[0] == 0x51:
+            self.session = DEFAULT_SESSION
+            self.security_level = None
+        elif len(response) == 2 and response[0] == 0x67 and \
+                not response[1] & 0x01:
+            self.security_level = (response[1] & 0x7F) - 1
+
+    def _last_activity(self):
+        times = [stamp for stamp in (self.link.last_request,
+                                     self.last_tester_present)
+                 if stamp is not None]
+        return max(times) if times else None
+
+    def get_session(self):
+        """ Return the current session, the default one if the S3 timer
+        of the ECU expired
+        """
+        last = self._last_activity()
+        if self.session != DEFAULT_SESSION and last is not None and \
+                time.time() - last > self.s3_timeout:
+            self.session = DEFAULT_SESSION
+            self.security_level = None
+        return self.session
+
+    def get_state(self):
+        """ Return the session, the security level and the counters
+        """
+        return dict(self.stats, session=self.get_session(),
+                    security_level=self.security_level,
+                    tester_present_period=self.period)
+
+    def reset(self):
+        """ Forget the state, e.g. after a power cycle of the ECU
+        """
+        self.session = DEFAULT_SESSION
+        self.security_level = None
+
+    def _request(self, data, timeout, pending_timeout):
+        self.link.clear()
+        self.link.send(data)
+        response = self.link.wait_response(timeout, pending_timeout)
+        if response is None:
+            raise AssertionError("Error CAN TimeOut Reached")
+        if response[0] == 0x7F:
+            raise AssertionError("Negative response %s to %s" %
+                                 (response.hex().upper(), data.hex().upper()))
+        return response
+
+    def change_session(self, session, timeout=2, pending_timeout=5,
+                       force=False):
+        """ Enter a diagnostic session (0x10) if it is not the current one
+        Return the response, None if the request was skipped.
+        Keyword arguments:
+        session -- diagnosticSessionType (int)
+        timeout -- response timeout in second (P2)
+        pending_timeout -- timeout after a response pending (P2*)
+        force -- send the request even in the session
+        """
+        if not force and self.get_session() == session:
+            self.stats["session_skipped"] += 1
+            return None
+        self.stats["session_requests"] += 1
+        response = self._request(bytes((0x10, session)), timeout,
+                                 pending_timeout)
+        if response[:2] != bytes((0x50, session)):
+            raise AssertionError("Bad DiagnosticSessionControl response %s"
+                                 % (response.hex().upper()))
+        return response
+
+    def set_key_algorithm(self, function, **params):
+        """ Compute the keys with function(seed, level, **params)
+        """
+        self.key_function = function
+        self.key_params = params
+
+    def unlock(self, level, timeout=2, pending_timeout=5, force=False):
+        """ Unlock a security level (0x27) if it is not already unlocked
+        Return True if the seed and key were exchanged.
+        Keyword arguments:
+        level -- requestSeed sub-function (odd int)
+        timeout -- response timeout in second (P2)
+        pending_timeout -- timeout after a response pending (P2*)
+        force -- exchange the seed and key even if unlocked
+        """
+        if level % 2 == 0:
+            raise AssertionError("Security level %02X is not a requestSeed "
+                                 "sub-function (odd)" % (level))
+        self.get_session()
+        if not force and self.security_level == level:
+            self.stats["security_skipped"] += 1
+            return False
+        self.stats["security_requests"] += 1
+        response = self._request(bytes((0x27, level)), timeout,
+                                 pending_timeout)
+        if response[:2] != bytes((0x67, level)):
+            raise AssertionError("Bad SecurityAccess seed response %s" %
+                                 (response.hex().upper()))
+        seed = response[2:]
+        if not any(seed):
+            # A zero seed means the level is already unlocked
+            self.security_level = level
+            return False
+        key = bytes(self.key_function(seed, level, **self.key_params))
+        metrics.log("DEBUG", "seed", seed.hex(), "key", key.hex())
+        response = self._request(bytes((0x27, level + 1)) + key, timeout,
+                                 pending_timeout)
+        if response[:2] != bytes((0x67, level + 1)):
+            raise AssertionError("Bad SecurityAccess key response %s" %
+                                 (response.hex().upper()))
+        return True
+
+    def start_tester_present(self, period=2.0):
+        """ Send TesterPresent without response (3E 80) when no request was
+        sent during period, from a background thread
+        The frame is queued on the link after the transfer in progress
+        and the foreground requests never wait for it.
+        """
+        self.period = float(period)
+        if self.thread is not None:
+            return
+        self.stop_event.clear()
+        self.thread = threading.Thread(
+            target=self._run, daemon=True,
+            name="TesterPresent %s" % (self.link.address,))
+        self.thread.start()
+
+    def stop_tester_present(self):
+        """ Stop sending TesterPresent
+        """
+        if self.thread is None:
+            return
+        self.stop_event.set()
+        self.thread.join(2)
+        self.thread = None
+        self.period = None
+
+    def _run(self):
+        while not self.stop_event.is_set():
+            now = time.time()
+            last = self._last_activity()
+            if last is None or now - last >= self.period:
+                try:
+                    self.link.send_nowait(
+                        b"\x3E\x80", isotp.TargetAddressType.Functional)
+                except (RuntimeError, ValueError) as error:
+                    metrics.log("WARN", "TesterPresent not sent:", error)
+                self.last_tester_present = now
+                self.stats["tester_present"] += 1
+                last = now
+            self.stop_event.wait(max(0.0, last + self.period - time.time()))
+
+    def close(self):
+        """ Stop the background thread and detach from the link
+        """
+        self.stop_tester_present()
+        if self.link.response_listener == self.observe:
+            self.link.response_listener = None
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+
+# statusOfDTC bit names, bit 0 first
+STATUS_BITS = ["testFailed",
+               "testFailedThisMonitoringCycle",
+               "pendingDTC",
+               "confirmedDTC",
+               "testNotCompletedSinceLastClear",
+               "testFailedSinceLastClear",
+               "testNotCompletedThisMonitoringCycle",
+               "warningIndicatorRequested"]
+
+# Sub-functions answering DTCAndStatusAvailabilityMask + [DTC, status]*
+_STATUS_LISTS = (0x02, 0x0A, 0x0B, 0x0C, 0x0D, 0x0E, 0x0F, 0x13, 0x15)
+# Sub-functions answering a number of DTCs
+_COUNTS = (0x01, 0x07, 0x11, 0x12)
+# Sub-functions answering a DTC, its status and records of the DTC
+_DTC_RECORDS = (0x04, 0x06, 0x10)
+
+
+class DtcRecords:
+    """ DtcRecords is a decoded ReadDTCInformation (0x59) response
+        The DTCs and their status are kept as columns of bytes sliced from
+        the response, so a status check over hundreds of DTCs is a single
+        bytes.translate() pass instead of a loop.
+    """
+
+    def __init__(self, response):
+        """Instanciate a DtcRecords object
+        Keyword argument:
+        response -- positive response to ReadDTCInformation (bytes)
+        """
+        if len(response) < 2 or response[0] != 0x59:
+            raise AssertionError("Not a ReadDTCInformation response: %s" %
+                                 (bytes(response).hex().upper()))
+        self.sub_function = response[1]
+        self.availability_mask = None
+        self.format = None
+        self.count = None
+        self.severities = b""
+        self.functional_units = b""
+        self.record_data = None
+        # Fourth byte of each record: status, fault detection counter or
+        # snapshot record number depending on the sub-function
+        column = "status"
+        sub_function = self.sub_function
+        if sub_function in _COUNTS:
+            if len(response) < 6:
+                raise AssertionError("Bad DTC count response")
+            self.availability_mask = response[2]
+            self.format = response[3]
+            self.count = int.from_bytes(response[4:6], "big")
+            body, width = b"", 4
+        elif sub_function in _STATUS_LISTS:
+            self.availability_mask = response[2] if len(response) > 2 else 0
+            body, width = response[3:], 4
+        elif sub_function == 0x17:
+            self.availability_mask = response[3] if len(response) > 3 else 0
+            body, width = response[4:], 4
+        elif sub_function in (0x08, 0x09):
+            self.availability_mask = response[2] if len(response) > 2 else 0
+            body, width = response[3:], 6
+        elif sub_function == 0x14:
+            body, width, column = response[2:], 4, "fault_detection_counter"
+        elif sub_function == 0x03:
+            body, width, column = response[2:], 4, "record_number"
+        elif sub_function in _DTC_RECORDS:
+            self.record_data = bytes(response[6:])
+            body, width = response[2:6], 4
+        else:
+            raise AssertionError("ReadDTCInformation sub-function 0x%02X "
+                                 "is not supported" % (sub_function))
+        body = bytes(body)
+        if len(body) % width:
+            raise AssertionError("Truncated DTC record in %s" %
+                                 (bytes(response).hex().upper()))
+        offset = width - 4
+        if width == 6:
+            self.severities = body[0::width]
+            self.functional_units = body[1::width]
+        self.column = column
+        self.dtc_high = body[offset::width]
+        self.dtc_middle = body[offset + 1::width]
+        self.dtc_low = body[offset + 2::width]
+        self.values = body[offset + 3::width]
+
+    def __len__(self):
+        return len(self.values)
+
+    def get_dtcs(self):
+        """ Return the DTC numbers in hexadecimal (123456, ...)
+        """
+        return ["%02X%02X%02X" % dtc for dtc in
+                zip(self.dtc_high, self.dtc_middle, self.dtc_low)]
+
+    def get_records(self):
+        """ Return one dictionary per DTC
+        """
+        records = []
+        for index, dtc in enumerate(self.get_dtcs()):
+            record = {"dtc": dtc, self.column: self.values[index]}
+            if self.column == "status":
+                record.update(decode_status(self.values[index]))
+            if self.severities:
+                record["severity"] = self.severities[index]
+                record["functional_unit"] = self.functional_units[index]
+            if self.record_data is not None:
+                record["data"] = self.record_data.hex().upper()
+            records.append(record)
+        return records
+
+    def check_status(self, bits, dtcs=None):
+        """ Return the DTCs whose status does not have the expected bits
+        Keyword arguments:
+        bits -- dictionary of bit name (testFailed, ...) to 0 or 1
+        dtcs -- DTC numbers to check, in hexadecimal with or without 0x
+                (default all)
+        """
+        if self.column != "status":
+            raise AssertionError("Sub-function 0x%02X has no DTC status" %
+                                 (self.sub_function))
+        mask, value = status_mask(bits)
+        # 1 for each status byte value having the expected bits
+        table = bytes(1 if byte & mask == value else 0 for byte in range(256))
+        results = self.values.translate(table)
+        if dtcs is None:
+            if results.find(0) < 0:
+                return []
+            return [dtc for dtc, result in zip(self.get_dtcs(), results)
+                    if not result]
+        known = dict(zip(self.get_dtcs(), results))
+        failed = []
+        for dtc in dtcs:
+            dtc = dtc.upper()
+            if dtc.startswith("0X"):
+                dtc = dtc[2:]
+            if dtc not in known:
+                raise AssertionError("DTC %s is not in the response" % (dtc))
+            if not known[dtc]:
+                failed.append(dtc)
+        return failed
+
+
+def decode_status(status):
+    """ Return the statusOfDTC bits by name
+    """
+    return {name: (status >> bit) & 1 for bit, name in enumerate(STATUS_BITS)}
+
+
+def status_mask(bits):
+    """ Return (mask, value) of the expected statusOfDTC bits
+    Keyword argument:
+    bits -- dictionary of bit name (testFailed, ...) to 0 or 1
+    """
+    mask = 0
+    value = 0
+    for name, bit_value in bits.items():
+        if name not in STATUS_BITS:
+            raise AssertionError("Bit Name Must Be One of Those:\n" +
+                                 "\n".join(STATUS_BITS) +
+                                 "\nBut Was:\n" + name)
+        bit = 1 << STATUS_BITS.index(name)
+        mask |= bit
+        if int(bit_value):
+            value |= bit
+    return mask, value
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+import mmap
+import os
+import time
+
+
+class FlashDownload:
+    """ FlashDownload streams an image file to an ECU with the UDS
+        services RequestDownload (0x34), TransferData (0x36) and
+        RequestTransferExit (0x37)
+        The file is memory mapped and every request is built from a view
+        of the map: only the block in flight is copied, the image is never
+        read as a whole nor hex encoded.
+    """
+
+    def __init__(self, link, timeout=1.0, pending_timeout=5.0):
+        """Instanciate a FlashDownload object
+        Keyword arguments:
+        link -- IsotpLink of the ECU
+        timeout -- time to wait for each response in second (P2)
+        pending_timeout -- time to wait after a response pending in second
+                           (P2*)
+        """
+        self.link = link
+        self.timeout = float(timeout)
+        self.pending_timeout = float(pending_timeout)
+        self.max_block_length = None
+
+    def request(self, data):
+        """ Send a request and return its positive response
+        Raise AssertionError on a negative response or a timeout
+        """
+        self.link.clear()
+        self.link.send(data)
+        return self.check_response(data[0])
+
+    def check_response(self, service):
+        """ Return the positive response of a service
+        Raise AssertionError on a negative response or a timeout
+        """
+        response = self.link.wait_response(self.timeout, self.pending_timeout)
+        if response is None:
+            raise AssertionError("No response to service 0x%02X" % (service))
+        if response[0] == 0x7F:
+            raise AssertionError(
+                "Service 0x%02X refused with NRC 0x%02X" %
+                (service, response[2] if len(response) > 2 else 0))
+        if response[0] != service + 0x40:
+            raise AssertionError("Unexpected response %s to service 0x%02X" %
+                                 (response.hex().upper(), service))
+        return response
+
+    def request_download(self, memory_address, memory_size, data_format=0x00,
+                         address_and_length_format=0x44):
+        """ Send a RequestDownload and return maxNumberOfBlockLength
+        Keyword arguments:
+        memory_address -- start address of the download
+        memory_size -- number of bytes to download
+        data_format -- dataFormatIdentifier (compression, encryption)
+        address_and_length_format -- addressAndLengthFormatIdentifier:
+                                     size length << 4 | address length
+        """
+        size_length = address_and_length_format >> 4
+        address_length = address_and_length_format & 0x0F
+        for name, value, length in (("memory address", memory_address,
+                                     address_length),
+                                    ("memory size", memory_size,
+                                     size_length)):
+            if length == 0 or not 0 <= value < 1 << (8 * length):
+                raise AssertionError(
+                    "The %s 0x%X does not fit on %d bytes, see the "
+                    "addressAndLengthFormatIdentifier 0x%02X" %
+                    (name, value, length, address_and_length_format))
+        request = (bytes([0x34, data_format, address_and_length_format]) +
+                   memory_address.to_bytes(address_length, "big") +
+                   memory_size.to_bytes(size_length, "big"))
+        response = self.request(request)
+        # lengthFormatIdentifier: length of maxNumberOfBlockLength << 4
+        length = response[1] >> 4
+        if length == 0 or len(response) < 2 + length:
+            raise AssertionError("Bad RequestDownload response %s" %
+                                 (response.hex().upper()))
+        self.max_block_length = int.from_bytes(response[2:2 + length], "big")
+        if self.max_block_length <= 2:
+            raise AssertionError("maxNumberOfBlockLength %d is too short" %
+                                 (self.max_block_length))
+        return self.max_block_length
+
+    def transfer_data(self, path, offset=0, size=None, max_block_length=None):
+        """ Send a file (or a part of it) with TransferData requests
+        Return a report with the throughput and the block latencies
+        Keyword arguments:
+        path -- path of the image file
+        offset -- first byte of the file to send (default 0)
+        size -- number of bytes to send (default up to the end of file)
+        max_block_length -- length of a TransferData request including its
+                            SID and counter (default negotiated by
+                            request_download)
+        """
+        if max_block_length is None:
+            max_block_length = self.max_block_length
+        if max_block_length is None:
+            raise AssertionError("RequestDownload must be sent first")
+        block_size = max_block_length - 2
+        latencies = []
+        with open(path, "rb") as image_file:
+            file_size = os.fstat(image_file.fileno()).st_size
+            if size is None:
+                size = file_size - offset
+            if offset + size > file_size:
+                raise AssertionError("%s is only %d bytes long" %
+                                     (path, file_size))
+            image = mmap.mmap(image_file.fileno(), 0,
+                              access=mmap.ACCESS_READ) if file_size else b""
+            view = memoryview(image)
+            try:
+                counter = 1
+                start = time.perf_counter()
+                for position in range(offset, offset + size, block_size):
+                    block_start = time.perf_counter()
+                    self.link.clear()
+                    with view[position:min(position + block_size,
+                                           offset + size)] as block:
+                        self.link.send(bytes((0x36, counter)) + block)
+                    response = self.check_response(0x36)
+                    if len(response) < 2 or response[1] != counter:
+                        raise AssertionError(
+                            "TransferData response %s does not echo block "
+                            "counter 0x%02X" %
+                            (response.hex().upper(), counter))
+                    latencies.append(time.perf_counter() - block_start)
+                    # The counter goes 0x01 to 0xFF then wraps to 0x00
+                    counter = (counter + 1) & 0xFF
+                duration = time.perf_counter() - start
+            finally:
+                view.release()
+                if file_size:
+                    image.close()
+        return self.get_report(size, duration, latencies)
+
+    def request_transfer_exit(self, parameter=b""):
+        """ Send a RequestTransferExit and return its response parameters
+        """
+        return self.request(bytes([0x37]) + parameter)[1:]
+
+    def download(self, path, memory_address, data_format=0x00,
+                 address_and_length_format=0x44):
+        """ Download a whole file: RequestDownload, TransferData and
+        RequestTransferExit
+        Return the report of transfer_data, the time of the whole
+        sequence included
+        """
+        start = time.perf_counter()
+        size = os.path.getsize(path)
+        self.request_download(memory_address, size, data_format,
+                              address_and_length_format)
+        report = self.transfer_data(path)
+        self.request_transfer_exit()
+        report["total_duration"] = time.perf_counter() - start
+        return report
+
+    def get_report(self, size, duration, latencies):
+        """ Return the throughput and block latency report of a transfer
+        """
+        ordered = sorted(latencies)
+        count = len(ordered)
+        return {"bytes": size,
+                "blocks": count,
+                "max_block_length": self.max_block_length,
+                "duration": duration,
+                "bytes_per_second": size / duration if duration > 0 else 0.0,
+                "block_latency_mean":
+                    sum(ordered) / count if count else 0.0,
+                "block_latency_max": ordered[-1] if count else 0.0,
+                "block_latency_p99":
+                    ordered[min(count - 1, int(count * 0.99))]
+                    if count else 0.0}
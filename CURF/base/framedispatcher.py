@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+import collections
+import threading
+import time
+
+import can
+
+
+def frame_key(frame_id, is_extended):
+    """ Return the key of the frames of an ID in the dispatcher, the
+    acceptance filter and the checks: a standard and an extended frame
+    of the same ID are told apart
+    Keyword arguments:
+    frame_id -- arbitration ID (int)
+    is_extended -- True for a 29 bits ID
+    """
+    return (frame_id, bool(is_extended))
+
+
+def message_key(message):
+    """ Return the key of the frames of a database message
+    """
+    return frame_key(message.frame_id, message.is_extended_frame)
+
+
+def parse_frame_id(text):
+    """ Return the key of an ID given in hexadecimal
+    As with cansend, an ID written with 8 digits (00000123) is extended and
+    one written with 3 digits or less (123) is standard. An ID above 7FF
+    is always extended.
+    """
+    digits = text[2:] if text[:2] in ("0x", "0X") else text
+    frame_id = int(digits, 16)
+    return frame_key(frame_id, len(digits) == 8 or frame_id > 0x7FF)
+
+
+def format_frame_key(key):
+    """ Return the hexadecimal ID of a key, read back by parse_frame_id()
+    """
+    return ("%08X" if key[1] else "%X") % (key[0])
+
+
+class Subscription:
+    """ Subscription holds the frames received since it was created
+        Frames are filtered by key (see frame_key()) or by a given
+        predicate
+    """
+
+    def __init__(self, dispatcher, ids=None, accept=None, maxlen=10000):
+        """Instanciate a Subscription object
+        Keyword arguments:
+        dispatcher -- FrameDispatcher feeding the subscription
+        ids -- keys of the IDs to keep (default all)
+        accept -- function(msg) returning True for frames to keep
+        maxlen -- maximum number of pending frames, older are dropped
+        """
+        self.dispatcher = dispatcher
+        self.ids = None if ids is None else frozenset(ids)
+        self.accept = accept
+        self.frames = collections.deque(maxlen=maxlen)
+        self.dropped = 0
+        self.woken = False
+
+    def matches(self, msg):
+        """ Return True if the frame is wanted by the subscription
+        """
+        if self.ids is not None and \
+                (msg.arbitration_id, msg.is_extended_id) not in self.ids:
+            return False
+        if self.accept is not None and not self.accept(msg):
+            return False
+        return True
+
+    def get(self, timeout=None):
+        """ Return the next frame, None if timeout is reached
+        """
+        return self.dispatcher.wait_pop(self.frames, timeout)
+
+    def wait(self, timeout=None):
+        """ Wait until a frame is pending or wake() is called
+        Return False if timeout is reached
+        """
+        with self.dispatcher.condition:
+            result = self.dispatcher.wait_for(
+                lambda: len(self.frames) > 0 or self.woken, timeout)
+            self.woken = False
+            return result
+
+    def wake(self):
+        """ Wake up the thread waiting in wait()
+        """
+        with self.dispatcher.condition:
+            self.woken = True
+            self.dispatcher.condition.notify_all()
+
+    def clear(self):
+        """ Forget the pending frames
+        """
+        with self.dispatcher.condition:
+            self.frames.clear()
+
+    def close(self):
+        """ Stop receiving frames
+        """
+        self.dispatcher.unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class FrameDispatcher(can.Listener):
+    """ FrameDispatcher is the single reader of a CAN bus
+        Each received frame is timestamped and stored in a bounded
+        ring buffer per ID, in a bounded ring buffer of raw
+        frames and in the queue of every matching subscription.
+        Check keywords wait on those buffers instead of calling bus.recv
+        so that a frame is never lost for another check.
+        The last frame of each ID is also kept, and the last frames of the
+        watched IDs, for the checks looking back (see SignalHistory).
+        IDs are (arbitration ID, extended) keys, see frame_key().
+    """
+
+    def __init__(self, buffer_size=1000):
+        """Instanciate a FrameDispatcher object
+        Keyword argument:
+        buffer_size -- size of each ring buffer (default 1000)
+        """
+        self.buffer_size = buffer_size
+        self.condition = threading.Condition()
+        self.buffers = {}
+        self.raw = collections.deque(maxlen=buffer_size)
+        self.subscriptions = []
+        self.received = 0
+        self.overflows = 0
+        # Frames without timestamp get the reception time
+        self.stamp_frames = True
+        # Timestamp of the last frame minus the host time it was read at
+        self.clock_offset = 0.0
+        # Keys kept, None for every ID (see AcceptanceFilter)
+        self.accepted_ids = None
+        self.filtered = 0
+        # Last frame by key, never consumed
+        self.latest = {}
+        # Bounded history of the watched arbitration IDs
+        self.history = {}
+
+    def on_message_received(self, msg):
+        key = (msg.arbitration_id, msg.is_extended_id)
+        if self.accepted_ids is not None and key not in self.accepted_ids:
+            self.filtered += 1
+            return
+        if msg.timestamp:
+            self.clock_offset = msg.timestamp - time.time()
+        elif self.stamp_frames:
+            msg.timestamp = time.time()
+        with self.condition:
+            self.received += 1
+            self._store(self.raw, msg)
+            buffer = self.buffers.get(key)
+            if buffer is None:
+                buffer = collections.deque(maxlen=self.buffer_size)
+                self.buffers[key] = buffer
+            self._store(buffer, msg)
+            self.latest[key] = msg
+            history = self.history.get(key)
+            if history is not None:
+                history.append(msg)
+            for subscription in self.subscriptions:
+                if subscription.matches(msg):
+                    if len(subscription.frames) == subscription.frames.maxlen:
+                        subscription.dropped += 1
+                    subscription.frames.append(msg)
+            self.condition.notify_all()
+
+    def _store(self, buffer, msg):
+        if len(buffer) == buffer.maxlen:
+            self.overflows += 1
+        buffer.append(msg)
+
+    def now(self):
+        """ Return the clock used for timeouts
+        """
+        return time.monotonic()
+
+    def frame_time(self):
+        """ Return the current time on the clock of the frame timestamps
+        The interfaces stamping the frames in hardware have their own
+        clock: the host time is mapped to it with the offset measured on
+        the last frame read, accurate to the reception latency.
+        """
+        return time.time() + self.clock_offset
+
+    def wait_for(self, predicate, timeout=None):
+        """ Wait until predicate() is True, the condition must be held
+        Return the last predicate() result
+        """
+        return self.condition.wait_for(predicate, timeout)
+
+    def wait_pop(self, buffer, timeout=None):
+        """ Pop the oldest frame of buffer, waiting at most timeout
+        Return None if no frame is received in timeout
+        """
+        with self.condition:
+            if not self.wait_for(lambda: len(buffer) > 0,
+                                 None if timeout is None else float(timeout)):
+                return None
+            return buffer.popleft()
+
+    def pop(self, key, timeout=None):
+        """ Return the oldest unread frame with the given ID
+        Keyword arguments:
+        key -- key of the wanted ID, see frame_key()
+        timeout -- time to wait in second (default forever)
+        """
+        with self.condition:
+            buffer = self.buffers.get(key)
+            if buffer is None:
+                buffer = collections.deque(maxlen=self.buffer_size)
+                self.buffers[key] = buffer
+        return self.wait_pop(buffer, timeout)
+
+    def next(self, timeout=None):
+        """ Return the oldest unread frame whatever its ID
+        Keyword argument:
+        timeout -- time to wait in second (default forever)
+        """
+        return self.wait_pop(self.raw, timeout)
+
+    def subscribe(self, ids=None, accept=None):
+        """ Return a Subscription receiving the next frames
+        Keyword arguments:
+        ids -- keys of the IDs to keep (default all)
+        accept -- function(msg) returning True for frames to keep
+        """
+        subscription = Subscription(self, ids, accept)
+        with self.condition:
+            self.subscriptions.append(subscription)
+        return subscription
+
+    def watch(self, key, size=100):
+        """ Return the history of the last size frames of an ID
+        The history is kept from the first call on.
+        """
+        with self.condition:
+            history = self.history.get(key)
+            if history is None:
+                history = collections.deque(maxlen=size)
+                latest = self.latest.get(key)
+                if latest is not None:
+                    history.append(latest)
+                self.history[key] = history
+            return history
+
+    def unsubscribe(self, subscription):
+        with self.condition:
+            if subscription in self.subscriptions:
+                self.subscriptions.remove(subscription)
+
+    def discard(self, key):
+        """ Forget the unread frames of an ID, the next pop() returns a
+        frame received from now on
+        The last frame and the history of the ID are kept.
+        """
+        with self.condition:
+            buffer = self.buffers.get(key)
+            if buffer is not None:
+                buffer.clear()
+
+    def clear(self):
+        """ Forget every unread frame and the last frames
+        """
+        with self.condition:
+            self.raw.clear()
+            for buffer in self.buffers.values():
+                buffer.clear()
+            for subscription in self.subscriptions:
+                subscription.frames.clear()
+            self.latest.clear()
+            for history in self.history.values():
+                history.clear()
+
+    def stop(self):
+        with self.condition:
+            self.condition.notify_all()
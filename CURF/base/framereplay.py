@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+import csv
+import os
+import time
+
+import can
+
+from framedispatcher import parse_frame_id
+
+
+def hex_to_bytes(frame_data):
+    """ Return the bytes of an hexadecimal payload (DEADBEEF, 0xDEAD)
+    """
+    if frame_data[:2] in ("0x", "0X"):
+        frame_data = frame_data[2:]
+    if len(frame_data) % 2 == 0:
+        return bytes.fromhex(frame_data)
+    # Odd length: the last char is a byte on its own
+    return bytes.fromhex(frame_data[:-1]) + bytes([int(frame_data[-1], 16)])
+
+
+def parse_row(row):
+    """ Return (can.Message, delta) from an (id, data[, delta]) row
+    """
+    frame_id, is_extended = parse_frame_id(row[0].strip())
+    data = hex_to_bytes(row[1].strip()) if len(row) > 1 else b""
+    delta = float(row[2]) if len(row) > 2 and row[2].strip() else 0.0
+    return can.Message(arbitration_id=frame_id, is_extended_id=is_extended,
+                       data=data), delta
+
+
+def load_frames(source):
+    """ Return the list of (can.Message, delta) to send
+    Keyword argument:
+    source -- list of "ID,DATA[,DELTA]" strings, path of a CSV file of
+              ID,DATA[,DELTA] rows, or path of a log file readable by
+              can.LogReader (asc, blf, log, python-can csv, ...)
+    """
+    if not isinstance(source, str):
+        return [parse_row(row.split(",") if isinstance(row, str) else row)
+                for row in source]
+    if source.lower().endswith(".csv"):
+        with open(source, newline="") as csv_file:
+            rows = [row for row in csv.reader(csv_file) if row]
+        if rows and "timestamp" not in rows[0][0].lower():
+            if not _is_hex(rows[0][0]):
+                rows = rows[1:]
+            return [parse_row(row) for row in rows]
+    if not os.path.exists(source):
+        raise AssertionError("Frame source not found: %s" % (source))
+    frames = []
+    last_timestamp = None
+    for msg in can.LogReader(source):
+        if msg.is_error_frame:
+            continue
+        delta = 0.0 if last_timestamp is None else \
+            msg.timestamp - last_timestamp
+        last_timestamp = msg.timestamp
+        msg.channel = None
+        frames.append((msg, max(delta, 0.0)))
+    return frames
+
+
+def _is_hex(text):
+    try:
+        int(text.strip(), 16)
+        return True
+    except ValueError:
+        return False
+
+
+def send_frames(bus, frames, rate=None, spin_time=0.002):
+    """ Send frames at their own timing or at a fixed rate
+    Each frame has an absolute deadline computed from the start time so
+    that the timing errors do not accumulate. The thread sleeps until
+    spin_time before the deadline then spins on the clock.
+    Return a report with the achieved rate and the timing errors.
+    Keyword arguments:
+    bus -- python-can bus
+    frames -- list of (can.Message, delta) from load_frames()
+    rate -- frames per second, None to keep the deltas (default None)
+    spin_time -- busy wait time before each deadline in second
+    """
+    clock = time.perf_counter
+    total_error = 0.0
+    max_error = 0.0
+    deadline = 0.0
+    start = clock()
+    for index, (msg, delta) in enumerate(frames):
+        if rate is not None:
+            deadline = index / rate
+        else:
+            deadline += delta
+        remaining = start + deadline - clock()
+        if remaining > spin_time:
+            time.sleep(remaining - spin_time)
+        while clock() < start + deadline:
+            pass
+        bus.send(msg)
+        error = clock() - start - deadline
+        total_error += error
+        if error > max_error:
+            max_error = error
+    duration = clock() - start
+    count = len(frames)
+    return {"frames": count,
+            "duration": duration,
+            "frames_per_second": count / duration if duration > 0 else 0.0,
+            "mean_error": total_error / count if count else 0.0,
+            "max_error": max_error,
+            "expected_duration": deadline}
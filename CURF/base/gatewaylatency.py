@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+import collections
+
+from framedispatcher import format_frame_key, parse_frame_id
+from metrics import LatencyStats
+
+
+def parse_routes(routes):
+    """ Return the target ID key of each source ID key (see frame_key())
+    Keyword argument:
+    routes -- IDs in hexadecimal, "123" for a frame routed with the same
+              ID, "123:456" for a frame routed with another ID, read by
+              parse_frame_id()
+    """
+    targets = {}
+    for route in routes:
+        source, _, target = route.partition(":")
+        targets[parse_frame_id(source)] = parse_frame_id(target or source)
+    return targets
+
+
+class GatewayLatency:
+    """ GatewayLatency matches the frames received on a source channel
+        with the frames a gateway routes to a target channel
+        Frames of a route are matched in order, the latency being the
+        difference of their reception timestamps. A source frame not
+        routed within max_latency is lost; a target frame received before
+        any source frame is unmatched.
+    """
+
+    def __init__(self, routes, max_latency=1.0):
+        """Instanciate a GatewayLatency object
+        Keyword arguments:
+        routes -- dictionary of the target ID key of each source ID key,
+                  two sources cannot be routed to the same target
+        max_latency -- time in second after which a frame is lost
+        """
+        self.routes = dict(routes)
+        self.max_latency = float(max_latency)
+        self.sources = {source: collections.deque() for source in routes}
+        self.targets = {source: collections.deque() for source in routes}
+        # Source ID of each target ID
+        self.route_of = {}
+        for source, target in sorted(self.routes.items()):
+            if target in self.route_of:
+                # A routed frame could not be told from the other one
+                raise AssertionError(
+                    "Sources %s and %s are both routed to %s, measure them "
+                    "one at a time" % (format_frame_key(self.route_of[target]),
+                                       format_frame_key(source),
+                                       format_frame_key(target)))
+            self.route_of[target] = source
+        self.stats = {source: LatencyStats() for source in routes}
+        self.lost = dict.fromkeys(routes, 0)
+        self.unmatched = dict.fromkeys(routes, 0)
+        # Latest timestamp seen on both channels
+        self.clock = None
+
+    def put_source(self, msg):
+        """ Add a frame received on the source channel
+        """
+        self._tick(msg.timestamp)
+        key = (msg.arbitration_id, msg.is_extended_id)
+        if key in self.sources:
+            self.sources[key].append(msg.timestamp)
+            self._match(key)
+
+    def put_target(self, msg):
+        """ Add a frame received on the target channel
+        """
+        self._tick(msg.timestamp)
+        source = self.route_of.get((msg.arbitration_id, msg.is_extended_id))
+        if source is not None:
+            self.targets[source].append(msg.timestamp)
+            self._match(source)
+
+    def _tick(self, timestamp):
+        if self.clock is None or timestamp > self.clock:
+            self.clock = timestamp
+
+    def _match(self, source):
+        sources = self.sources[source]
+        targets = self.targets[source]
+        while sources and targets:
+            latency = targets[0] - sources[0]
+            if latency < 0:
+                targets.popleft()
+                self.unmatched[source] += 1
+            elif latency > self.max_latency:
+                sources.popleft()
+                self.lost[source] += 1
+            else:
+                sources.popleft()
+                targets.popleft()
+                self.stats[source].put(latency)
+
+    def get_report(self):
+        """ Return the latency distribution in second of each route
+        Source frames not routed max_latency before the last frame are
+        counted as lost.
+        """
+        if self.clock is not None:
+            for source, sources in self.sources.items():
+                while sources and \
+                        self.clock - sources[0] > self.max_latency:
+                    sources.popleft()
+                    self.lost[source] += 1
+        report = {}
+        for source, target in sorted(self.routes.items()):
+            name = format_frame_key(source) if source == target else \
+                "%s:%s" % (format_frame_key(source), format_frame_key(target))
+            report[name] = self.stats[source].get_report()
+            report[name]["lost"] = self.lost[source]
+            # Received at the end of the measure, maybe not routed yet
+            report[name]["pending"] = len(self.sources[source])
+            report[name]["unmatched"] = self.unmatched[source] + \
+                len(self.targets[source])
+        return report
@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+import queue
+import threading
+import time
+
+import can
+import isotp
+
+from metrics import metrics
+
+
+class IsotpLink:
+    """ IsotpLink binds an ISO-TP transport layer to a FrameDispatcher
+        The stack reads its frames from a dispatcher subscription instead
+        of calling bus.recv, so it does not steal frames from the other
+        keywords.
+        Once started, a background thread processes the stack: it sleeps
+        on the subscription until a frame arrives or a request is sent,
+        and puts every complete PDU in a queue the keywords block on.
+    """
+
+    def __init__(self, bus, dispatcher, address, error_handler=None,
+                 params=None):
+        """Instanciate an IsotpLink object
+        Keyword arguments:
+        bus -- python-can bus used to send frames
+        dispatcher -- FrameDispatcher reading the bus
+        address -- isotp.Address of the link
+        error_handler -- function called on ISO-TP errors
+        params -- isotp.TransportLayer parameters (stmin, blocksize, ...)
+        """
+        self.bus = bus
+        self.address = address
+        # (source, destination, addr_mode) the link was set with
+        self.key = None
+        self.subscription = dispatcher.subscribe(accept=address.is_for_me)
+        self.stack = isotp.TransportLayer(
+            rxfn=self._rxfn, txfn=self._txfn, address=address,
+            error_handler=error_handler, params=params)
+        self.pdus = queue.Queue()
+        self.errors = queue.Queue()
+        self.tx_condition = threading.Condition()
+        # Held by the thread while it processes the stack
+        self.stack_lock = threading.Lock()
+        self.thread = None
+        self.running = False
+        # End of the last request, for the round trip time
+        self.sent_at = None
+        # Start of the last request sent by send()
+        self.last_request = None
+        # Function called with every received PDU (see DiagSession)
+        self.response_listener = None
+
+    def _rxfn(self, timeout=0.0):
+        msg = self.subscription.get(timeout)
+        if msg is None or msg.is_error_frame or msg.is_remote_frame:
+            return None
+        return isotp.CanMessage(arbitration_id=msg.arbitration_id,
+                                data=msg.data,
+                                extended_id=msg.is_extended_id,
+                                is_fd=msg.is_fd,
+                                bitrate_switch=msg.bitrate_switch)
+
+    def _txfn(self, isotp_msg):
+        self.bus.send(can.Message(arbitration_id=isotp_msg.arbitration_id,
+                                  data=isotp_msg.data,
+                                  is_extended_id=isotp_msg.is_extended_id,
+                                  is_fd=isotp_msg.is_fd,
+                                  bitrate_switch=isotp_msg.bitrate_switch))
+
+    def start(self):
+        """ Start the background processing thread
+        """
+        if self.running:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True,
+                                       name="IsotpLink %s" % (self.address,))
+        self.thread.start()
+
+    def stop(self):
+        """ Stop the background processing thread
+        """
+        if not self.running:
+            return
+        self.running = False
+        self.subscription.wake()
+        self.thread.join(2)
+        self.thread = None
+
+    def set_params(self, params):
+        """ Change parameters of the stack (stmin, blocksize, wftmax,
+        tx_padding, rx_flowcontrol_timeout, tx_data_length, can_fd, ...)
+        The transfers in progress are stopped. The thread is paused
+        between two process() calls while the stack is changed.
+        """
+        for name in params:
+            if name not in self.stack.params.__slots__:
+                raise AssertionError("Unknown ISO-TP parameter: %s" % (name))
+        with self.stack_lock:
+            previous = {}
+            for name, value in params.items():
+                previous[name] = getattr(self.stack.params, name)
+                self.stack.params.set(name, value, validate=False)
+            try:
+                self.stack.params.validate()
+            except ValueError as error:
+                for name, value in previous.items():
+                    self.stack.params.set(name, value, validate=False)
+                raise AssertionError("Bad ISO-TP parameters: %s" % (error))
+            self.stack.stop_sending()
+            self.stack.stop_receiving()
+            self.stack.load_params()
+        # Sleep time of the thread may have changed
+        self.subscription.wake()
+
+    def get_params(self):
+        """ Return the parameters of the stack
+        """
+        return {name: getattr(self.stack.params, name)
+                for name in self.stack.params.__slots__
+                if name not in ("logger_name", "wait_func")}
+
+    def _is_active(self):
+        return (self.stack.transmitting() or
+                self.stack.rx_state != self.stack.RxState.IDLE)
+
+    def _run(self):
+        while self.running:
+            with self.stack_lock:
+                try:
+                    self.stack.process()
+                except Exception as error:
+                    self.errors.put(error)
+                pdus = []
+                while self.stack.available():
+                    pdus.append(self.stack.recv())
+                active = self._is_active()
+                sleep_time = self.stack.sleep_time()
+            for data in pdus:
+                self._put_pdu(data)
+            with self.tx_condition:
+                self.tx_condition.notify_all()
+            if active:
+                # Timers of the stack (STmin, FC, CF timeouts) are running
+                self.subscription.wait(sleep_time)
+            else:
+                self.subscription.wait()
+
+    def _put_pdu(self, data):
+        now = time.time()
+        self._measure(data, now)
+        if self.response_listener is not None:
+            self.response_listener(data)
+        self.pdus.put((now, data))
+
+    def _measure(self, data, now):
+        if len(data) >= 3 and data[0] == 0x7F and data[2] == 0x78:
+            metrics.count("isotp_nrc_78")
+        elif self.sent_at is not None:
+            metrics.observe("isotp_round_trip", now - self.sent_at)
+            self.sent_at = None
+
+    def _raise_errors(self):
+        try:
+            error = self.errors.get_nowait()
+        except queue.Empty:
+            return
+        raise error
+
+    def send(self, data, target_address_type=None, timeout=None):
+        """ Send a PDU and wait for the end of its transmission
+        Keyword arguments:
+        data -- payload to send (bytes)
+        target_address_type -- isotp.TargetAddressType (default Physical)
+        timeout -- maximum transmission time in second (default forever)
+        """
+        self._raise_errors()
+        metrics.count("isotp_requests")
+        self.sent_at = time.time()
+        self.last_request = self.sent_at
+        if target_address_type is None:
+            self.stack.send(data)
+        else:
+            self.stack.send(data, target_address_type)
+        if not self.running:
+            while self.stack.transmitting():
+                self.stack.process()
+                time.sleep(self.stack.sleep_time())
+            return
+        self.subscription.wake()
+        with self.tx_condition:
+            self.tx_condition.wait_for(
+                lambda: not self.stack.transmitting(), timeout)
+        self._raise_errors()
+
+    def send_nowait(self, data, target_address_type=None):
+        """ Queue a single frame PDU without waiting for its transmission
+        It is sent after the transfer in progress, if any.
+        Keyword arguments:
+        data -- payload to send (bytes)
+        target_address_type -- isotp.TargetAddressType (default Physical)
+        """
+        if target_address_type is None:
+            self.stack.send(data)
+        else:
+            self.stack.send(data, target_address_type)
+        self.subscription.wake()
+
+    def recv(self, timeout=None):
+        """ Return the next received PDU, None if timeout is reached
+        Keyword argument:
+        timeout -- time to wait in second (default forever)
+        """
+        self._raise_errors()
+        if not self.running:
+            end_time = time.time() + (timeout or 0)
+            while True:
+                self.stack.process()
+                if self.stack.available():
+                    data = self.stack.recv()
+                    self._measure(data, time.time())
+                    return data
+                if time.time() >= end_time:
+                    return None
+        try:
+            return self.pdus.get(timeout=timeout)[1]
+        except queue.Empty:
+            return None
+
+    def wait_response(self, timeout, pending_timeout=None):
+        """ Return the response to a request, None if timeout is reached
+        A negative response 7F XX 78 (response pending) restarts the
+        timer with pending_timeout.
+        Keyword arguments:
+        timeout -- time to wait for the response in second (P2)
+        pending_timeout -- time to wait after a response pending in second
+                           (P2*) (default timeout)
+        """
+        if pending_timeout is None:
+            pending_timeout = timeout
+        end_time = time.time() + timeout
+        while True:
+            data = self.recv(max(0.0, end_time - time.time()))
+            if data is None:
+                return None
+            if len(data) >= 3 and data[0] == 0x7F and data[2] == 0x78:
+                end_time = time.time() + pending_timeout
+                continue
+            return data
+
+    def clear(self):
+        """ Forget the received and unread PDUs
+        """
+        while not self.pdus.empty():
+            self.pdus.get_nowait()
+
+    def close(self):
+        """ Stop the link and detach it from the dispatcher
+        """
+        self.stop()
+        self.subscription.close()
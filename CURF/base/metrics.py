@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+import bisect
+import threading
+import time
+
+import can
+
+# Upper bounds of the latency histogram buckets: 10us to ~168s
+BUCKETS = [0.00001 * 2 ** index for index in range(25)]
+
+LEVELS = {"TRACE": 0, "DEBUG": 10, "INFO": 20, "WARN": 30, "NONE": 100}
+
+
+class LatencyStats:
+    """ LatencyStats is a histogram of durations with power of two buckets
+    """
+
+    def __init__(self):
+        """Instanciate a LatencyStats object
+        """
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self.buckets = [0] * (len(BUCKETS) + 1)
+
+    def put(self, duration):
+        """ Add a duration in second
+        """
+        self.count += 1
+        self.total += duration
+        if self.min is None or duration < self.min:
+            self.min = duration
+        if self.max is None or duration > self.max:
+            self.max = duration
+        self.buckets[bisect.bisect_left(BUCKETS, duration)] += 1
+
+    def get_percentile(self, percent):
+        """ Return the upper bound of the bucket holding the percentile
+        """
+        if self.count == 0:
+            return None
+        rank = self.count * percent / 100.0
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            seen += count
+            if seen >= rank:
+                if index == len(BUCKETS):
+                    return self.max
+                return min(BUCKETS[index], self.max)
+        return self.max
+
+    def get_report(self):
+        """ Return count, mean, min, max, p50, p90 and p99 in second
+        """
+        return {"count": self.count,
+                "mean": self.total / self.count if self.count else None,
+                "min": self.min,
+                "max": self.max,
+                "p50": self.get_percentile(50),
+                "p90": self.get_percentile(90),
+                "p99": self.get_percentile(99)}
+
+
+class BusLoadMeter(can.Listener):
+    """ BusLoadMeter counts the frames and bits seen on a bus
+        The bus load is estimated from the nominal length of the frames
+        (without bit stuffing) and the bitrate, on average and over the
+        busiest second.
+    """
+
+    def __init__(self, bitrate=None):
+        """Instanciate a BusLoadMeter object
+        Keyword argument:
+        bitrate -- nominal bitrate of the bus, None if unknown
+        """
+        self.bitrate = float(bitrate) if bitrate not in (None, 'None') \
+            else None
+        self.start = time.monotonic()
+        self.frames = 0
+        self.bits = 0
+        self.window_start = self.start
+        self.window_bits = 0
+        self.peak_bits = 0
+
+    @staticmethod
+    def frame_bits(msg):
+        """ Return the nominal number of bits of a frame
+        """
+        data_bits = 8 * len(msg.data)
+        if msg.is_extended_id:
+            return 67 + data_bits
+        return 47 + data_bits
+
+    def on_message_received(self, msg):
+        now = time.monotonic()
+        bits = self.frame_bits(msg)
+        self.frames += 1
+        self.bits += bits
+        if now - self.window_start >= 1.0:
+            self.peak_bits = max(self.peak_bits, self.window_bits)
+            self.window_start = now
+            self.window_bits = 0
+        self.window_bits += bits
+
+    def get_report(self, received_frames=None):
+        """ Return the frame rates and the bus load in percent
+        Keyword argument:
+        received_frames -- frames read by the library, the others are
+                           counted as sent (default unknown)
+        """
+        duration = max(time.monotonic() - self.start, 1e-9)
+        report = {"duration": duration,
+                  "frames": self.frames,
+                  "frames_per_second": self.frames / duration,
+                  "bus_load": None,
+                  "peak_bus_load": None}
+        if received_frames is not None:
+            sent_frames = max(0, self.frames - received_frames)
+            report["rx_frames_per_second"] = received_frames / duration
+            report["tx_frames_per_second"] = sent_frames / duration
+        if self.bitrate:
+            report["bus_load"] = 100.0 * self.bits / duration / self.bitrate
+            report["peak_bus_load"] = max(
+                report["bus_load"],
+                100.0 * max(self.peak_bits, self.window_bits) / self.bitrate)
+        return report
+
+
+class Metrics:
+    """ Metrics gathers the latencies and counters of the library
+        It also holds the log level gating the messages printed by the
+        keywords.
+    """
+
+    def __init__(self):
+        """Instanciate a Metrics object
+        """
+        self.lock = threading.Lock()
+        self.latencies = {}
+        self.counters = {}
+        self.level = LEVELS["INFO"]
+
+    def observe(self, name, duration):
+        """ Add a duration in second to the histogram name
+        """
+        with self.lock:
+            stats = self.latencies.get(name)
+            if stats is None:
+                stats = LatencyStats()
+                self.latencies[name] = stats
+            stats.put(duration)
+
+    def count(self, name, value=1):
+        """ Add value to the counter name
+        """
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def set_level(self, level):
+        """ Set the lowest level printed (TRACE, DEBUG, INFO, WARN, NONE)
+        """
+        if level.upper() not in LEVELS:
+            raise AssertionError("Log level must be one of: %s" %
+                                 (", ".join(LEVELS)))
+        self.level = LEVELS[level.upper()]
+
+    def log(self, level, *values):
+        """ Print values if level is enabled
+        """
+        if LEVELS[level] >= self.level:
+            print(*values)
+
+    def get_report(self):
+        """ Return the latency histograms and the counters
+        """
+        with self.lock:
+            return {"latencies": {name: stats.get_report() for name, stats
+                                  in sorted(self.latencies.items())},
+                    "counters": dict(self.counters)}
+
+    def reset(self):
+        """ Forget every latency and counter
+        """
+        with self.lock:
+            self.latencies.clear()
+            self.counters.clear()
+
+
+class KeywordTimer:
+    """ KeywordTimer is a Robot Framework listener recording the duration
+        of each keyword in the metrics
+    """
+    ROBOT_LISTENER_API_VERSION = 2
+
+    def end_keyword(self, name, attributes):
+        metrics.observe("keyword " + name, attributes["elapsedtime"] / 1000.0)
+
+
+# Shared by every Curf instance of the process
+metrics = Metrics()
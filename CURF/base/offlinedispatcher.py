@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+import json
+import os
+
+import can
+
+from framedispatcher import FrameDispatcher
+
+
+def read_log(path):
+    """ Generate the frames of a log file readable by can.LogReader
+    (blf, asc, log, csv, ... optionally gzipped)
+    """
+    reader = can.LogReader(path)
+    try:
+        for msg in reader:
+            yield msg
+    finally:
+        reader.stop()
+
+
+def read_segment(index_path, test_name):
+    """ Generate the frames recorded by LogWriter for a test case
+    Keyword arguments:
+    index_path -- path of the <base_name>_index.json file
+    test_name -- name of the test case (its last segment is read)
+    """
+    with open(index_path) as index_file:
+        segments = [segment for segment in json.load(index_file)
+                    if segment["test"] == test_name]
+    if not segments:
+        raise AssertionError("No segment of test %s in %s" %
+                             (test_name, index_path))
+    segment = segments[-1]
+    directory = os.path.dirname(index_path)
+    remaining = segment["frames"]
+    for part in segment["parts"]:
+        path = os.path.join(directory, os.path.basename(part["file"]))
+        for number, msg in enumerate(read_log(path)):
+            if remaining <= 0:
+                return
+            if number < part["first_frame"]:
+                continue
+            remaining -= 1
+            yield msg
+
+
+class OfflineDispatcher(FrameDispatcher):
+    """ OfflineDispatcher feeds the check keywords from a recorded log
+        Frames are read one at a time from a generator, only when a check
+        waits for them, so the memory footprint does not depend on the
+        size of the log. The clock is the timestamp of the last frame
+        read: a timeout elapses in log time, not in wall time.
+    """
+
+    def __init__(self, frames, buffer_size=1000):
+        """Instanciate an OfflineDispatcher object
+        Keyword arguments:
+        frames -- iterable of can.Message in time order (see read_log)
+        buffer_size -- size of each ring buffer (default 1000)
+        """
+        FrameDispatcher.__init__(self, buffer_size)
+        # A log may start at timestamp 0
+        self.stamp_frames = False
+        self.frames = iter(frames)
+        self.pending = None
+        self.clock = None
+        self.exhausted = False
+
+    def _next_frame(self):
+        if self.pending is not None:
+            msg, self.pending = self.pending, None
+            return msg
+        if self.exhausted:
+            return None
+        for msg in self.frames:
+            if not msg.is_error_frame:
+                return msg
+        self.exhausted = True
+        return None
+
+    def now(self):
+        """ Return the log time
+        """
+        if self.clock is None:
+            msg = self._next_frame()
+            if msg is None:
+                return 0.0
+            self.pending = msg
+            self.clock = msg.timestamp
+        return self.clock
+
+    def frame_time(self):
+        """ Return the log time, frames are stamped by the log
+        """
+        return self.now()
+
+    def wait_for(self, predicate, timeout=None):
+        """ Read frames until predicate() is True or timeout elapses in
+        log time
+        """
+        result = predicate()
+        if result:
+            return result
+        deadline = None if timeout is None else self.now() + timeout
+        while not result:
+            msg = self._next_frame()
+            if msg is None:
+                if deadline is not None:
+                    self.clock = max(self.clock, deadline)
+                return predicate()
+            if deadline is not None and msg.timestamp > deadline:
+                # Kept for the next check
+                self.pending = msg
+                self.clock = deadline
+                return predicate()
+            self.clock = msg.timestamp
+            self.on_message_received(msg)
+            result = predicate()
+        return result
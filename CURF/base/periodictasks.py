@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+import can
+
+
+class PeriodicTask:
+    """ PeriodicTask is a named cyclic transmission of a frame
+    """
+
+    def __init__(self, name, msg, period, task):
+        self.name = name
+        self.msg = msg
+        self.period = period
+        self.task = task
+
+    def __str__(self):
+        return "%s: ID 0x%X period %gs data %s" % (
+            self.name, self.msg.arbitration_id, self.period,
+            bytes(self.msg.data).hex().upper())
+
+
+class PeriodicTasks:
+    """ PeriodicTasks keeps the cyclic transmissions of a bus by name
+        Tasks use the cyclic transmission of the interface when it has
+        one, else the threaded scheduler of python-can. The payload of a
+        running task is changed in place without a gap in the cycle.
+    """
+
+    def __init__(self, bus):
+        """Instanciate a PeriodicTasks object
+        Keyword argument:
+        bus -- python-can bus sending the frames
+        """
+        self.bus = bus
+        self.tasks = {}
+
+    def start(self, name, msg, period):
+        """ Start the task name, or update it if it is already running
+        with the same ID and period
+        """
+        task = self.tasks.get(name)
+        if task is not None:
+            if task.period == period and \
+                    task.msg.arbitration_id == msg.arbitration_id:
+                self.modify(name, msg)
+                return task
+            self.stop(name)
+        cyclic_task = self.bus.send_periodic(msg, period, store_task=True)
+        task = PeriodicTask(name, msg, period, cyclic_task)
+        self.tasks[name] = task
+        return task
+
+    def modify(self, name, msg):
+        """ Change the payload sent by a running task
+        """
+        task = self.get(name)
+        if isinstance(task.task, can.ModifiableCyclicTaskABC) and \
+                len(msg.data) == len(task.msg.data):
+            task.task.modify_data(msg)
+            task.msg = msg
+        else:
+            # The interface can not change the payload of a running task
+            self.stop(name)
+            self.start(name, msg, task.period)
+
+    def get(self, name):
+        """ Return the task name, raise AssertionError if unknown
+        """
+        task = self.tasks.get(name)
+        if task is None:
+            raise AssertionError("Periodic task : %s is not running" % (name))
+        return task
+
+    def stop(self, name):
+        """ Stop the task name
+        """
+        task = self.get(name)
+        task.task.stop()
+        del self.tasks[name]
+
+    def stop_all(self):
+        """ Stop every periodic task of the bus
+        """
+        self.bus.stop_all_periodic_tasks()
+        self.tasks.clear()
+
+    def names(self):
+        """ Return the names of the running tasks
+        """
+        return list(self.tasks)
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+import math
+
+
+class PeriodStats:
+    """ PeriodStats computes the period statistics of a cyclic frame
+        from the frame timestamps in constant memory.
+        Mean and standard deviation use the Welford update, percentiles
+        come from a fixed size histogram of the intervals relative to the
+        reference period.
+    """
+
+    def __init__(self, expected_period=None, bins=1000, max_ratio=4.0):
+        """Instanciate a PeriodStats object
+        Keyword arguments:
+        expected_period -- expected period in second, used to count the
+                           missed cycles and as histogram reference
+                           (default first measured interval)
+        bins -- number of histogram bins (default 1000)
+        max_ratio -- histogram upper bound relative to the reference
+                     period (default 4.0)
+        """
+        self.expected_period = expected_period
+        self.reference = expected_period
+        self.bins = bins
+        self.max_ratio = max_ratio
+        self.histogram = [0] * (bins + 1)
+        self.last_timestamp = None
+        self.count = 0
+        self.frames = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = None
+        self.max = None
+        self.missed = 0
+
+    def put(self, timestamp):
+        """ Add a frame timestamp in second
+        """
+        self.frames += 1
+        if self.last_timestamp is None:
+            self.last_timestamp = timestamp
+            return
+        interval = timestamp - self.last_timestamp
+        self.last_timestamp = timestamp
+        self.count += 1
+        delta = interval - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (interval - self.mean)
+        if self.min is None or interval < self.min:
+            self.min = interval
+        if self.max is None or interval > self.max:
+            self.max = interval
+        if self.expected_period:
+            cycles = int(round(interval / self.expected_period))
+            if cycles > 1:
+                self.missed += cycles - 1
+        if not self.reference:
+            self.reference = interval
+        if self.reference > 0:
+            index = int(interval / self.reference / self.max_ratio *
+                        self.bins)
+            self.histogram[min(max(index, 0), self.bins)] += 1
+
+    def get_average(self):
+        """ Return the mean period, None without interval
+        """
+        return self.mean if self.count else None
+
+    def get_std(self):
+        """ Return the standard deviation of the period
+        """
+        if self.count < 2:
+            return 0.0
+        return math.sqrt(self.m2 / (self.count - 1))
+
+    def get_percentile(self, percent):
+        """ Return the given percentile of the period, None without interval
+        The precision is the width of a histogram bin
+        """
+        if not self.count:
+            return None
+        rank = float(percent) / 100 * self.count
+        total = 0
+        for index, value in enumerate(self.histogram):
+            total += value
+            if total >= rank and value:
+                if index == self.bins:
+                    return self.max
+                width = self.reference * self.max_ratio / self.bins
+                return min(max((index + 0.5) * width, self.min), self.max)
+        return self.max
+
+    def get_report(self):
+        """ Return the statistics as a dictionary
+        """
+        return {"frames": self.frames,
+                "mean": self.get_average(),
+                "std": self.get_std(),
+                "min": self.min,
+                "max": self.max,
+                "p50": self.get_percentile(50),
+                "p99": self.get_percentile(99),
+                "missed": self.missed}
@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+import abc
+import re
+
+from bytepattern import compile_pattern
+from framedispatcher import frame_key, message_key, parse_frame_id
+from signalhistory import same_value
+
+_WINDOW = re.compile(r"^(\d*\.?\d*)\.\.(\d*\.?\d*)$")
+
+
+class IsotpReassembler:
+    """ IsotpReassembler rebuilds the ISO-TP PDUs from the frames of an
+        address, without sending flow controls (the IsotpLink of the
+        address does)
+    """
+
+    def __init__(self, address):
+        """Instanciate an IsotpReassembler object
+        Keyword argument:
+        address -- isotp.Address of the link
+        """
+        self.address = address
+        self.prefix = address.get_rx_prefix_size()
+        self.data = None
+        self.length = 0
+
+    def put(self, msg):
+        """ Add a frame, return the PDU it completes or None
+        """
+        if not self.address.is_for_me(msg):
+            return None
+        data = bytes(msg.data[self.prefix:])
+        if not data:
+            return None
+        frame_type = data[0] >> 4
+        if frame_type == 0:
+            length = data[0] & 0x0F
+            if length == 0 and len(data) > 1:
+                # CAN FD single frame
+                return data[2:2 + data[1]]
+            return data[1:1 + length]
+        if frame_type == 1:
+            self.length = ((data[0] & 0x0F) << 8) | data[1]
+            header = 2
+            if self.length == 0:
+                # More than 4095 bytes
+                self.length = int.from_bytes(data[2:6], "big")
+                header = 6
+            self.data = bytearray(data[header:])
+        elif frame_type == 2 and self.data is not None:
+            self.data += data[1:]
+            if len(self.data) >= self.length:
+                pdu = bytes(self.data[:self.length])
+                self.data = None
+                return pdu
+        return None
+
+
+class SequenceStep(abc.ABC):
+    """ SequenceStep is one step of a sequence: an expected frame, signal
+        value or diagnostic response, or a frame or request to send, with
+        its delay window from the previous step
+    """
+
+    def __init__(self, text, kind, ids, min_delay, max_delay):
+        self.text = text
+        self.kind = kind
+        # Keys of the IDs the step waits for, see frame_key()
+        self.ids = ids
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        # Last compared data, for the failure report
+        self.last = None
+
+    def is_action(self):
+        return self.kind in ("SEND", "REQUEST")
+
+    def get_deadline(self, reference):
+        """ Return the timestamp the step must be fulfilled by
+        Keyword argument:
+        reference -- timestamp of the previous step
+        """
+        return reference + self.max_delay
+
+    @abc.abstractmethod
+    def match(self, msg):
+        """ Return True if the frame fulfills the step
+        """
+
+
+class FrameStep(SequenceStep):
+
+    def __init__(self, text, key, pattern, min_delay, max_delay):
+        SequenceStep.__init__(self, text, "FRAME", [key], min_delay,
+                              max_delay)
+        self.key = key
+        self.pattern = pattern
+
+    def match(self, msg):
+        if (msg.arbitration_id, msg.is_extended_id) != self.key:
+            return False
+        self.last = bytes(msg.data).hex().upper()
+        return self.pattern is None or \
+            self.pattern.match(bytes(msg.data)) is not None
+
+
+class SignalStep(SequenceStep):
+
+    def __init__(self, text, message, signal_name, value, min_delay,
+                 max_delay):
+        SequenceStep.__init__(self, text, "SIGNAL", [message_key(message)],
+                              min_delay, max_delay)
+        self.message = message
+        self.signal_name = signal_name
+        self.value = value
+
+    def match(self, msg):
+        if (msg.arbitration_id, msg.is_extended_id) != self.ids[0]:
+            return False
+        value = self.message.decode(msg.data).get(self.signal_name)
+        if value is None:
+            return False
+        self.last = value
+        return same_value(value, self.value)
+
+
+class DiagStep(SequenceStep):
+    """ A response pending (7F xx 78) extends the window of the step to
+        pending_timeout after it, as IsotpLink.wait_response() does
+    """
+
+    def __init__(self, text, reassembler, pattern, min_delay, max_delay,
+                 pending_timeout=5.0):
+        SequenceStep.__init__(
+            self, text, "DIAG",
+            [frame_key(reassembler.address.get_rx_arbitration_id(),
+                       reassembler.address.is_rx_29bits())],
+            min_delay, max_delay)
+        self.reassembler = reassembler
+        self.pattern = pattern
+        self.pending_timeout = pending_timeout
+        # Timestamp of the last response pending
+        self.pending_at = None
+
+    def get_deadline(self, reference):
+        deadline = reference + self.max_delay
+        if self.pending_at is not None:
+            deadline = max(deadline, self.pending_at + self.pending_timeout)
+        return deadline
+
+    def match(self, msg):
+        pdu = self.reassembler.put(msg)
+        if pdu is None:
+            return False
+        self.last = pdu.hex().upper()
+        if len(pdu) >= 3 and pdu[0] == 0x7F and pdu[2] == 0x78 and \
+                self.pattern.match(pdu) is None:
+            self.pending_at = msg.timestamp
+            return False
+        return self.pattern.match(pdu) is not None
+
+
+class ActionStep(SequenceStep):
+
+    def __init__(self, text, kind, data, key=None):
+        SequenceStep.__init__(self, text, kind, [], 0.0, 0.0)
+        self.data = data
+        # Key of the ID of a SEND step
+        self.key = key
+
+    def match(self, msg):
+        # Sent by the check, never received
+        return False
+
+
+def parse_step(text, db_index=None, address=None, timeout=5.0,
+               pending_timeout=5.0):
+    """ Return the SequenceStep of a step written as:
+    FRAME <ID> [<data pattern>] [<min>..<max>]
+    SIGNAL <name> <value> [<min>..<max>]
+    DIAG <response pattern> [<min>..<max>]
+    SEND <ID> <data>
+    REQUEST <diagnostic request>
+    The delays are in second from the previous step (the start of the
+    sequence for the first one), the default window is 0..timeout.
+    IDs are read by parse_frame_id(): 00000123 is extended, 123 standard.
+    Patterns are BytePattern (62 F1 90 *, 01??, ...). A DIAG step
+    answered by a response pending (7F xx 78) waits pending_timeout more.
+    Keyword arguments:
+    db_index -- DatabaseIndex for the SIGNAL steps
+    address -- isotp.Address of the ISO-TP link for the DIAG steps
+    timeout -- default maximum delay in second
+    pending_timeout -- delay after a response pending in second (P2*)
+    """
+    tokens = text.split()
+    if not tokens:
+        raise AssertionError("Empty sequence step")
+    kind = tokens[0].upper()
+    min_delay, max_delay = 0.0, float(timeout)
+    window = _WINDOW.match(tokens[-1]) if len(tokens) > 1 else None
+    if window is not None and kind not in ("SEND", "REQUEST"):
+        tokens = tokens[:-1]
+        if window.group(1):
+            min_delay = float(window.group(1))
+        if window.group(2):
+            max_delay = float(window.group(2))
+    if kind == "FRAME" and len(tokens) >= 2:
+        pattern = " ".join(tokens[2:])
+        return FrameStep(text, parse_frame_id(tokens[1]),
+                         None if pattern in ("", "ANY")
+                         else compile_pattern(pattern),
+                         min_delay, max_delay)
+    if kind == "SIGNAL" and len(tokens) == 3:
+        if db_index is None:
+            raise AssertionError("Step %s: no database" % (text))
+        message = db_index.message_by_signal(tokens[1])
+        if message is None:
+            raise AssertionError('Signal : %s was not in database' %
+                                 (tokens[1]))
+        return SignalStep(text, message, db_index.signal_short_name(
+            tokens[1]), tokens[2], min_delay, max_delay)
+    if kind == "DIAG" and len(tokens) >= 2:
+        if address is None:
+            raise AssertionError("Step %s: set_isotp() must be called"
+                                 % (text))
+        return DiagStep(text, IsotpReassembler(address),
+                        compile_pattern(" ".join(tokens[1:])),
+                        min_delay, max_delay, float(pending_timeout))
+    if kind == "SEND" and len(tokens) == 3:
+        return ActionStep(text, kind, bytes.fromhex(tokens[2]),
+                          parse_frame_id(tokens[1]))
+    if kind == "REQUEST" and len(tokens) >= 2:
+        return ActionStep(text, kind, bytes.fromhex("".join(tokens[1:])))
+    raise AssertionError("Bad sequence step: %s" % (text))
+
+
+class SequenceCheck:
+    """ SequenceCheck is the state machine of a sequence of steps
+        The frames are fed once, in reception order: each one is only
+        compared with the current step, which is fulfilled by the first
+        matching frame received inside its delay window from the previous
+        step. The first step out of its window fails the sequence.
+    """
+
+    def __init__(self, steps, start):
+        """Instanciate a SequenceCheck object
+        Keyword arguments:
+        steps -- SequenceStep list
+        start -- timestamp of the start of the sequence
+        """
+        self.steps = steps
+        self.index = 0
+        self.reference = start
+        self.timeline = []
+        self.failure = None
+
+    def get_ids(self):
+        """ Return the keys of the IDs the steps wait for
+        """
+        return {key for step in self.steps for key in step.ids}
+
+    def current(self):
+        """ Return the current step, None when the sequence is over
+        """
+        if self.failure is not None or self.index >= len(self.steps):
+            return None
+        return self.steps[self.index]
+
+    def get_deadline(self):
+        """ Return the timestamp the current step must be fulfilled by
+        """
+        return self.current().get_deadline(self.reference)
+
+    def done(self, timestamp):
+        """ Fulfill the current step at timestamp
+        """
+        step = self.current()
+        self.timeline.append({"step": step.text,
+                              "delay": timestamp - self.reference,
+                              "timestamp": timestamp})
+        self.reference = timestamp
+        self.index += 1
+
+    def fail(self, reason):
+        step = self.current()
+        self.failure = "Step %d (%s): %s" % (self.index + 1, step.text,
+                                             reason)
+
+    def put(self, msg):
+        """ Feed a received frame to the current step
+        """
+        step = self.current()
+        if step is None or step.is_action() or msg.is_error_frame or \
+                msg.is_remote_frame or \
+                (msg.arbitration_id, msg.is_extended_id) not in step.ids:
+            return
+        delay = msg.timestamp - self.reference
+        if msg.timestamp > step.get_deadline(self.reference):
+            self.timeout()
+        elif step.match(msg):
+            if step.min_delay > 0 and delay < step.min_delay:
+                self.fail("received after %.6f s, before the minimum "
+                          "delay %g s" % (delay, step.min_delay))
+            else:
+                self.done(msg.timestamp)
+
+    def timeout(self):
+        """ Fail the current step, its window is over
+        """
+        step = self.current()
+        reason = "not received within %g s" % (
+            step.get_deadline(self.reference) - self.reference)
+        if step.last is not None:
+            reason += ", last received: %s" % (step.last)
+        self.fail(reason)
+
+    def get_report(self):
+        """ Return the timeline of the fulfilled steps and the failure
+        """
+        lines = ["%d. %s: +%.6f s" % (index + 1, entry["step"],
+                                      entry["delay"])
+                 for index, entry in enumerate(self.timeline)]
+        if self.failure is not None:
+            lines.append(self.failure)
+        return "\n".join(lines)
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from framedispatcher import message_key
+
+
+class SignalCapture:
+    """ SignalCapture stores the frames of some messages as columns and
+        decodes a signal over the whole capture at once
+        The payloads of a message are packed in one byte array, so a
+        signal is extracted for every frame with a few numpy operations
+        using its start bit, length, byte order, scale and offset.
+        numpy is required.
+    """
+
+    def __init__(self, messages):
+        """Instanciate a SignalCapture object
+        Keyword argument:
+        messages -- cantools messages to capture
+        """
+        if numpy is None:
+            raise AssertionError("numpy is required for the captures: "
+                                 "pip install numpy")
+        # Messages, timestamps and payloads by key, see frame_key()
+        self.messages = {message_key(message): message
+                         for message in messages}
+        self.timestamps = {key: [] for key in self.messages}
+        self.payloads = {key: bytearray() for key in self.messages}
+        self.columns = {}
+
+    def put(self, msg):
+        """ Add a received frame
+        """
+        key = (msg.arbitration_id, msg.is_extended_id)
+        message = self.messages.get(key)
+        if message is None or msg.is_error_frame or msg.is_remote_frame:
+            return
+        data = bytes(msg.data)
+        if len(data) != message.length:
+            data = data[:message.length].ljust(message.length, b"\0")
+        self.timestamps[key].append(msg.timestamp)
+        self.payloads[key] += data
+        self.columns.pop(key, None)
+
+    def get_frames_count(self):
+        """ Return the number of captured frames by message name
+        """
+        return {message.name: len(self.timestamps[key])
+                for key, message in self.messages.items()}
+
+    def _get_raw(self, message):
+        """ Return the timestamps and the payloads of a message as one
+        unsigned integer per frame, in little and big endian order
+        """
+        key = message_key(message)
+        columns = self.columns.get(key)
+        if columns is None:
+            count = len(self.timestamps[key])
+            data = numpy.frombuffer(bytes(self.payloads[key]),
+                                    dtype=numpy.uint8)
+            data = data.reshape(count, message.length).astype(numpy.uint64)
+            little = numpy.zeros(count, dtype=numpy.uint64)
+            big = numpy.zeros(count, dtype=numpy.uint64)
+            for index in range(message.length):
+                little |= data[:, index] << numpy.uint64(8 * index)
+                big |= data[:, index] << numpy.uint64(
+                    8 * (message.length - 1 - index))
+            columns = (numpy.array(self.timestamps[key]), little, big)
+            self.columns[key] = columns
+        return columns
+
+    def _extract(self, message, signal):
+        """ Return the raw values of a signal for every frame
+        """
+        timestamps, little, big = self._get_raw(message)
+        if signal.byte_order == "little_endian":
+            shift = signal.start
+            raw = little
+        else:
+            # Position of the most significant bit counted from the first
+            # bit of the frame
+            msb = 8 * (signal.start // 8) + 7 - signal.start % 8
+            shift = 8 * message.length - msb - signal.length
+            raw = big
+        mask = numpy.uint64((1 << signal.length) - 1)
+        return (raw >> numpy.uint64(shift)) & mask
+
+    def decode(self, message, signal):
+        """ Return the timestamps and the physical values of a signal
+        Frames where a multiplexed signal is not present are skipped.
+        """
+        if message.length > 8:
+            raise AssertionError("Message : %s is longer than 8 bytes"
+                                 % (message.name))
+        timestamps = self._get_raw(message)[0]
+        raw = self._extract(message, signal)
+        if signal.multiplexer_ids:
+            multiplexer = message.get_signal_by_name(
+                signal.multiplexer_signal)
+            selected = numpy.isin(self._extract(message, multiplexer),
+                                  signal.multiplexer_ids)
+            timestamps = timestamps[selected]
+            raw = raw[selected]
+        if signal.is_float:
+            float_type = numpy.float32 if signal.length == 32 \
+                else numpy.float64
+            int_type = numpy.uint32 if signal.length == 32 else numpy.uint64
+            values = raw.astype(int_type).view(float_type).astype(
+                numpy.float64)
+        elif signal.is_signed:
+            values = raw.astype(numpy.int64)
+            if signal.length < 64:
+                sign = 1 << (signal.length - 1)
+                values = numpy.where(values >= sign,
+                                     values - (1 << signal.length), values)
+            values = values.astype(numpy.float64)
+        else:
+            values = raw.astype(numpy.float64)
+        return timestamps, values * signal.scale + signal.offset
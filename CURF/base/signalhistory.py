@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+from framedispatcher import message_key
+
+
+def numeric(value):
+    """ Return the number of a decoded value (choices are named values)
+    """
+    return getattr(value, "value", value)
+
+
+class SignalHistory:
+    """ SignalHistory reads the signal values from the frames a
+        FrameDispatcher keeps, without consuming them
+        The dispatcher keeps the raw last frame of every ID and the last
+        frames of the watched messages. Frames are only decoded when a
+        value is asked for, and the last decoded frame of each message is
+        cached. Waiting on a signal keeps the history of its message and
+        decodes each new frame once, outside the dispatcher lock.
+    """
+
+    def __init__(self, dispatcher, history_size=100):
+        """Instanciate a SignalHistory object
+        Keyword arguments:
+        dispatcher -- FrameDispatcher of the bus
+        history_size -- number of frames kept by watched message
+        """
+        self.dispatcher = dispatcher
+        self.history_size = history_size
+        # Last decoded frame and its values by message key
+        self.decoded = {}
+
+    def watch(self, message):
+        """ Keep the last frames of a message from now on
+        """
+        return self.dispatcher.watch(message_key(message), self.history_size)
+
+    def _decode(self, message, msg):
+        cached = self.decoded.get(message_key(message))
+        if cached is not None and cached[0] is msg:
+            return cached[1]
+        values = message.decode(msg.data)
+        self.decoded[message_key(message)] = (msg, values)
+        return values
+
+    def get_latest(self, message, signal_name):
+        """ Return the last received frame of a message holding the
+        signal and the signal value, None if not received
+        """
+        msg = self.dispatcher.latest.get(message_key(message))
+        if msg is None or msg.is_error_frame or msg.is_remote_frame:
+            return None
+        values = self._decode(message, msg)
+        if signal_name not in values:
+            # Multiplexed signal absent of this frame
+            return None
+        return msg, values[signal_name]
+
+    def get_history(self, message, signal_name):
+        """ Return the timestamps and values of the signal in the watched
+        frames, oldest first
+        """
+        history = self.watch(message)
+        with self.dispatcher.condition:
+            frames = list(history)
+        values = []
+        for msg in frames:
+            if msg.is_error_frame or msg.is_remote_frame:
+                continue
+            decoded = message.decode(msg.data)
+            if signal_name in decoded:
+                values.append((msg.timestamp, decoded[signal_name]))
+        return values
+
+    def _new_frames(self, history, checked, timeout):
+        """ Yield the frames added to a history after the frame checked,
+        until timeout elapses
+        Every frame is yielded, even when several arrive between two
+        wakeups, and outside the dispatcher lock so that decoding does
+        not block the reader thread.
+        """
+        dispatcher = self.dispatcher
+        end_time = dispatcher.now() + float(timeout)
+        new_frames = []
+
+        def received():
+            del new_frames[:]
+            for msg in reversed(history):
+                if msg is checked:
+                    break
+                new_frames.append(msg)
+            return len(new_frames) > 0
+
+        while True:
+            with dispatcher.condition:
+                if not dispatcher.wait_for(
+                        received, max(0.0, end_time - dispatcher.now())):
+                    return
+                frames = list(reversed(new_frames))
+            checked = frames[-1]
+            for msg in frames:
+                yield msg
+
+    def wait(self, message, signal_name, predicate, timeout=0):
+        """ Return the first signal value for which predicate(value) is
+        True, the current value first, or None if timeout elapses
+        """
+        history = self.watch(message)
+        with self.dispatcher.condition:
+            checked = history[-1] if history else None
+        latest = self.get_latest(message, signal_name)
+        if latest is not None and predicate(latest[1]):
+            return latest[1]
+        for msg in self._new_frames(history, checked, timeout):
+            if msg.is_error_frame or msg.is_remote_frame:
+                continue
+            value = message.decode(msg.data).get(signal_name)
+            if value is not None and predicate(value):
+                return value
+        return None
+
+    def wait_change(self, message, signal_name, reference=None, timeout=0):
+        """ Return the first value different from reference received
+        after the call, None if timeout elapses
+        The current value is returned at once if it differs from a given
+        reference.
+        Keyword arguments:
+        reference -- value to compare with (default the current value)
+        """
+        if reference is None:
+            latest = self.get_latest(message, signal_name)
+            if latest is None:
+                # The first value received is a change
+                return self.wait(message, signal_name, lambda value: True,
+                                 timeout)
+            reference = latest[1]
+        return self.wait(message, signal_name,
+                         lambda value: not same_value(value, reference),
+                         timeout)
+
+
+def same_value(value, expect_value):
+    """ Return True if a decoded value equals an expected value given as
+    a choice name or a number
+    """
+    if str(value) == str(expect_value):
+        return True
+    try:
+        return float(numeric(value)) == float(numeric(expect_value))
+    except (TypeError, ValueError):
+        return False
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+
+
+class SignalState:
+    """ SignalState keeps the last value of each signal of the sent
+        messages so that a message can be encoded from a partial update
+        without resetting its other signals.
+    """
+
+    def __init__(self):
+        """Instanciate a SignalState object
+        """
+        self.values = {}
+
+    @staticmethod
+    def default_value(signal):
+        """ Return the value of a signal never set: its initial value,
+        else 0 kept inside its minimum/maximum
+        """
+        if signal.initial is not None:
+            return signal.initial
+        value = 0
+        if signal.minimum is not None and value < signal.minimum:
+            value = signal.minimum
+        if signal.maximum is not None and value > signal.maximum:
+            value = signal.maximum
+        return value
+
+    def get_values(self, message):
+        """ Return the current signal values of a message
+        """
+        values = self.values.get(message.name)
+        if values is None:
+            values = {signal.name: self.default_value(signal)
+                      for signal in message.signals}
+            self.values[message.name] = values
+        return values
+
+    def encode(self, message, updates):
+        """ Update the signal values of a message and return its payload
+        Keyword arguments:
+        message -- cantools message
+        updates -- dictionary of the signal values to change
+        """
+        values = self.get_values(message)
+        values.update(updates)
+        if message.is_multiplexed() and hasattr(message, "gather_signals"):
+            # Only the signals of the selected multiplexer values
+            return message.encode(message.gather_signals(values))
+        return message.encode(values)
+
+    def reset(self, message_name=None):
+        """ Forget the values of a message (default every message)
+        """
+        if message_name is None:
+            self.values.clear()
+        else:
+            self.values.pop(message_name, None)
@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+import os
+import threading
+import time
+
+import isotp
+
+# Services whose sub-function may ask to suppress the positive response
+_SUPPRESSIBLE = (0x10, 0x11, 0x3E)
+
+
+def default_key(seed, key_constant=0):
+    """ Return the key of a seed: the seed plus a constant on 4 bytes
+    Same "dumb" algorithm as the Get Seedkey keyword.
+    """
+    key = (int.from_bytes(seed, "big") + key_constant) & 0xFFFFFFFF
+    return key.to_bytes(4, "big")
+
+
+class SimulatedEcu:
+    """ SimulatedEcu answers UDS requests on its own ISO-TP stack
+        It stands for a real ECU in loopback tests: a background thread
+        reads the requests and sends the responses found in a table of
+        request prefixes, or built from the DIDs and DTCs it holds for the
+        services 0x10, 0x11, 0x14, 0x19, 0x22, 0x27, 0x3E, 0x34, 0x36 and
+        0x37. Other requests are refused with NRC 0x11.
+        A service can answer with NRCs 0x78 (response pending) for some
+        time before its response. A non default session ends after
+        s3_timeout without request.
+    """
+
+    def __init__(self, bus, address, params=None, key_function=None,
+                 max_block_length=0x0FFF, s3_timeout=5.0):
+        """Instanciate a SimulatedEcu object
+        Keyword arguments:
+        bus -- python-can bus of the ECU, shut down by stop()
+        address -- isotp.Address of the ECU (rxid is the tester txid)
+        params -- isotp parameters of the stack (stmin, blocksize, ...)
+        key_function -- function returning the key of a seed and a
+                        security level (default default_key)
+        max_block_length -- maxNumberOfBlockLength of RequestDownload
+        s3_timeout -- time in second without request after which a non
+                      default session falls back to the default one
+        """
+        self.bus = bus
+        self.address = address
+        stack_params = {"stmin": 0, "blocksize": 0}
+        stack_params.update(params or {})
+        self.stack = isotp.CanStack(bus, address=address,
+                                    params=stack_params)
+        self.key_function = key_function or \
+            (lambda seed, level: default_key(seed))
+        self.max_block_length = max_block_length
+        # Responses by request prefix, None for no response
+        self.responses = {}
+        self.prefix_lengths = []
+        self.dids = {}
+        self.dtcs = {}
+        # Response pending delay in second by service
+        self.pending = {}
+        self.pending_interval = 2.0
+        self.session = 0x01
+        self.s3_timeout = s3_timeout
+        self.last_request = None
+        self.seed = None
+        self.security_level = 0
+        self.block_counter = None
+        self.downloaded = 0
+        self.stats = {"requests": 0, "responses": 0, "pending": 0,
+                      "negative": 0}
+        self.running = False
+        self.thread = None
+        self.handlers = {0x10: self._session_control,
+                         0x11: self._ecu_reset,
+                         0x14: self._clear_dtc,
+                         0x19: self._read_dtc,
+                         0x22: self._read_did,
+                         0x27: self._security_access,
+                         0x3E: self._tester_present,
+                         0x34: self._request_download,
+                         0x36: self._transfer_data,
+                         0x37: self._request_transfer_exit}
+
+    def set_response(self, request, response):
+        """ Answer the requests starting with request by response
+        Keyword arguments:
+        request -- request prefix in bytes
+        response -- response in bytes, None for no response
+        """
+        self.responses[bytes(request)] = response
+        self.prefix_lengths = sorted({len(prefix) for prefix
+                                      in self.responses}, reverse=True)
+
+    def set_did(self, did, value):
+        """ Set the value in bytes of a DID read by ReadDataByIdentifier
+        """
+        self.dids[did] = bytes(value)
+
+    def set_dtc(self, dtc, status):
+        """ Set the status of a DTC read by ReadDTCInformation
+        """
+        self.dtcs[dtc] = status
+
+    def set_pending(self, service, delay):
+        """ Send NRC 0x78 during delay second before answering a service
+        """
+        if delay:
+            self.pending[service] = delay
+        else:
+            self.pending.pop(service, None)
+
+    def start(self):
+        """ Start the ISO-TP stack and the responder thread
+        """
+        if self.running:
+            return
+        self.running = True
+        self.stack.start()
+        self.thread = threading.Thread(target=self._run, daemon=True,
+                                       name="SimulatedEcu %s" %
+                                       (self.address,))
+        self.thread.start()
+
+    def stop(self):
+        """ Stop the responder thread and shut the bus down
+        """
+        if not self.running:
+            return
+        self.running = False
+        self.thread.join()
+        self.stack.stop()
+        self.bus.shutdown()
+
+    def get_stats(self):
+        """ Return the request and response counters
+        """
+        return dict(self.stats, downloaded_bytes=self.downloaded,
+                    session=self.session, security_level=self.security_level)
+
+    def _run(self):
+        while self.running:
+            request = self.stack.recv(block=True, timeout=0.1)
+            if not request:
+                continue
+            self.stats["requests"] += 1
+            self._check_s3()
+            delay = self.pending.get(request[0])
+            if delay:
+                self._wait_pending(request[0], delay)
+            response = self.respond(bytes(request))
+            if response is not None:
+                if response[0] == 0x7F:
+                    self.stats["negative"] += 1
+                self.stats["responses"] += 1
+                self.stack.send(response)
+
+    def _check_s3(self):
+        now = time.monotonic()
+        if self.session != 0x01 and self.last_request is not None and \
+                now - self.last_request > self.s3_timeout:
+            self.session = 0x01
+            self.security_level = 0
+        self.last_request = now
+
+    def _wait_pending(self, service, delay):
+        end = time.monotonic() + delay
+        remaining = delay
+        while remaining > 0 and self.running:
+            self.stack.send(bytes((0x7F, service, 0x78)))
+            self.stats["pending"] += 1
+            time.sleep(min(remaining, self.pending_interval))
+            remaining = end - time.monotonic()
+
+    def respond(self, request):
+        """ Return the response to a request, None for no response
+        """
+        for length in self.prefix_lengths:
+            if request[:length] in self.responses:
+                return self.responses[request[:length]]
+        handler = self.handlers.get(request[0])
+        if handler is None:
+            return self._negative(request, 0x11)
+        if request[0] in _SUPPRESSIBLE and len(request) > 1 and \
+                request[1] & 0x80:
+            handler(request)
+            return None
+        return handler(request)
+
+    @staticmethod
+    def _negative(request, nrc):
+        return bytes((0x7F, request[0], nrc))
+
+    def _session_control(self, request):
+        if len(request) != 2:
+            return self._negative(request, 0x13)
+        self.session = request[1] & 0x7F
+        self.security_level = 0
+        # P2 50 ms, P2* 5 s
+        return bytes((0x50, self.session, 0x00, 0x32, 0x01, 0xF4))
+
+    def _ecu_reset(self, request):
+        if len(request) != 2:
+            return self._negative(request, 0x13)
+        self.session = 0x01
+        self.security_level = 0
+        return bytes((0x51, request[1] & 0x7F))
+
+    def _clear_dtc(self, request):
+        if len(request) != 4:
+            return self._negative(request, 0x13)
+        group = int.from_bytes(request[1:4], "big")
+        if group == 0xFFFFFF:
+            self.dtcs.clear()
+        else:
+            self.dtcs.pop(group, None)
+        return b"\x54"
+
+    def _read_dtc(self, request):
+        if len(request) < 2:
+            return self._negative(request, 0x13)
+        sub_function = request[1]
+        if sub_function in (0x01, 0x02):
+            if len(request) != 3:
+                return self._negative(request, 0x13)
+            dtcs = [(dtc, status) for dtc, status in self.dtcs.items()
+                    if status & request[2]]
+            if sub_function == 0x01:
+                return bytes((0x59, 0x01, 0xFF, 0x01)) + \
+                    len(dtcs).to_bytes(2, "big")
+        elif sub_function == 0x0A:
+            dtcs = sorted(self.dtcs.items())
+        else:
+            return self._negative(request, 0x12)
+        return bytes((0x59, sub_function, 0xFF)) + b"".join(
+            dtc.to_bytes(3, "big") + bytes((status,))
+            for dtc, status in dtcs)
+
+    def _read_did(self, request):
+        if len(request) < 3 or len(request) % 2 == 0:
+            return self._negative(request, 0x13)
+        response = bytearray(b"\x62")
+        for index in range(1, len(request), 2):
+            did = int.from_bytes(request[index:index + 2], "big")
+            value = self.dids.get(did)
+            if value is None:
+                return self._negative(request, 0x31)
+            response += request[index:index + 2] + value
+        return bytes(response)
+
+    def _security_access(self, request):
+        if len(request) < 2:
+            return self._negative(request, 0x13)
+        level = request[1]
+        if level % 2:
+            if self.security_level == level:
+                # Already unlocked: the seed is zero
+                return bytes((0x67, level)) + bytes(4)
+            self.seed = (level, os.urandom(4))
+            return bytes((0x67, level)) + self.seed[1]
+        if self.seed is None or self.seed[0] != level - 1:
+            return self._negative(request, 0x24)
+        seed, self.seed = self.seed[1], None
+        if request[2:] != self.key_function(seed, level - 1):
+            return self._negative(request, 0x35)
+        self.security_level = level - 1
+        return bytes((0x67, level))
+
+    def _tester_present(self, request):
+        if len(request) != 2:
+            return self._negative(request, 0x13)
+        return bytes((0x7E, request[1] & 0x7F))
+
+    def _request_download(self, request):
+        if len(request) < 4:
+            return self._negative(request, 0x13)
+        self.block_counter = 1
+        return b"\x74\x20" + self.max_block_length.to_bytes(2, "big")
+
+    def _transfer_data(self, request):
+        if self.block_counter is None:
+            return self._negative(request, 0x24)
+        if len(request) < 2:
+            return self._negative(request, 0x13)
+        if request[1] != self.block_counter:
+            return self._negative(request, 0x73)
+        self.block_counter = (self.block_counter + 1) & 0xFF
+        self.downloaded += len(request) - 2
+        return bytes((0x76, request[1]))
+
+    def _request_transfer_exit(self, request):
+        if self.block_counter is None:
+            return self._negative(request, 0x24)
+        self.block_counter = None
+        return b"\x77"
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+""" Micro-benchmark of the CAN database lookups
+Compare the former linear search on db.messages with the DatabaseIndex
+tables for databases of growing size.
+
+Usage: python3 benchmarks/bench_db_lookup.py (from the CURF directory)
+"""
+import os
+import sys
+import timeit
+
+from cantools.database.can import Database, Message, Signal
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "base"))
+from dbindex import DatabaseIndex  # noqa: E402
+
+
+def make_database(nb_messages, signals_per_message=8):
+    """ Return a synthetic database with nb_messages messages
+    """
+    messages = []
+    for i in range(nb_messages):
+        signals = [Signal(name="SIG_%d_%d" % (i, j), start=j * 8, length=8)
+                   for j in range(signals_per_message)]
+        messages.append(Message(frame_id=i, name="MSG_%d" % i, length=8,
+                                is_extended_frame=True, signals=signals))
+    return Database(messages=messages)
+
+
+def linear_lookup(db, signal_name):
+    for message in db.messages:
+        for signal in message.signals:
+            if signal_name == signal.name:
+                return message.name
+    return None
+
+
+def main():
+    number = 2000
+    print("%10s %10s %16s %16s" % ("messages", "signals",
+                                   "linear (us)", "indexed (us)"))
+    for nb_messages in (10, 100, 1000, 5000):
+        db = make_database(nb_messages)
+        index = DatabaseIndex(db)
+        # Worst case for the linear search: last signal of the database
+        target = "SIG_%d_7" % (nb_messages - 1)
+        linear = timeit.timeit(lambda: linear_lookup(db, target),
+                               number=number // 10 or 1) / (number // 10)
+        indexed = timeit.timeit(lambda: index.message_by_signal(target),
+                                number=number) / number
+        print("%10d %10d %16.2f %16.3f" % (nb_messages, nb_messages * 8,
+                                           linear * 1e6, indexed * 1e6))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+""" Compare the ISO-TP throughput of IsotpLink parameter sets on the
+virtual bus
+
+A loopback ECU using the same parameters answers each 4095 bytes request
+with a 4095 bytes response. The benchmark reports the payload rate of both
+directions for classic CAN frames with several block sizes and separation
+times, and for 64 bytes CAN FD frames.
+
+Usage: python3 benchmarks/bench_isotp_params.py (from the CURF directory)
+"""
+import os
+import sys
+import threading
+import time
+
+import can
+import isotp
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "base"))
+from framedispatcher import FrameDispatcher  # noqa: E402
+from isotplink import IsotpLink  # noqa: E402
+
+CHANNEL = "bench_isotp_params"
+REQUESTS = 10
+SIZE = 4095
+PARAMS = [
+    ("classic bs=0 stmin=0", {"blocksize": 0, "stmin": 0}),
+    ("classic bs=8 stmin=0", {"blocksize": 8, "stmin": 0}),
+    ("classic bs=8 stmin=1", {"blocksize": 8, "stmin": 1}),
+    ("fd 64 bs=0 stmin=0", {"blocksize": 0, "stmin": 0, "can_fd": True,
+                            "tx_data_length": 64}),
+]
+
+
+def ecu(bus, params, stop):
+    address = isotp.Address(isotp.AddressingMode.Normal_11bits,
+                            rxid=0x7E0, txid=0x7E8)
+    stack = isotp.CanStack(bus, address=address, params=params)
+    stack.start()
+    while not stop.is_set():
+        request = stack.recv(block=True, timeout=0.1)
+        if request is not None:
+            stack.send(bytes([request[0] + 0x40]) + bytes(SIZE - 1))
+    stack.stop()
+
+
+def run(params):
+    bus = can.Bus(interface="virtual", channel=CHANNEL)
+    ecu_bus = can.Bus(interface="virtual", channel=CHANNEL)
+    dispatcher = FrameDispatcher()
+    notifier = can.Notifier(bus, [dispatcher])
+    address = isotp.Address(isotp.AddressingMode.Normal_11bits,
+                            rxid=0x7E8, txid=0x7E0)
+    link = IsotpLink(bus, dispatcher, address, params=params)
+    link.start()
+    stop = threading.Event()
+    peer = threading.Thread(target=ecu, args=(ecu_bus, params, stop))
+    peer.start()
+    request = bytes([0x36]) + bytes(SIZE - 1)
+    start = time.perf_counter()
+    for i in range(REQUESTS):
+        link.send(request)
+        data = link.recv(5)
+        assert data is not None and len(data) == SIZE
+    wall = time.perf_counter() - start
+    stop.set()
+    peer.join()
+    link.close()
+    notifier.stop()
+    bus.shutdown()
+    ecu_bus.shutdown()
+    return wall
+
+
+def main():
+    print("%22s %12s %14s" % ("parameters", "wall (s)", "rate (kB/s)"))
+    for name, params in PARAMS:
+        wall = run(params)
+        print("%22s %12.2f %14.1f" % (
+            name, wall, 2 * REQUESTS * SIZE / wall / 1000))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+""" Compare the ISO-TP receive modes of IsotpLink on the virtual bus
+busy  -- former loop on process()/available() until the timeout
+event -- background thread blocking on the dispatcher until a frame arrives
+
+A loopback ECU answers each request after a delay with a NRC 0x78
+(response pending) and then the positive response. The benchmark reports
+the process CPU time spent while waiting and the latency between the
+positive response being sent and the PDU being returned.
+
+Usage: python3 benchmarks/bench_isotp_rx.py (from the CURF directory)
+"""
+import os
+import sys
+import threading
+import time
+
+import can
+import isotp
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "base"))
+from framedispatcher import FrameDispatcher  # noqa: E402
+from isotplink import IsotpLink  # noqa: E402
+
+CHANNEL = "bench_isotp_rx"
+REQUESTS = 20
+DELAY = 0.1
+
+
+def ecu(bus, stop, sent_at):
+    address = isotp.Address(isotp.AddressingMode.Normal_11bits,
+                            rxid=0x7E0, txid=0x7E8)
+    stack = isotp.CanStack(bus, address=address)
+    while not stop.is_set():
+        stack.process()
+        if stack.available():
+            request = stack.recv()
+            time.sleep(DELAY / 2)
+            stack.send(bytes([0x7F, request[0], 0x78]))
+            time.sleep(DELAY / 2)
+            stack.send(bytes([request[0] + 0x40]) + bytes(62))
+            sent_at.append(time.perf_counter())
+        time.sleep(0.001)
+
+
+def receive(link):
+    while True:
+        data = link.recv(3)
+        if data is None or not (data[0] == 0x7F and data[2] == 0x78):
+            return data
+
+
+def run(mode):
+    bus = can.Bus(interface="virtual", channel=CHANNEL)
+    ecu_bus = can.Bus(interface="virtual", channel=CHANNEL)
+    dispatcher = FrameDispatcher()
+    notifier = can.Notifier(bus, [dispatcher])
+    address = isotp.Address(isotp.AddressingMode.Normal_11bits,
+                            rxid=0x7E8, txid=0x7E0)
+    link = IsotpLink(bus, dispatcher, address)
+    if mode == "event":
+        link.start()
+    stop = threading.Event()
+    sent_at = []
+    peer = threading.Thread(target=ecu, args=(ecu_bus, stop, sent_at))
+    peer.start()
+    latencies = []
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    for i in range(REQUESTS):
+        link.send(bytes([0x22, 0xF1, 0x87]))
+        data = receive(link)
+        latencies.append(time.perf_counter() - sent_at[-1])
+        assert data is not None and data[0] == 0x62
+    cpu = time.process_time() - cpu_start
+    wall = time.perf_counter() - wall_start
+    stop.set()
+    peer.join()
+    link.close()
+    notifier.stop()
+    bus.shutdown()
+    ecu_bus.shutdown()
+    return cpu, wall, latencies
+
+
+def main():
+    print("%6s %12s %10s %16s %16s" % ("mode", "wall (s)", "cpu (%)",
+                                       "mean lat. (ms)", "max lat. (ms)"))
+    for mode in ("busy", "event"):
+        cpu, wall, latencies = run(mode)
+        print("%6s %12.2f %10.1f %16.3f %16.3f" % (
+            mode, wall, 100 * cpu / wall,
+            1000 * sum(latencies) / len(latencies), 1000 * max(latencies)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+""" Compare the decoding of a signal over a capture
+frame  -- cantools message.decode() called for each frame
+column -- SignalCapture decoding the signal for every frame at once
+
+Both decode the multiplexed SENSOR_SONARS_left signal of the example
+database from the same random frames and the results are compared.
+
+Usage: python3 benchmarks/bench_signal_decode.py (from the CURF directory)
+"""
+import os
+import random
+import sys
+import time
+
+import can
+import cantools
+import numpy
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "base"))
+from signalcapture import SignalCapture  # noqa: E402
+
+FRAMES = 100000
+SIGNAL = "SENSOR_SONARS_left"
+
+
+def main():
+    db = cantools.database.load_file(
+        os.path.join(os.path.dirname(__file__), "..", "dbc", "Example.dbc"))
+    message = db.get_message_by_name("SENSOR_SONARS")
+    signal = message.get_signal_by_name(SIGNAL)
+    random.seed(0)
+    frames = []
+    for index in range(FRAMES):
+        data = bytearray(random.getrandbits(8) for _ in range(8))
+        data[0] &= 0xF1
+        frames.append(can.Message(timestamp=index * 0.01,
+                                  arbitration_id=message.frame_id,
+                                  is_extended_id=message.is_extended_frame,
+                                  data=data))
+    capture = SignalCapture([message])
+    for msg in frames:
+        capture.put(msg)
+
+    start = time.perf_counter()
+    expected = []
+    for msg in frames:
+        signals = message.decode(msg.data, decode_choices=False)
+        if SIGNAL in signals:
+            expected.append(signals[SIGNAL])
+    frame_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    values = capture.decode(message, signal)[1]
+    column_time = time.perf_counter() - start
+
+    assert numpy.allclose(values, expected)
+    print("%8s %12s" % ("method", "time (ms)"))
+    print("%8s %12.1f" % ("frame", 1000 * frame_time))
+    print("%8s %12.1f" % ("column", 1000 * column_time))
+    print("speedup %.0fx on %d frames" % (frame_time / column_time, FRAMES))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+""" Benchmark suite of Curf on the python-can virtual interface
+
+Measures the keyword rates (send_frame, send_signal, check_frame), the
+accuracy of check_period, the ISO-TP round trip time and bulk throughput
+against a loopback ISO-TP peer, and the set_can setup time with a large
+database.
+
+The results are written to outputs/benchmarks/<date>.json and compared
+with a JSON baseline: the run fails when a result is worse than the
+baseline by more than the threshold.
+
+Usage (from the CURF directory):
+    python3 benchmarks/run_benchmarks.py --save        # record a baseline
+    python3 benchmarks/run_benchmarks.py               # compare with it
+    python3 benchmarks/run_benchmarks.py --threshold 30 --only isotp
+"""
+import argparse
+import datetime
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+import can
+import isotp
+from cantools.database.can import Database, Message, Node, Signal
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+CURF_DIR = os.path.dirname(BENCHMARKS_DIR)
+sys.path.insert(0, os.path.join(CURF_DIR, "base"))
+from Curf import Curf  # noqa: E402
+from dbcache import database_cache  # noqa: E402
+from metrics import metrics  # noqa: E402
+
+EXAMPLE_DB = os.path.join(CURF_DIR, "dbc", "Example.dbc")
+CHANNEL = "run_benchmarks"
+
+
+def higher_is_better(name):
+    """ Rates are better when higher, durations and errors when lower
+    """
+    return name.endswith("per_second")
+
+
+def open_curf(db=EXAMPLE_DB, test_name="benchmark"):
+    curf = Curf()
+    curf.set_can("virtual", CHANNEL, 500000, db, test_name)
+    return curf
+
+
+def bench_send_frame(count=5000):
+    curf = open_curf()
+    start = time.perf_counter()
+    for _ in range(count):
+        curf.send_frame("123", "0102030405060708")
+    duration = time.perf_counter() - start
+    curf.end_can()
+    return {"send_frame_per_second": count / duration}
+
+
+def bench_send_signal(count=2000):
+    curf = open_curf()
+    start = time.perf_counter()
+    for index in range(count):
+        curf.send_signal("MOTOR_CMD_drive", str(index % 10))
+    duration = time.perf_counter() - start
+    curf.end_can()
+    return {"send_signal_per_second": count / duration}
+
+
+def bench_check_frame(count=1000):
+    curf = open_curf()
+    peer = can.Bus(interface="virtual", channel=CHANNEL)
+    stop = threading.Event()
+
+    def send():
+        # check_frame ignores the frames received before the call
+        msg = can.Message(arbitration_id=0x5D3, is_extended_id=False,
+                          data=b"\x01")
+        while not stop.is_set():
+            peer.send(msg)
+            time.sleep(0.0001)
+
+    sender = threading.Thread(target=send)
+    sender.start()
+    start = time.perf_counter()
+    for index in range(count):
+        curf.check_frame("5D3", "01", 1)
+    duration = time.perf_counter() - start
+    stop.set()
+    sender.join()
+    peer.shutdown()
+    curf.end_can()
+    return {"check_frame_per_second": count / duration}
+
+
+def bench_check_period(period=0.01, count=100):
+    curf = open_curf()
+    peer = can.Bus(interface="virtual", channel=CHANNEL)
+    stop = threading.Event()
+
+    def send():
+        start = time.perf_counter()
+        index = 0
+        while not stop.is_set():
+            index += 1
+            remaining = start + index * period - time.perf_counter()
+            if remaining > 0:
+                time.sleep(remaining)
+            peer.send(can.Message(arbitration_id=0x190, is_extended_id=False,
+                                  data=bytes(3)))
+
+    sender = threading.Thread(target=send)
+    sender.start()
+    curf.check_period("190", period, count)
+    stop.set()
+    sender.join()
+    peer.shutdown()
+    curf.end_can()
+    stats = curf.period_stats
+    return {"check_period_error_percent":
+            100 * abs(stats.get_average() - period) / period,
+            "check_period_jitter_ms": 1000 * stats.get_std()}
+
+
+def loopback_peer(stop, ready):
+    """ ISO-TP peer answering each request with a response of the same
+    size, its first byte being the positive response SID
+    """
+    bus = can.Bus(interface="virtual", channel=CHANNEL)
+    address = isotp.Address(isotp.AddressingMode.Normal_11bits,
+                            rxid=0x7E0, txid=0x7E8)
+    stack = isotp.CanStack(bus, address=address,
+                           params={"stmin": 0, "blocksize": 0})
+    stack.start()
+    ready.set()
+    while not stop.is_set():
+        request = stack.recv(block=True, timeout=0.1)
+        if request is not None:
+            stack.send(bytes([request[0] + 0x40]) + bytes(request[1:]))
+    stack.stop()
+    bus.shutdown()
+
+
+def bench_isotp(count=50, sizes=(64, 512, 4095)):
+    curf = open_curf()
+    stop = threading.Event()
+    ready = threading.Event()
+    peer = threading.Thread(target=loopback_peer, args=(stop, ready))
+    peer.start()
+    ready.wait()
+    curf.set_isotp("7E0", "7E8", "Normal_11bits")
+    link = curf.isotp_link
+    results = {}
+    round_trips = []
+    for _ in range(count):
+        start = time.perf_counter()
+        link.send(bytes.fromhex("22F190"))
+        assert link.recv(2) is not None
+        round_trips.append(time.perf_counter() - start)
+    results["isotp_round_trip_ms"] = 1000 * statistics.median(round_trips)
+    for size in sizes:
+        data = bytes([0x36]) + bytes(size - 1)
+        repetitions = max(3, count * 64 // size)
+        start = time.perf_counter()
+        for _ in range(repetitions):
+            link.send(data)
+            assert len(link.recv(5)) == size
+        duration = time.perf_counter() - start
+        results["isotp_%d_bytes_per_second" % (size)] = \
+            2 * size * repetitions / duration
+    stop.set()
+    peer.join()
+    curf.end_can()
+    return results
+
+
+def make_database(path, nb_messages=2000, signals_per_message=8):
+    """ Write a DBC file of nb_messages messages
+    """
+    messages = []
+    for i in range(nb_messages):
+        signals = [Signal(name="SIG_%d_%d" % (i, j), start=j * 8, length=8)
+                   for j in range(signals_per_message)]
+        messages.append(Message(frame_id=i, name="MSG_%d" % i, length=8,
+                                senders=["ECU"], is_extended_frame=True,
+                                signals=signals))
+    with open(path, "w") as dbc_file:
+        dbc_file.write(Database(messages=messages, nodes=[Node("ECU")])
+                       .as_dbc_string())
+
+
+def bench_set_can(workdir):
+    path = os.path.join(workdir, "large.dbc")
+    make_database(path)
+    database_cache.clear()
+    curf = Curf()
+    curf.set_database_disk_cache(True)
+    start = time.perf_counter()
+    curf.set_can("virtual", CHANNEL, 500000, path, "cold")
+    cold = time.perf_counter() - start
+    curf.end_can()
+    database_cache.clear()
+    start = time.perf_counter()
+    curf.set_can("virtual", CHANNEL, 500000, path, "disk")
+    disk = time.perf_counter() - start
+    curf.end_can()
+    start = time.perf_counter()
+    curf.set_can("virtual", CHANNEL, 500000, path, "memory")
+    memory = time.perf_counter() - start
+    curf.end_can()
+    return {"set_can_cold_ms": 1000 * cold,
+            "set_can_disk_cache_ms": 1000 * disk,
+            "set_can_memory_cache_ms": 1000 * memory}
+
+
+BENCHMARKS = [
+    ("send_frame", bench_send_frame),
+    ("send_signal", bench_send_signal),
+    ("check_frame", bench_check_frame),
+    ("check_period", bench_check_period),
+    ("isotp", bench_isotp),
+    ("set_can", bench_set_can),
+]
+
+
+def compare(results, baseline, threshold):
+    """ Return the lines of the comparison and the regressions
+    """
+    lines = []
+    regressions = []
+    for name, value in results.items():
+        base = baseline.get(name)
+        if not base:
+            lines.append("%34s %14.3f %14s" % (name, value, "-"))
+            continue
+        if higher_is_better(name):
+            regression = 100 * (base - value) / base
+        else:
+            regression = 100 * (value - base) / base
+        mark = ""
+        if regression > threshold:
+            mark = " REGRESSION"
+            regressions.append(name)
+        lines.append("%34s %14.3f %14.3f %+8.1f%%%s" %
+                     (name, value, base, -regression, mark))
+    return lines, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--baseline",
+                        default=os.path.join(BENCHMARKS_DIR,
+                                             "baseline.json"),
+                        help="baseline JSON file")
+    parser.add_argument("--threshold", type=float, default=20.0,
+                        help="allowed regression in percent (default 20)")
+    parser.add_argument("--save", action="store_true",
+                        help="save the results as the baseline")
+    parser.add_argument("--only", action="append",
+                        help="run only this benchmark (repeatable)")
+    args = parser.parse_args()
+
+    metrics.set_level("NONE")
+    workdir = tempfile.mkdtemp()
+    os.makedirs(os.path.join(workdir, "outputs"))
+    database_cache.cache_dir = os.path.join(workdir, "outputs", "dbcache")
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    results = {}
+    try:
+        for name, bench in BENCHMARKS:
+            if args.only and name not in args.only:
+                continue
+            print("running %s" % (name), file=sys.stderr)
+            if bench is bench_set_can:
+                results.update(bench(workdir))
+            else:
+                results.update(bench())
+        Curf().release_can_buses()
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir)
+
+    output_dir = os.path.join(cwd, "outputs", "benchmarks")
+    os.makedirs(output_dir, exist_ok=True)
+    output = os.path.join(output_dir, datetime.datetime.now().strftime(
+        "%Y%m%d_%H%M%S.json"))
+    with open(output, "w") as output_file:
+        json.dump(results, output_file, indent=1)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+    print("%34s %14s %14s %9s" % ("benchmark", "result", "baseline",
+                                  "change"))
+    lines, regressions = compare(results, baseline, args.threshold)
+    print("\n".join(lines))
+    print("results written to %s" % (output))
+    if args.save:
+        baseline.update(results)
+        with open(args.baseline, "w") as baseline_file:
+            json.dump(baseline, baseline_file, indent=1, sort_keys=True)
+        print("baseline saved to %s" % (args.baseline))
+    elif regressions:
+        sys.exit("%d regression(s) above %g%%: %s" %
+                 (len(regressions), args.threshold, ", ".join(regressions)))
+
+
+if __name__ == "__main__":
+    main()
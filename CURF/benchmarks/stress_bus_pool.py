@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+""" Stress the set_can/end_can cycle of Curf on the virtual interface
+Runs CYCLES test setups and teardowns and prints the number of open file
+descriptors and threads along the way: both must stay flat.
+
+Usage: python3 benchmarks/stress_bus_pool.py [CYCLES] (from the CURF
+directory)
+"""
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "base"))
+from Curf import Curf  # noqa: E402
+
+
+def open_fds():
+    try:
+        return len(os.listdir("/proc/self/fd"))
+    except OSError:
+        return -1
+
+
+def main():
+    cycles = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    db = os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                      "..", "dbc", "Example.dbc"))
+    workdir = tempfile.mkdtemp()
+    os.makedirs(os.path.join(workdir, "outputs"))
+    os.chdir(workdir)
+    samples = []
+    start = time.perf_counter()
+    try:
+        for i in range(cycles):
+            # Robot creates a new library instance for each test case
+            curf = Curf()
+            curf.set_can("virtual", "stress_bus_pool", 500000, db,
+                         "cycle%d" % i)
+            curf.set_isotp("7E0", "7E8", "Normal_11bits")
+            curf.end_can()
+            if i % (cycles // 10 or 1) == 0 or i == cycles - 1:
+                samples.append((i + 1, open_fds(), threading.active_count()))
+        elapsed = time.perf_counter() - start
+        curf.release_can_buses()
+    finally:
+        os.chdir("/")
+        shutil.rmtree(workdir)
+    print("%8s %8s %8s" % ("cycle", "fds", "threads"))
+    for sample in samples:
+        print("%8d %8d %8d" % sample)
+    print("%.2f ms per setup/teardown" % (1000 * elapsed / cycles))
+    print("after release: %d threads" % threading.active_count())
+    if samples[-1][1:] != samples[1][1:]:
+        sys.exit("file descriptors or threads are growing")
+
+
+if __name__ == "__main__":
+    main()